@@ -1,10 +1,31 @@
 #!/usr/bin/env python3
 
+import os
+
 from aws_cdk import core
 
-from cdk_python_k8s_right_way_aws.cdk_python_k8s_right_way_aws_stack import CdkPythonK8SRightWayAwsStack, aws_region, aws_account
+from cdk_python_k8s_right_way_aws.cdk_python_k8s_right_way_aws_stack import aws_region, aws_account, cluster_settings, cluster_stacks
+from cdk_python_k8s_right_way_aws.clusters import cluster_file, load_clusters, shared_lookups
 
 app = core.App()
-CdkPythonK8SRealWayAwsStack(app, "cdk-python-k8s-real-way-aws", env={'account': aws_account, 'region': aws_region})
+
+if os.path.exists(cluster_file):
+    # The stacks of every cluster in clusters.json (only the one selected with -c cluster=<name>, if given)
+    clusters = load_clusters(cluster_file)
+    selected = app.node.try_get_context('cluster')
+    lookups = shared_lookups(clusters)
+    for cluster in clusters:
+        if selected and cluster['name'] != selected:
+            continue
+        settings = cluster_settings(cluster)
+        cluster_stacks(
+            app,
+            "cdk-python-k8s-real-way-aws-" + cluster['name'],
+            lookups=lookups[cluster['name']],
+            cluster=cluster,
+            env={'account': settings['aws_account'], 'region': settings['aws_region']}
+        )
+else:
+    cluster_stacks(app, "cdk-python-k8s-real-way-aws", env={'account': aws_account, 'region': aws_region})
 
 app.synth()
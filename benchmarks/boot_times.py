@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Per-role, per-step bootstrap durations from the step events of the nodes.
+
+Reads the events written by the UserData step_event function, either from
+captured files (/var/log/cloud-init-output.log with BOOTSTRAP_EVENT lines, or
+/var/log/bootstrap-events.log) or from the bootstrap CloudWatch Logs group,
+and prints count, failures and p50/p95/p99 seconds per role and step. The
+'time-to-ready' row is the seconds from boot to the 'ready' event of
+successful bootstraps.
+
+    python benchmarks/boot_times.py cloud-init-output.log ...
+    python benchmarks/boot_times.py --log-group /k8s-the-real-hard-way-aws/bootstrap --hours 24 --json > boot.json
+    python benchmarks/boot_times.py --log-group /k8s-the-real-hard-way-aws/bootstrap --baseline boot.json
+"""
+import argparse
+import json
+import sys
+import time
+
+EVENT_PREFIX = 'BOOTSTRAP_EVENT '
+
+
+def parse_events(lines):
+    """Yield the step events found in lines (raw JSON lines or BOOTSTRAP_EVENT output)."""
+    for line in lines:
+        if EVENT_PREFIX in line:
+            line = line.split(EVENT_PREFIX, 1)[1]
+        line = line.strip()
+        if not line.startswith('{'):
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if 'step' in event and 'start_ms' in event and 'end_ms' in event:
+            yield event
+
+
+def log_group_events(log_group, hours, region=None):
+    """Yield the step events of the last hours from a CloudWatch Logs group."""
+    import boto3
+
+    client = boto3.client('logs', region_name=region)
+    paginator = client.get_paginator('filter_log_events')
+    start_time = int((time.time() - hours * 3600) * 1000)
+    for page in paginator.paginate(logGroupName=log_group, startTime=start_time):
+        yield from parse_events(event['message'] for event in page['events'])
+
+
+def percentile(values, q):
+    """q-th percentile of sorted values, linearly interpolated between the closest ranks."""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(events):
+    """Return {role: {step: {count, failed, p50, p95, p99}}} with durations in seconds."""
+    durations = {}
+    failures = {}
+    seen = set()
+    for event in events:
+        # The same event can be read from several sources
+        key = (event.get('instance_id'), event['step'], event['start_ms'])
+        if key in seen:
+            continue
+        seen.add(key)
+        role = event.get('role', 'unknown')
+        samples = durations.setdefault(role, {})
+        samples.setdefault(event['step'], []).append((event['end_ms'] - event['start_ms']) / 1000.0)
+        if event.get('exit_code', 0) != 0:
+            failures[(role, event['step'])] = failures.get((role, event['step']), 0) + 1
+        elif event['step'] == 'ready' and 'uptime_s' in event:
+            samples.setdefault('time-to-ready', []).append(float(event['uptime_s']))
+
+    summary = {}
+    for role, steps in durations.items():
+        for step_name, values in steps.items():
+            values.sort()
+            summary.setdefault(role, {})[step_name] = {
+                'count': len(values),
+                'failed': failures.get((role, step_name), 0),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+            }
+    return summary
+
+
+def print_table(summary, baseline=None):
+    baseline = baseline or {}
+    header = "{:<10} {:<20} {:>6} {:>6} {:>9} {:>9} {:>9}".format(
+        'role', 'step', 'count', 'failed', 'p50 s', 'p95 s', 'p99 s')
+    if baseline:
+        header += " {:>10} {:>10}".format('p50 delta', 'p95 delta')
+    print(header)
+    for role in sorted(summary):
+        # Slowest steps first, time-to-ready last
+        steps = sorted(summary[role].items(), key=lambda item: (item[0] == 'time-to-ready', -item[1]['p50']))
+        for step_name, stats in steps:
+            row = "{:<10} {:<20} {:>6} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                role, step_name, stats['count'], stats['failed'], stats['p50'], stats['p95'], stats['p99'])
+            previous = baseline.get(role, {}).get(step_name)
+            if previous:
+                row += " {:>+10.1f} {:>+10.1f}".format(stats['p50'] - previous['p50'], stats['p95'] - previous['p95'])
+            print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help='captured cloud-init output or bootstrap event logs')
+    parser.add_argument('--log-group', help='CloudWatch Logs group of the bootstrap step events')
+    parser.add_argument('--hours', type=float, default=24, help='age of the oldest log group events')
+    parser.add_argument('--region', default=None)
+    parser.add_argument('--baseline', help='JSON output of an earlier run to compare p50/p95 against')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    if not args.files and not args.log_group:
+        parser.error('pass event files or --log-group')
+
+    events = []
+    for path in args.files:
+        with open(path, errors='replace') as fp:
+            events.extend(parse_events(fp))
+    if args.log_group:
+        events.extend(log_group_events(args.log_group, args.hours, args.region))
+    if not events:
+        print("no bootstrap step events found", file=sys.stderr)
+        return 1
+
+    summary = summarize(events)
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as fp:
+                baseline = json.load(fp)
+        print_table(summary, baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Cold-import-time benchmark for the stack module.
+
+Every run imports the module in a fresh interpreter with outbound sockets
+disabled, so an import that starts talking to the network fails loudly
+instead of just getting slower.
+
+    python benchmarks/import_time.py --runs 10 --max-seconds 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULE = 'cdk_python_k8s_right_way_aws.cdk_python_k8s_right_way_aws_stack'
+
+# Runs inside the child interpreter: block the network, then import
+IMPORT_SNIPPET = """
+import socket, time
+
+def _no_network(*args, **kwargs):
+    raise RuntimeError('network access during import')
+
+socket.socket.connect = _no_network
+socket.create_connection = _no_network
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def cold_import(module):
+    """Import module in a new interpreter and return (in-process seconds, wall seconds)."""
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SNIPPET.format(module=module)],
+        cwd=PROJECT_DIR,
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True
+    ).stdout
+    return float(output.strip().splitlines()[-1]), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default=MODULE)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='exit non-zero if the median import time exceeds this')
+    args = parser.parse_args()
+
+    import_times, wall_times = zip(*(cold_import(args.module) for _ in range(args.runs)))
+    median = statistics.median(import_times)
+    print("import {}: median {:.3f}s, min {:.3f}s, max {:.3f}s, interpreter wall median {:.3f}s ({} runs)".format(
+        args.module, median, min(import_times), max(import_times), statistics.median(wall_times), args.runs))
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print("median import time {:.3f}s exceeds {:.3f}s".format(median, args.max_seconds))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
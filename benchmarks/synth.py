@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Offline synth benchmark for the stacks of cluster_stacks().
+
+Measures module import, stack construction and app.synth() wall time, peak
+Python memory and template size/resource count summed over the stacks,
+sweeping the worker node count and the number of worker pools. --layout
+picks the stack_layout (default: the configured one). ipify and EC2 are
+replaced by StaticLookups and a botocore Stubber, and the Route53 hosted-zone lookup is
+answered from pre-populated context, so nothing leaves the machine.
+
+    python benchmarks/synth.py --workers 3 30 300 --pools 1 4 16 --repeat 3 --layout layered
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from import_time import MODULE, cold_import  # noqa: E402
+
+ACCOUNT = '123456789012'
+REGION = 'us-east-1'
+ZONE_FQDN = 'k8s.example.com'
+AMI_ID = 'ami-0123456789abcdef0'
+
+# Answer for route53.HostedZone.from_lookup, keyed like the CDK context provider
+HOSTED_ZONE_CONTEXT = {
+    'hosted-zone:account={}:domainName={}:privateZone=false:region={}'.format(ACCOUNT, ZONE_FQDN, REGION): {
+        'Id': '/hostedzone/Z0000000000000000000',
+        'Name': ZONE_FQDN + '.',
+    }
+}
+
+
+def stubbed_session_class(images_per_page=100, pages=3):
+    """Return a boto3 Session subclass whose EC2 clients answer from a botocore Stubber."""
+    import boto3
+    from botocore.stub import ANY, Stubber
+
+    images = [
+        {'ImageId': 'ami-{:017x}'.format(index), 'CreationDate': '2019-01-01T00:00:{:02d}.000Z'.format(index % 60)}
+        for index in range(images_per_page)
+    ]
+
+    class StubbedSession(boto3.session.Session):
+        def client(self, *args, **kwargs):
+            client = super().client(*args, **kwargs)
+            stubber = Stubber(client)
+            for page in range(pages):
+                response = {'Images': images}
+                if page < pages - 1:
+                    response['NextToken'] = str(page + 1)
+                stubber.add_response('describe_images', response, {'Filters': ANY, 'Owners': ANY, 'NextToken': ANY}
+                                     if page else {'Filters': ANY, 'Owners': ANY})
+            stubber.activate()
+            return client
+
+    return StubbedSession
+
+
+def bench_ami_lookup(regions):
+    """Time get_ami_region_map against stubbed EC2 clients for the given regions."""
+    from cdk_python_k8s_right_way_aws import ami_lookup
+
+    original_session = ami_lookup.boto3.session.Session
+    ami_lookup.boto3.session.Session = stubbed_session_class()
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    try:
+        start = time.perf_counter()
+        result = ami_lookup.get_ami_region_map(REGION, regions=regions)
+        elapsed = time.perf_counter() - start
+    finally:
+        ami_lookup.boto3.session.Session = original_session
+    return elapsed, len(result)
+
+
+def worker_pools(worker_count, pool_count):
+    """Split worker_count workers over pool_count worker node pools."""
+    return [
+        {
+            'name': 'worker' if index == 0 else 'worker-{}'.format(index),
+            'role': 'worker',
+            'instance_type': 't3a.small',
+            'min_capacity': worker_count // pool_count + (index < worker_count % pool_count),
+            'max_capacity': worker_count // pool_count + (index < worker_count % pool_count),
+            'desired_capacity': worker_count // pool_count + (index < worker_count % pool_count),
+            'subnet_name': 'Private',
+        }
+        for index in range(pool_count)
+    ]
+
+
+def bench_synth(worker_count, pool_count, layout=None):
+    """Construct and synth the stacks of cluster_stacks() with worker_count workers in pool_count pools.
+
+    layout: the stack_layout, None for the configured one. Return the
+    measurements, template size and resources summed over the stacks.
+    """
+    from aws_cdk import core
+    from cdk_python_k8s_right_way_aws import cdk_python_k8s_right_way_aws_stack as stack_module
+    from cdk_python_k8s_right_way_aws.lookups import StaticLookups
+
+    stack_module.zone_fqdn = ZONE_FQDN
+    node_pools = [pool for pool in stack_module.node_pools if pool['role'] != 'worker']
+    node_pools += worker_pools(worker_count, pool_count)
+
+    layout = layout or stack_module.stack_layout
+    lookups = StaticLookups(ami_region_map={REGION: AMI_ID})
+    tracemalloc.start()
+    start = time.perf_counter()
+    app = core.App(context=HOSTED_ZONE_CONTEXT)
+    stacks = stack_module.cluster_stacks(
+        app, 'benchmark', lookups=lookups, node_pools=node_pools, cluster={'stack_layout': layout},
+        env={'account': ACCOUNT, 'region': REGION})
+    constructed = time.perf_counter()
+    assembly = app.synth()
+    synthesized = time.perf_counter()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    templates = [assembly.get_stack(stack.stack_name).template for stack in stacks.values()]
+    return {
+        'workers': worker_count,
+        'pools': pool_count,
+        'stacks': len(templates),
+        'construct_seconds': constructed - start,
+        'synth_seconds': synthesized - constructed,
+        'peak_python_memory_bytes': peak_memory,
+        'template_bytes': sum(len(json.dumps(template)) for template in templates),
+        'resources': sum(len(template.get('Resources', {})) for template in templates),
+    }
+
+
+def median_run(runs):
+    """Collapse repeated runs into one record holding the median of every measurement."""
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[3, 30, 300])
+    parser.add_argument('--pools', type=int, nargs='+', default=[1])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ami-regions', type=int, default=17,
+                        help='number of stubbed regions for the AMI lookup benchmark')
+    parser.add_argument('--layout', choices=['single', 'layered'],
+                        help='stack_layout to synth (default: the configured stack_layout)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = {
+        'import_seconds': statistics.median(cold_import(MODULE)[0] for _ in range(args.repeat)),
+        'ami_lookup_seconds': bench_ami_lookup(['region-{}'.format(index) for index in range(args.ami_regions)])[0],
+        'synth': [
+            median_run([bench_synth(workers, pools, args.layout) for _ in range(args.repeat)])
+            for workers in args.workers for pools in args.pools if pools <= workers
+        ],
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print("import: {:.3f}s".format(results['import_seconds']))
+    print("ami lookup ({} stubbed regions): {:.3f}s".format(args.ami_regions, results['ami_lookup_seconds']))
+    print("{:>8} {:>6} {:>6} {:>10} {:>10} {:>12} {:>14} {:>10}".format(
+        'workers', 'pools', 'stacks', 'construct', 'synth', 'peak mem', 'template', 'resources'))
+    for run in results['synth']:
+        print("{:>8.0f} {:>6.0f} {:>6.0f} {:>9.3f}s {:>9.3f}s {:>10.1f}MB {:>12.0f}kB {:>10.0f}".format(
+            run['workers'], run['pools'], run['stacks'], run['construct_seconds'], run['synth_seconds'],
+            run['peak_python_memory_bytes'] / 2 ** 20, run['template_bytes'] / 2 ** 10, run['resources']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
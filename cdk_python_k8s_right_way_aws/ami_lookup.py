@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from operator import itemgetter
+
+import boto3
+from botocore.config import Config
+
+# Canonical's AWS account ID (owner of the official Ubuntu AMIs)
+UBUNTU_OWNER = '099720109477'
+
+# Name filter for the most recent Ubuntu Bionic server AMIs
+UBUNTU_NAME_FILTER = 'ubuntu/images/hvm-ssd/ubuntu-bionic-18.04-amd64-server-*'
+
+# Ubuntu image architecture names <=> EC2 architecture filter values
+EC2_ARCHITECTURES = {
+    'amd64': 'x86_64',
+    'arm64': 'arm64',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_key(*parts):
+    return '|'.join(parts)
+
+
+def load_ami_cache(cache_file):
+    """Read the AMI cache file, returning an empty cache if it is missing or unreadable."""
+    try:
+        with open(cache_file) as fp:
+            cache = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_ami_cache(cache_file, entries):
+    """Merge entries into the AMI cache file using an atomic replace.
+
+    The file is re-read right before writing so that concurrent synths only
+    ever add to each other's results, and readers never see a partial file.
+    """
+    cache = load_ami_cache(cache_file)
+    cache.update(entries)
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.ami-cache-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(cache, fp, indent=2, sort_keys=True)
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _cached_value(cache, key, ttl, now):
+    entry = cache.get(key)
+    if not isinstance(entry, dict) or now - entry.get('resolved_at', 0) > ttl:
+        return None
+    return entry.get('value')
+
+
+def ubuntu_name_filter(codename='bionic', version='18.04', architecture='amd64'):
+    """Return the describe_images name filter for Canonical's Ubuntu server AMIs."""
+    return 'ubuntu/images/hvm-ssd/ubuntu-{}-{}-{}-server-*'.format(codename, version, architecture)
+
+
+def image_filters(name_filter, architecture='x86_64'):
+    """Server-side describe_images filters, so only usable HVM/EBS images come back."""
+    return [
+        {'Name': 'name', 'Values': [name_filter]},
+        {'Name': 'architecture', 'Values': [architecture]},
+        {'Name': 'state', 'Values': ['available']},
+        {'Name': 'virtualization-type', 'Values': ['hvm']},
+        {'Name': 'root-device-type', 'Values': ['ebs']},
+    ]
+
+
+def _image_pages(client, filters, owner):
+    """Yield the Images lists of all describe_images result pages."""
+    params = {'Filters': filters, 'Owners': [owner]}
+    # Older botocore releases have no describe_images paginator
+    if client.can_paginate('describe_images'):
+        for page in client.get_paginator('describe_images').paginate(**params):
+            yield page['Images']
+    else:
+        yield client.describe_images(**params)['Images']
+
+
+def _latest_image_id(client, name_filter, owner, architecture='x86_64'):
+    """Return the ImageId of the newest image matching name_filter in the client's region."""
+    newest = None
+    for images in _image_pages(client, image_filters(name_filter, architecture), owner):
+        if not images:
+            continue
+        candidate = max(images, key=itemgetter('CreationDate'))
+        if newest is None or candidate['CreationDate'] > newest['CreationDate']:
+            newest = candidate
+    if newest is None:
+        raise LookupError("no image matches " + name_filter)
+    return newest['ImageId']
+
+
+def get_ami_region_map(home_region, regions=None, max_workers=8, timeout=10,
+                       name_filter=UBUNTU_NAME_FILTER, owner=UBUNTU_OWNER,
+                       architecture='x86_64', cache_file=None, cache_ttl=0, refresh=False):
+    """Resolve the most recent AMI per region, querying all regions concurrently.
+
+    regions=None queries every region returned by describe_regions in home_region.
+    Regions that fail or exceed timeout (seconds) are logged and left out of the
+    returned dict; callers decide whether a missing region is fatal.
+
+    With a cache_file, results younger than cache_ttl (seconds) are served from
+    disk without any AWS call; refresh=True ignores the cached entries.
+    """
+    now = time.time()
+    cache = {} if cache_file is None or refresh else load_ami_cache(cache_file)
+    new_entries = {}
+
+    if regions is None:
+        regions_key = _cache_key('regions', home_region)
+        regions = _cached_value(cache, regions_key, cache_ttl, now)
+
+    ami_region_map = {}
+    missing_regions = None if regions is None else []
+    for region in regions or []:
+        image_id = _cached_value(cache, _cache_key(region, name_filter, owner), cache_ttl, now)
+        if image_id:
+            ami_region_map[region] = image_id
+        else:
+            missing_regions.append(region)
+
+    if missing_regions == []:
+        return ami_region_map
+
+    session = boto3.session.Session()
+    client_config = Config(
+        connect_timeout=timeout,
+        read_timeout=timeout,
+        retries={'max_attempts': 2}
+    )
+
+    if missing_regions is None:
+        home_client = session.client('ec2', region_name=home_region, config=client_config)
+        missing_regions = [region['RegionName'] for region in home_client.describe_regions()['Regions']]
+        new_entries[regions_key] = {'value': missing_regions, 'resolved_at': now}
+
+    # Session.client() is not thread-safe, so build all clients up front and
+    # only share the (thread-safe) clients with the worker pool.
+    clients = {
+        region: session.client('ec2', region_name=region, config=client_config)
+        for region in missing_regions
+    }
+
+    workers = max(1, min(max_workers, len(clients)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(_latest_image_id, client, name_filter, owner, architecture): region
+            for region, client in clients.items()
+        }
+        # Every request is bounded by the client timeouts; the overall deadline
+        # covers retries and queueing behind a full worker pool.
+        deadline = timeout * 2 * (len(futures) // workers + 1)
+        done, not_done = wait(futures, timeout=deadline)
+        for future in done:
+            region = futures[future]
+            try:
+                ami_region_map[region] = future.result()
+                new_entries[_cache_key(region, name_filter, owner)] = {
+                    'value': ami_region_map[region],
+                    'resolved_at': now
+                }
+            except Exception as error:
+                logger.warning("AMI lookup failed for region %s: %s", region, error)
+        for future in not_done:
+            future.cancel()
+            logger.warning("AMI lookup timed out for region %s", futures[future])
+    finally:
+        executor.shutdown(wait=False)
+
+    if cache_file is not None and new_entries:
+        try:
+            save_ami_cache(cache_file, new_entries)
+        except OSError as error:
+            logger.warning("Could not write AMI cache %s: %s", cache_file, error)
+
+    return ami_region_map
@@ -0,0 +1,128 @@
+"""Stage pinned bootstrap binaries locally, so they can be shipped as S3 assets.
+
+Every manifest entry is downloaded once into the staging directory and
+verified against its sha256. Entries without a sha256 in the manifest are
+pinned on first download: the checksum is recorded in the lock file and
+every later staging run (and every node) verifies against it.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_lock(lock_file):
+    try:
+        with open(lock_file) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _stage_one(name, spec, staging_dir, expected):
+    """Download one binary unless a verified copy is already staged; return (path, sha256)."""
+    path = os.path.join(staging_dir, '{}-{}'.format(name, spec['version']))
+    if not os.path.exists(path):
+        logger.info("Downloading %s %s from %s", name, spec['version'], spec['url'])
+        fd, tmp_path = tempfile.mkstemp(dir=staging_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp, urllib.request.urlopen(spec['url']) as response:
+                for chunk in iter(lambda: response.read(1024 * 1024), b''):
+                    fp.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    checksum = _sha256(path)
+    if expected and checksum != expected:
+        os.unlink(path)
+        raise ValueError("Checksum mismatch for {} {}: expected {}, got {}".format(
+            name, spec['version'], expected, checksum))
+    return path, checksum
+
+
+def stage_binaries(manifest, staging_dir, lock_file, max_workers=8):
+    """Download and verify all manifest entries in parallel.
+
+    Returns name => {'path': staged file, 'sha256': checksum}.
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    lock = _load_lock(lock_file)
+
+    def expected_checksum(name, spec):
+        locked = lock.get(name, {})
+        if locked.get('version') == spec['version'] and locked.get('url') == spec['url']:
+            return spec.get('sha256') or locked.get('sha256')
+        return spec.get('sha256')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(_stage_one, name, spec, staging_dir, expected_checksum(name, spec))
+            for name, spec in manifest.items()
+        }
+        staged = {}
+        for name, future in futures.items():
+            path, checksum = future.result()
+            staged[name] = {'path': path, 'sha256': checksum}
+
+    new_lock = {
+        name: {'version': spec['version'], 'url': spec['url'], 'sha256': staged[name]['sha256']}
+        for name, spec in manifest.items()
+    }
+    if new_lock != {name: lock.get(name) for name in manifest}:
+        _write_atomic(lock_file, dict(lock, **new_lock))
+    return staged
+
+
+def install_commands(binaries, install_dir='/usr/local/bin', owner=None):
+    """UserData commands fetching binaries from S3 in parallel and verifying their checksums.
+
+    binaries is a list of dicts with name, s3_uri, sha256 and optionally archive
+    (a .tar.gz whose files are extracted into install_dir).
+    """
+    if not binaries:
+        return []
+    download_dir = '/tmp/bootstrap-binaries'
+    downloads = " & ".join(
+        "aws s3 cp --quiet " + binary['s3_uri'] + " " + download_dir + "/" + binary['name'] for binary in binaries)
+    checksums = " ".join("'{}  {}/{}'".format(binary['sha256'], download_dir, binary['name']) for binary in binaries)
+    commands = [
+        "mkdir -p " + download_dir,
+        "{ " + downloads + " & wait; }",
+        "printf '%s\\n' " + checksums + " | sha256sum -c --quiet",
+    ]
+    for binary in binaries:
+        target = install_dir + "/" + binary['name']
+        if binary.get('archive'):
+            commands.append(
+                "tar -xzf " + download_dir + "/" + binary['name'] + " -C " + install_dir
+                + " --strip-components=1 --wildcards '*/" + binary['name'] + "*'")
+        else:
+            commands.append("install -m 0755 " + download_dir + "/" + binary['name'] + " " + target)
+        if owner:
+            commands.append("chown " + owner + " " + target)
+    return commands
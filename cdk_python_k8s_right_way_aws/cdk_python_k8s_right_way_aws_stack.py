@@ -2,15 +2,29 @@ from aws_cdk import (
     aws_autoscaling as autoscaling,
     aws_ec2 as ec2,
     aws_elasticloadbalancing as elb,
+    aws_elasticloadbalancingv2 as elbv2,
     aws_route53 as route53,
+    aws_s3 as s3,
+    aws_s3_assets as s3_assets,
     aws_route53_targets as route53_targets,
     aws_iam as iam,
     core,
 )
 
-from requests import get
-import boto3
-from operator import itemgetter
+import os
+
+from .binaries import install_commands, stage_binaries
+from .etcd_backup import BACKUP_SCRIPT, backup_bucket, backup_environment, backup_install_commands, restore_command
+from .golden_ami import GoldenAmi
+from .launch_template import use_hibernation, use_launch_template, use_mixed_instances
+from .lookups import Lookups
+from .node_registration import NodeRegistration
+from .observability import ClusterObservability, add_bootstrap_log_group, cloudwatch_agent_commands, etcd_disk_commands
+from .pod_cidr import pod_cidr_fragment, validate_pod_cidr
+from .scaling import add_scaling_policies
+from .security_rules import applicable_rules, compile_rules, rule_counts, validate_rules
+from .userdata import compile_user_data, data_volume_step, step
+from .warm_pool import add_warm_pool, validate_warm_pool
 
 # ---------------------------------------------------------
 # TODO
@@ -19,6 +33,9 @@ from operator import itemgetter
 # Configuration Variables
 # ---------------------------------------------------------
 
+# Project directory (next to cdk.json)
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # Global Tags applied to all resources
 # Project Tag
 tag_project = 'k8s-the-real-hard-way-aws'
@@ -26,30 +43,164 @@ tag_project = 'k8s-the-real-hard-way-aws'
 # Owner Tag (your name)
 tag_owner = 'napo.io'
 
+# Prefix of the physical names of ASGs, LoadBalancers and the bastion record
+# (clusters in clusters.json default to '<name>-', so they can share an account)
+resource_name_prefix = ''
+
+# Stack layout of a cluster
+# 'single': everything in one stack (keeps existing single-stack deployments in place)
+# 'layered': a network stack plus one stack per node layer (bastion, etcd, control-plane and each worker
+#   pool), connected by cross-stack references, so layers deploy concurrently and on their own
+#   (new clusters only, see "Layered stacks" in the README for moving an existing cluster)
+stack_layout = 'single'
+
 # AWS account
 aws_account = ''
 
 # AWS region
 aws_region = 'us-east-1'
 
-# Get your workstation IPv4 address
-myipv4 = get('https://api.ipify.org').text + "/32"
-
 # Configure your AWS key pair name here
 ssh_key_pair = ''
 
 # Set VPC CIDR
 vpc_cidr = '10.5.0.0/16'
 
+# VPC gateway endpoints (S3, DynamoDB) routed from the subnets, bypassing the NAT gateways
+# Example: ['s3', 'dynamodb']
+vpc_gateway_endpoints = []
+
+# VPC interface endpoints with private DNS in the private subnets, reachable from all nodes
+# Example: ['ec2', 'elasticloadbalancing', 'sts', 'ecr.api', 'ecr.dkr', 'ssm', 'monitoring', 'logs']
+vpc_interface_endpoints = []
+
 # FQDN of the hosted zone to create Route53 records in
 # Example: test.example.com
 zone_fqdn = ''
 
+# Maintain Route53 A records <instance-id>.<zone_fqdn> with the private IPs of the etcd, master
+# and worker nodes (ASG lifecycle hooks, registered in batches by one Lambda function)
+node_registration = False
+
+# TTL in seconds of the node records
+node_record_ttl = 60
+
 # Flannel CNI CIDR
 # flannel_cidr = '10.244.0.0/16'
 
-# Pod CIDR range, exported as POD_CIDR in Worker nodes UserData
-pod_cidr = '10.200'
+# Pod CIDR range, each worker gets one block of it exported as POD_CIDR in its UserData
+# (derived from the node's private IP, so it must hold one block per worker subnet address)
+pod_cidr_block = '10.200.0.0/14'
+
+# Size of the pod CIDR block per worker node
+pod_cidr_node_mask = 24
+
+# Placement group strategy per node role: None, 'cluster' (lowest latency, single AZ, no burstable instances),
+# 'spread' (distinct hardware) or 'partition' (distinct racks per partition)
+placement_strategies = {
+    'etcd': None,
+    'master': None,
+}
+
+# Number of partitions of 'partition' placement groups
+placement_partition_count = 3
+
+# Keep etcd and master nodes in the same first N Availability Zones (None: all)
+control_plane_azs = None
+
+# Instance type presets with ENA enhanced networking (select with a pool's instance_preset)
+ena_instance_presets = {
+    'burstable': 't3a.medium',
+    'balanced': 'm5.large',
+    'network': 'm5n.large',
+    'compute': 'c5n.large',
+    'memory': 'r5n.large',
+}
+
+# Autoscaling policies of the worker node pools (None: fixed size)
+# Example (raise worker_max_capacity above worker_min_capacity to let it act):
+# worker_scaling = {
+#     'cpu_target': 60,
+#     'network_in_target': 50 * 1024 * 1024,
+#     'step_metric': {
+#         'namespace': 'Kubernetes',
+#         'metric_name': 'PendingPods',
+#         'dimensions': {'Cluster': tag_project},
+#         'steps': [{'upper': 0, 'change': -1}, {'lower': 1, 'change': 1}, {'lower': 10, 'change': 3}],
+#     },
+#     'cooldown': 300,
+#     'estimated_instance_warmup': 300,
+#     'disable_scale_in': False,
+#     'scale_in_protection': False,
+# }
+worker_scaling = None
+
+# Warm pools per node role (None: none): pre-initialized instances, kept stopped or hibernated, which
+# run the expensive bootstrap on entry to the warm pool and only the pool's user_data when they move
+# into service (a lifecycle hook holds each node until its part is done)
+# min_size: instances kept warm, max_prepared_capacity: warm plus in-service instances
+#   (default: max_capacity), pool_state: 'Stopped' or 'Hibernated', heartbeat_timeout: seconds
+#   a node has for its bootstrap, root_volume_size: GiB of the encrypted root volume of hibernated nodes
+# Example: {'min_size': 2, 'pool_state': 'Stopped'}
+warm_pools = {
+    'master': None,
+    'worker': None,
+}
+
+# Load Balancer type for the kube-apiservers
+# 'classic': Classic ELBs with TCP health checks
+# 'network': cross-zone NLBs with client IP preservation and HTTPS /healthz health checks
+master_lb_type = 'classic'
+
+# CloudWatch agent on all nodes (CPU, memory, disk IO, network),
+# plus a dashboard and alarms for the load balancers and node pools
+observability = False
+
+# CloudWatch namespace of the agent's host metrics
+observability_namespace = 'CWAgent'
+
+# etcd disk write latency (ms per write) above which the etcd disk latency alarm fires
+etcd_disk_latency_threshold = 10
+
+# SNS topic ARN notified by the alarms ('' for none)
+alarm_topic_arn = ''
+
+# SecurityGroup ingress rules, compiled into the fewest rules per SecurityGroup at synth time
+# to / from: SecurityGroup (bastion-lb, bastion, etcd, master, worker, master-public-lb,
+#   master-private-lb) or CIDR peer (workstation, vpc, any)
+# ports: 'all', 'tcp:<port>', 'tcp:<from>-<to>' (or udp)
+# when: only applied if all these settings match
+# The descriptions are the ones of deployed clusters, changing them updates every rule
+security_group_rules = [
+    {'to': 'bastion-lb', 'from': 'workstation', 'ports': 'tcp:22',
+     'description': "SSH: Workstation - MasterPublicLB"},
+    {'to': 'master-public-lb', 'from': 'workstation', 'ports': 'tcp:6443',
+     'description': "kubectl: Workstation - MasterPublicLB", 'when': {'master_lb_type': 'classic'}},
+    {'to': 'master-public-lb', 'from': 'master', 'ports': 'tcp:6443',
+     'description': "kubeapi: Workers - MasterPublicLB", 'when': {'master_lb_type': 'classic'}},
+    {'to': 'master-private-lb', 'from': 'any', 'ports': 'tcp:6443',
+     'description': "kubectl: ALL - MasterPrivateLB", 'when': {'master_lb_type': 'classic'}},
+    {'to': 'bastion', 'from': 'bastion-lb', 'ports': 'tcp:22', 'description': "SSH: Bastion-LB - Bastio"},
+    {'to': 'etcd', 'from': 'bastion', 'ports': 'tcp:22', 'description': "SSH: Bastion - Etcds"},
+    {'to': 'etcd', 'from': 'master', 'ports': 'tcp:2379-2380', 'description': "etcd: Masters - Etcds"},
+    {'to': 'etcd', 'from': 'etcd', 'ports': 'tcp:2379-2380', 'description': "etcd: Etcds - Etcds"},
+    {'to': 'master', 'from': 'worker', 'ports': 'all', 'description': "ALL: Workers - Masters"},
+    {'to': 'master', 'from': 'worker', 'ports': 'tcp:6443', 'description': "kubectl: Workers - Masters"},
+    {'to': 'master', 'from': 'bastion', 'ports': 'tcp:22', 'description': "SSH: Bastion - Masters"},
+    {'to': 'master', 'from': 'bastion', 'ports': 'tcp:6443', 'description': "kubectl: Bastion - Masters"},
+    {'to': 'master', 'from': 'master-public-lb', 'ports': 'tcp:6443',
+     'description': "kubectl: MasterPublicLB - Masters", 'when': {'master_lb_type': 'classic'}},
+    {'to': 'master', 'from': 'master-private-lb', 'ports': 'tcp:6443',
+     'description': "kubectl: MasterPrivateLB - Masters", 'when': {'master_lb_type': 'classic'}},
+    # NLBs preserve client IPs, so the masters see the clients directly
+    {'to': 'master', 'from': 'workstation', 'ports': 'tcp:6443',
+     'description': "kubectl: Workstation - Masters", 'when': {'master_lb_type': 'network'}},
+    {'to': 'master', 'from': 'vpc', 'ports': 'tcp:6443',
+     'description': "kubectl: VPC - Masters", 'when': {'master_lb_type': 'network'}},
+    {'to': 'worker', 'from': 'master', 'ports': 'all', 'description': "ALL: Master - Workers"},
+    {'to': 'worker', 'from': 'bastion', 'ports': 'tcp:22', 'description': "SSH: Bastion - Workers"},
+    {'to': 'worker', 'from': 'bastion', 'ports': 'tcp:6443', 'description': "kubectl: Bastion - Workers"},
+]
 
 # Bastion Host
 bastion_min_capacity = 1
@@ -74,227 +225,1245 @@ worker_min_capacity = 3
 worker_max_capacity = 3
 worker_desired_capacity = 3
 worker_instance_type = "t3a.small"
+
+# etcd storage profiles: dedicated low-latency data volume for /var/lib/etcd
+# instance_type: EBS-optimized instance preset (overrides the pool's instance_type)
+# volume_type: 'gp3' or 'io2' EBS data volume, 'instance-store' for the NVMe disk of i-class instances
+#   (io2 pools launch from a launch template, LaunchConfigurations do not support io2)
+# volume_size (GiB), iops, throughput (MiB/s, gp3 only): EBS data volume settings
+etcd_storage_profiles = {
+    # Root disk of the AMI, no dedicated volume
+    'root': {},
+    'gp3': {
+        'instance_type': 'm5.large',
+        'volume_type': 'gp3',
+        'volume_size': 20,
+        'iops': 3000,
+        'throughput': 125,
+    },
+    'io2': {
+        'instance_type': 'm5.large',
+        'volume_type': 'io2',
+        'volume_size': 20,
+        'iops': 5000,
+    },
+    'nvme': {
+        'instance_type': 'i3.large',
+        'volume_type': 'instance-store',
+    },
+}
+
+# etcd storage profile used by the etcd node pool
+etcd_storage_profile = 'root'
+
+# Stream etcd snapshots to S3 on etcd_backup_schedule (cron) from the etcd leader,
+# and restore the latest one on etcd nodes booting without data while no peer is healthy
+etcd_backup = False
+etcd_backup_schedule = '*/15 * * * *'
+# Days the snapshots are kept
+etcd_backup_retention_days = 7
+# Existing bucket for the snapshots (default: a bucket is created and kept when the stack is deleted)
+etcd_backup_bucket_name = ''
+# etcd client endpoint and TLS files on the etcd nodes (as set up in the etcd chapter)
+etcd_client_endpoint = 'https://127.0.0.1:2379'
+etcd_client_tls = {
+    'cacert': '/etc/etcd/ca.pem',
+    'cert': '/etc/etcd/kubernetes.pem',
+    'key': '/etc/etcd/kubernetes-key.pem',
+}
+
+# Node pools: one AutoScalingGroup per entry
+# role: bastion, etcd, master or worker (selects UserData, AMI, LBs and IAM policies)
+# security_group: role whose SecurityGroup the pool joins (defaults to its own role)
+# user_data: additional UserData commands run in order after the role's bootstrap steps
+#   (a failing one fails the bootstrap)
+# storage_profile: name of an entry in etcd_storage_profiles
+# scaling: autoscaling policies (see worker_scaling)
+# placement: placement group strategy (defaults to the role's entry in placement_strategies)
+# warm_pool: warm pool of the pool (defaults to the role's entry in warm_pools)
+# instance_preset: name of an entry in ena_instance_presets (overrides instance_type)
+# instance_types: launch from a launch template with a MixedInstancesPolicy over these instance types
+#   (instead of a LaunchConfiguration with instance_type), with Spot capacity above
+#   on_demand_base_capacity / on_demand_percentage_above_base_capacity (defaults: 0 / 0),
+#   allocated by spot_allocation_strategy (default: 'capacity-optimized')
+def default_node_pools(settings):
+    """The bastion, etcd, master and worker node pools, sized by the variables above."""
+    return [
+        {
+            'name': 'bastion',
+            'role': 'bastion',
+            'instance_type': settings['bastion_instance_type'],
+            'min_capacity': settings['bastion_min_capacity'],
+            'max_capacity': settings['bastion_max_capacity'],
+            'desired_capacity': settings['bastion_desired_capacity'],
+            'subnet_name': 'Private',
+        },
+        {
+            'name': 'etcd',
+            'role': 'etcd',
+            'instance_type': settings['etcd_instance_type'],
+            'min_capacity': settings['etcd_min_capacity'],
+            'max_capacity': settings['etcd_max_capacity'],
+            'desired_capacity': settings['etcd_desired_capacity'],
+            'subnet_name': 'Private',
+            'storage_profile': settings['etcd_storage_profile'],
+        },
+        {
+            'name': 'master',
+            'role': 'master',
+            'instance_type': settings['master_instance_type'],
+            'min_capacity': settings['master_min_capacity'],
+            'max_capacity': settings['master_max_capacity'],
+            'desired_capacity': settings['master_desired_capacity'],
+            'subnet_name': 'Private',
+        },
+        {
+            'name': 'worker',
+            'role': 'worker',
+            'instance_type': settings['worker_instance_type'],
+            'min_capacity': settings['worker_min_capacity'],
+            'max_capacity': settings['worker_max_capacity'],
+            'desired_capacity': settings['worker_desired_capacity'],
+            'subnet_name': 'Private',
+            'scaling': settings['worker_scaling'],
+        },
+    ]
+
+
+node_pools = default_node_pools(globals())
+
+# Additional worker pools, e.g. sized for different workloads:
+# node_pools += [
+# {
+#     'name': 'worker-compute',
+#     'role': 'worker',
+#     'instance_type': 'c5.large',
+#     'min_capacity': 2,
+#     'max_capacity': 2,
+#     'desired_capacity': 2,
+#     'subnet_name': 'Private',
+#     'user_data': ["echo \"NODE_POOL=compute\" >> /etc/environment"],
+# },
+# {
+#     'name': 'worker-spot',
+#     'role': 'worker',
+#     'instance_types': ['m5.large', 'm5a.large', 'm4.large', 'm5d.large'],
+#     'on_demand_base_capacity': 1,
+#     'min_capacity': 3,
+#     'max_capacity': 10,
+#     'desired_capacity': 3,
+#     'subnet_name': 'Private',
+# },
+# {
+#     'name': 'worker-memory',
+#     'role': 'worker',
+#     'instance_type': 'r5.large',
+#     'min_capacity': 1,
+#     'max_capacity': 1,
+#     'desired_capacity': 1,
+#     'subnet_name': 'Private',
+# },
+# ]
+
+# Ubuntu release used for etcd, master and worker nodes
+ubuntu_codename = 'bionic'
+ubuntu_version = '18.04'
+ubuntu_architecture = 'amd64'
+
+# Bake per-role golden AMIs with EC2 Image Builder instead of installing packages at boot
+golden_ami = False
+
+# Golden AMI recipe version (new parent AMIs and changed commands re-bake on their own, bump it to force a bake)
+golden_ami_version = '1.0.0'
+
+# Additional build commands per node role for the golden AMIs
+golden_ami_role_commands = {
+    'etcd': [],
+    'master': [],
+    'worker': [],
+}
+
+# Stage the binaries of binary_manifest as S3 assets at deploy time,
+# instead of downloading them from the internet on every boot
+binary_staging = False
+
+# Pinned binaries, installed to /usr/local/bin on the nodes of the listed roles
+# sha256: expected checksum (None: pinned on first download in binary_lock_file)
+# archive: .tar.gz release, the files named like the entry are extracted
+binary_manifest = {
+    'cfssl': {
+        'version': 'R1.2',
+        'url': 'https://pkg.cfssl.org/R1.2/cfssl_linux-amd64',
+        'sha256': None,
+        'roles': ['bastion'],
+    },
+    'cfssljson': {
+        'version': 'R1.2',
+        'url': 'https://pkg.cfssl.org/R1.2/cfssljson_linux-amd64',
+        'sha256': None,
+        'roles': ['bastion'],
+    },
+    'kubectl': {
+        'version': 'v1.16.2',
+        'url': 'https://storage.googleapis.com/kubernetes-release/release/v1.16.2/bin/linux/amd64/kubectl',
+        'sha256': None,
+        'roles': ['bastion'],
+    },
+    # 'etcd': {
+    #     'version': 'v3.4.3',
+    #     'url': 'https://github.com/etcd-io/etcd/releases/download/v3.4.3/etcd-v3.4.3-linux-amd64.tar.gz',
+    #     'sha256': None,
+    #     'archive': True,
+    #     'roles': ['etcd'],
+    # },
+    # 'kube-apiserver': {
+    #     'version': 'v1.16.2',
+    #     'url': 'https://storage.googleapis.com/kubernetes-release/release/v1.16.2/bin/linux/amd64/kube-apiserver',
+    #     'sha256': None,
+    #     'roles': ['master'],
+    # },
+    # 'kubelet': {
+    #     'version': 'v1.16.2',
+    #     'url': 'https://storage.googleapis.com/kubernetes-release/release/v1.16.2/bin/linux/amd64/kubelet',
+    #     'sha256': None,
+    #     'roles': ['worker'],
+    # },
+}
+
+# Local download directory of the staged binaries
+binary_staging_dir = os.path.join(project_dir, '.binaries')
+
+# Checksums of the staged binaries (commit this file)
+binary_lock_file = os.path.join(project_dir, 'binaries.lock.json')
+
+# Regions to look up the Ubuntu AMI in
+# (set to None to query all regions returned by describe_regions)
+ami_lookup_regions = [aws_region]
+
+# Number of regions queried concurrently
+ami_lookup_max_workers = 8
+
+# Timeout in seconds for each regional AMI lookup
+ami_lookup_timeout = 10
+
+# On-disk cache for the resolved AMI IDs (next to cdk.json)
+# (set to None to disable caching)
+ami_cache_file = os.path.join(project_dir, '.ami-cache.json')
+
+# Seconds a cached AMI ID is considered fresh
+ami_cache_ttl = 7 * 24 * 60 * 60
+
+# Ignore cached AMI IDs and query AWS again (also via AMI_CACHE_REFRESH=1)
+ami_cache_refresh = os.environ.get('AMI_CACHE_REFRESH', '') not in ('', '0')
 # ---------------------------------------------------------
 
 
-# Create dict for region <=> Ubuntu AMI mapping
-ami_region_map = {}
+# Configuration variables a cluster in clusters.json can override
+cluster_setting_names = [
+    'tag_project', 'tag_owner', 'resource_name_prefix', 'stack_layout', 'aws_account', 'aws_region', 'ssh_key_pair',
+    'vpc_cidr',
+    'vpc_gateway_endpoints', 'vpc_interface_endpoints', 'zone_fqdn', 'node_registration', 'node_record_ttl',
+    'pod_cidr_block', 'pod_cidr_node_mask',
+    'placement_strategies', 'placement_partition_count', 'control_plane_azs', 'ena_instance_presets',
+    'worker_scaling', 'warm_pools', 'master_lb_type', 'observability', 'observability_namespace', 'etcd_disk_latency_threshold',
+    'alarm_topic_arn', 'security_group_rules',
+    'bastion_min_capacity', 'bastion_max_capacity', 'bastion_desired_capacity', 'bastion_instance_type',
+    'etcd_min_capacity', 'etcd_max_capacity', 'etcd_desired_capacity', 'etcd_instance_type',
+    'master_min_capacity', 'master_max_capacity', 'master_desired_capacity', 'master_instance_type',
+    'worker_min_capacity', 'worker_max_capacity', 'worker_desired_capacity', 'worker_instance_type',
+    'etcd_storage_profiles', 'etcd_storage_profile', 'node_pools',
+    'etcd_backup', 'etcd_backup_schedule', 'etcd_backup_retention_days', 'etcd_backup_bucket_name',
+    'etcd_client_endpoint', 'etcd_client_tls',
+    'ubuntu_codename', 'ubuntu_version', 'ubuntu_architecture',
+    'golden_ami', 'golden_ami_version', 'golden_ami_role_commands',
+    'binary_staging', 'binary_manifest', 'binary_staging_dir', 'binary_lock_file',
+    'ami_lookup_regions', 'ami_lookup_max_workers', 'ami_lookup_timeout', 'ami_cache_file', 'ami_cache_ttl',
+    'ami_cache_refresh',
+]
 
-# Loop through all regions and get the most recent Ubuntu Bionic AMIs for all AWS regions
-ec2_client = boto3.client('ec2', region_name=aws_region)
-response = ec2_client.describe_regions()
 
-for region in response['Regions']:
-    regionname = region['RegionName']
-    ec2_region = boto3.client('ec2', region_name=regionname)
-    response = ec2_region.describe_images(
-        Filters=[
-            {
-                'Name': 'name',
-                'Values': [
-                    'ubuntu/images/hvm-ssd/ubuntu-bionic-18.04-amd64-server-**',
-                ]
-            },
-        ],
-        Owners=[
-            '099720109477'
+def cluster_settings(cluster=None):
+    """The configuration variables above, overridden by the entries of one cluster definition.
+
+    Unless the cluster lists its own node_pools, the default pools are sized
+    from the cluster's capacity and instance type settings; additional pools
+    appended to node_pools above are kept. A cluster name defaults the
+    resource_name_prefix to '<name>-'.
+    """
+    cluster = dict(cluster or {})
+    name = cluster.pop('name', None)
+    unknown = set(cluster) - set(cluster_setting_names)
+    if unknown:
+        raise ValueError("Unknown settings {} in cluster '{}'".format(', '.join(sorted(unknown)), name))
+    settings = {setting: globals()[setting] for setting in cluster_setting_names}
+    settings.update(cluster)
+    if cluster and 'node_pools' not in cluster:
+        default_pool_names = {pool['name'] for pool in default_node_pools(globals())}
+        settings['node_pools'] = default_node_pools(settings) + [
+            pool for pool in node_pools if pool['name'] not in default_pool_names
         ]
+    if 'ami_lookup_regions' not in cluster and ami_lookup_regions == [aws_region]:
+        settings['ami_lookup_regions'] = [settings['aws_region']]
+    if 'resource_name_prefix' not in cluster and name:
+        settings['resource_name_prefix'] = name + '-'
+    return settings
+
+
+def default_lookups(settings=None):
+    """Lookups for the workstation IPv4 address and Ubuntu AMIs, configured from the variables above."""
+    if settings is None:
+        settings = cluster_settings()
+    return Lookups(
+        aws_region=settings['aws_region'],
+        ami_lookup_regions=settings['ami_lookup_regions'],
+        ami_lookup_max_workers=settings['ami_lookup_max_workers'],
+        ami_lookup_timeout=settings['ami_lookup_timeout'],
+        ami_cache_file=settings['ami_cache_file'],
+        ami_cache_ttl=settings['ami_cache_ttl'],
+        ami_cache_refresh=settings['ami_cache_refresh'],
+        ubuntu_codename=settings['ubuntu_codename'],
+        ubuntu_version=settings['ubuntu_version'],
+        ubuntu_architecture=settings['ubuntu_architecture'],
+        workstation_cidr=os.environ.get('WORKSTATION_CIDR')
     )
-    image_details = sorted(response['Images'], key=itemgetter('CreationDate'), reverse=True)
-    ami_id = image_details[0]['ImageId']
-    ami_region_map[regionname] = ami_id
 
 
-# Default Tags applied to all taggable AWS Resources in Stack
-default_tags={
-    "Project": tag_project,
-    "Owner": tag_owner
+# Instance families with ENA enhanced networking
+ena_instance_families = {
+    'a1', 'c5', 'c5a', 'c5d', 'c5n', 'd2', 'f1', 'g3', 'g4dn', 'h1', 'i3', 'i3en', 'inf1', 'm5', 'm5a', 'm5ad',
+    'm5d', 'm5dn', 'm5n', 'p2', 'p3', 'p3dn', 'r4', 'r5', 'r5a', 'r5ad', 'r5d', 'r5dn', 'r5n', 't3', 't3a', 'x1',
+    'x1e', 'z1d',
 }
 
+# Burstable instance families, which cluster placement groups do not support
+burstable_instance_families = {'t2', 't3', 't3a', 't4g'}
 
-class CdkPythonK8SRealWayAwsStack(core.Stack):
 
-    def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
-        super().__init__(scope, id, tags=default_tags, **kwargs)
+def pool_instance_types(pool, settings):
+    """Instance types a node pool launches, the one of its LaunchConfiguration first."""
+    storage = settings['etcd_storage_profiles'][pool.get('storage_profile', 'root')]
+    instance_type = (
+        storage.get('instance_type')
+        or settings['ena_instance_presets'].get(pool.get('instance_preset'))
+        or pool.get('instance_type')
+        or pool['instance_types'][0]
+    )
+    return [instance_type] + [other for other in pool.get('instance_types', []) if other != instance_type]
 
-        # VPC
-        vpc = ec2.Vpc(
-            self,
-            'k8s-real-hard-way-vpc',
-            cidr=vpc_cidr,
-            subnet_configuration=[
-                ec2.SubnetConfiguration(
-                    cidr_mask=24,
-                    name='Public',
-                    subnet_type=ec2.SubnetType.PUBLIC,
+# Node roles and the suffix of their Name tag
+node_roles = {
+    'bastion': '-bastion',
+    'etcd': '-etcd',
+    'master': '-k8s-master',
+    'worker': '-k8s-worker',
+}
 
-                ),
-                ec2.SubnetConfiguration(
-                    cidr_mask=24,
-                    name='Private',
-                    subnet_type=ec2.SubnetType.PRIVATE
-                )
-            ]
-        )
 
-        # Ubuntu AMI from dict mapping
-        ubuntu_ami = ec2.GenericLinuxImage(
-            ami_map={
-                aws_region: ami_region_map.get(aws_region)
-            }
-        )
+def validate_node_pools(pools, settings=None):
+    """Fail early on node pool specs the stack cannot build."""
+    if settings is None:
+        settings = cluster_settings()
+    names = set()
+    for pool in pools:
+        if pool['role'] not in node_roles:
+            raise ValueError("Unknown role '{}' in node pool '{}'".format(pool['role'], pool['name']))
+        security_group = pool.get('security_group', pool['role'])
+        if security_group not in node_roles:
+            raise ValueError("Unknown security_group '{}' in node pool '{}'".format(security_group, pool['name']))
+        storage_profile = pool.get('storage_profile', 'root')
+        if storage_profile not in settings['etcd_storage_profiles']:
+            raise ValueError("Unknown storage_profile '{}' in node pool '{}'".format(storage_profile, pool['name']))
+        if pool.get('instance_types') and settings['etcd_storage_profiles'][storage_profile].get(
+                'volume_type') in ('gp3', 'io2'):
+            raise ValueError("Node pool '{}': mixed instances pools cannot have an EBS data volume".format(pool['name']))
+        if not pool.get('instance_type') and not pool.get('instance_types'):
+            raise ValueError("Node pool '{}' needs instance_type or instance_types".format(pool['name']))
+        placement = pool.get('placement', settings['placement_strategies'].get(pool['role']))
+        if placement not in (None, 'cluster', 'spread', 'partition'):
+            raise ValueError("Unknown placement '{}' in node pool '{}'".format(placement, pool['name']))
+        if pool.get('instance_preset') is not None and pool['instance_preset'] not in settings['ena_instance_presets']:
+            raise ValueError("Unknown instance_preset '{}' in node pool '{}'".format(pool['instance_preset'], pool['name']))
+        if placement == 'cluster':
+            for instance_type in pool_instance_types(pool, settings):
+                family = instance_type.split('.')[0]
+                if family in burstable_instance_families:
+                    raise ValueError(
+                        "Node pool '{}' uses a cluster placement group, which does not support burstable {}".format(
+                            pool['name'], instance_type))
+                if family not in ena_instance_families:
+                    raise ValueError(
+                        "Node pool '{}' uses a cluster placement group, but {} has no ENA enhanced networking".format(
+                            pool['name'], instance_type))
+        warm_pool = pool.get('warm_pool', settings['warm_pools'].get(pool['role']))
+        if warm_pool:
+            validate_warm_pool(pool, warm_pool)
+        if pool['name'] in names:
+            raise ValueError("Duplicate node pool name '{}'".format(pool['name']))
+        if not pool['min_capacity'] <= pool['desired_capacity'] <= pool['max_capacity']:
+            raise ValueError("Node pool '{}' needs min_capacity <= desired_capacity <= max_capacity".format(pool['name']))
+        names.add(pool['name'])
+
+
+# Packages installed at boot on Ubuntu nodes
+# (baked into per-role golden AMIs instead when golden_ami is enabled)
+ubuntu_packages = [
+    "apt-get update",
+    "apt-get upgrade -y",
+    "apt-get install python3-pip -y",
+    "pip3 install awscli"
+]
+
+# Layer (stack) of the node pools per role in the layered stack_layout
+# (worker pools get a layer each, named like the pool)
+role_layers = {
+    'bastion': 'bastion',
+    'etcd': 'etcd',
+    'master': 'control-plane',
+}
+
+
+def stack_settings(cluster=None, node_pools=None):
+    """Validated settings of one cluster, node_pools replacing its pools if given."""
+    settings = cluster_settings(cluster)
+    if node_pools is not None:
+        settings['node_pools'] = node_pools
+    validate_node_pools(settings['node_pools'], settings)
+    return settings
+
+
+def default_tags(settings):
+    """Default Tags applied to all taggable AWS Resources of the cluster's stacks."""
+    return {
+        "Project": settings['tag_project'],
+        "Owner": settings['tag_owner']
+    }
+
+
+def bootstrap_log_group_name(settings):
+    """CloudWatch Logs group of the bootstrap step events."""
+    return '/' + settings['resource_name_prefix'] + settings['tag_project'] + '/bootstrap'
+
+
+def worker_subnet_cidrs(settings, vpc):
+    """CIDRs of all subnets worker pools run in, each address maps to one pod CIDR block."""
+    cidrs = []
+    for subnet_name in sorted({pool.get('subnet_name', 'Private') for pool in settings['node_pools'] if pool['role'] == 'worker'}):
+        for subnet in vpc.select_subnets(subnet_name=subnet_name).subnets:
+            cidrs.append(subnet.node.default_child.cidr_block)
+    return cidrs
+
+
+class ClusterNetwork:
+    """What the node layers of a cluster use from its network layer.
+
+    Passed as is from the network stack to the node pool stacks, the CDK
+    turns every reference into a CloudFormation export/import pair and a
+    stack dependency.
+    """
+
+    def __init__(self, vpc: ec2.Vpc, zone: route53.IHostedZone, workstation_cidr: str, security_groups: dict,
+                 machine_images: dict, registration: NodeRegistration = None,
+                 etcd_backup_bucket: s3.IBucket = None) -> None:
+        self.vpc = vpc
+        self.zone = zone
+        # Workstation IPv4 address (CIDR)
+        self.workstation_cidr = workstation_cidr
+        # SecurityGroup name (see security_group_rules) => SecurityGroup
+        self.security_groups = security_groups
+        # Node role => machine image
+        self.machine_images = machine_images
+        # Route53 records of the etcd, master and worker nodes (None unless node_registration)
+        self.registration = registration
+        # Bucket of the etcd snapshots (None unless etcd_backup)
+        self.etcd_backup_bucket = etcd_backup_bucket
+
+
+def build_network(scope: core.Construct, settings: dict, lookups: Lookups,
+                  bootstrap_log_group: bool = False) -> ClusterNetwork:
+    """VPC, hosted zone, SecurityGroups, VPC endpoints, node images, node registration and etcd backup bucket.
+
+    With bootstrap_log_group the log group of the bootstrap step events is
+    created here too, so it exists before the nodes of any layer boot.
+    """
+    # Get your workstation IPv4 address
+    myipv4 = lookups.workstation_cidr()
+
+    # VPC
+    vpc = ec2.Vpc(
+        scope,
+        'k8s-real-hard-way-vpc',
+        cidr=settings['vpc_cidr'],
+        subnet_configuration=[
+            ec2.SubnetConfiguration(
+                cidr_mask=24,
+                name='Public',
+                subnet_type=ec2.SubnetType.PUBLIC,
+
+            ),
+            ec2.SubnetConfiguration(
+                cidr_mask=24,
+                name='Private',
+                subnet_type=ec2.SubnetType.PRIVATE
+            )
+        ]
+    )
+    validate_pod_cidr(
+        worker_subnet_cidrs(settings, vpc), settings['pod_cidr_block'], settings['pod_cidr_node_mask'],
+        settings['vpc_cidr']
+    )
+
+    # Get HostedZone ID from HostedZone Name
+    zoneid = route53.HostedZone.from_lookup(
+        scope,
+        "k8s-real-hard-way-zone",
+        domain_name=settings['zone_fqdn']
+    )
 
-        # Get HostedZone ID from HostedZone Name
-        zoneid = route53.HostedZone.from_lookup(
-            self,
-            "k8s-real-hard-way-zone",
-            domain_name=zone_fqdn
+    # SecurityGroups
+    # Bastion LB
+    bastion_lb_sg = ec2.SecurityGroup(
+        scope,
+        "bastion-lb-sg",
+        vpc=vpc,
+        allow_all_outbound=True,
+        description="Bastion-LB",
+    )
+    # Bastion
+    bastion_security_group = ec2.SecurityGroup(
+        scope,
+        "bastion-security-group",
+        vpc=vpc,
+        allow_all_outbound=True,
+        description="Bastion"
+    )
+    # etcd
+    etcd_security_group = ec2.SecurityGroup(
+        scope,
+        "etcd-security-group",
+        vpc=vpc,
+        allow_all_outbound=True,
+        description="etcd"
+    )
+    # Kubernetes Master
+    master_securiy_group = ec2.SecurityGroup(
+        scope,
+        "master-security-group",
+        vpc=vpc,
+        allow_all_outbound=True,
+        description="K8s Master",
+    )
+    # Kubernetes Worker
+    worker_security_group = ec2.SecurityGroup(
+        scope,
+        "worker-security-group",
+        vpc=vpc,
+        allow_all_outbound=True,
+        description="K8s Worker"
+    )
+    security_groups = {
+        'bastion-lb': bastion_lb_sg,
+        'bastion': bastion_security_group,
+        'etcd': etcd_security_group,
+        'master': master_securiy_group,
+        'worker': worker_security_group,
+    }
+    if settings['master_lb_type'] == 'classic':
+        # Kubernetes Master Public LB
+        security_groups['master-public-lb'] = ec2.SecurityGroup(
+            scope,
+            "k8s-real-hard-way-master-public-lb-sg",
+            vpc=vpc,
+            allow_all_outbound=True,
+            description="K8s MasterPublicLB",
         )
-        zoneid_str = zoneid.hosted_zone_id
-
-        # IAM Policy for Bastion Instance Profile
-        iampolicystatement = iam.PolicyStatement(
-            actions=[
-                "ec2:CreateRoute",
-                "ec2:CreateTags",
-                "ec2:DescribeAutoScalingGroups",
-                "autoscaling:DescribeAutoScalingInstances",
-                "ec2:DescribeRegions",
-                "ec2:DescribeRouteTables",
-                "ec2:DescribeInstances",
-                "ec2:DescribeTags",
-                "elasticloadbalancing:DescribeLoadBalancers",
-                "route53:ListHostedZonesByName"
-            ],
-            effect=iam.Effect.ALLOW,
-            resources=[
-                "*"
-            ]
+        # Kubernetes Master Private LB
+        security_groups['master-private-lb'] = ec2.SecurityGroup(
+            scope,
+            "k8s-real-hard-way-master-private-lb-sg",
+            vpc=vpc,
+            allow_all_outbound=True,
+            description="K8s MasterPrivateLB",
         )
-        iampolicystatement_route53 = iam.PolicyStatement(
-            actions=[
-                "route53:ChangeResourceRecordSets"
-            ],
-            effect=iam.Effect.ALLOW,
-            resources=[
-                "arn:aws:route53:::" + zoneid_str[1:]
-            ]
+
+    # SecurityGroup Rules (compiled from security_group_rules)
+    cidr_peers = {
+        'workstation': myipv4,
+        'vpc': settings['vpc_cidr'],
+        'any': '0.0.0.0/0',
+    }
+    rules = applicable_rules(settings['security_group_rules'], settings)
+    validate_rules(rules, security_groups, cidr_peers)
+    compiled_rules = compile_rules(rules, cidr_peers)
+    for name, entries in sorted(compiled_rules.items()):
+        for peer, protocol, from_port, to_port, description in entries:
+            if protocol == 'all':
+                connection = ec2.Port.all_traffic()
+            elif from_port == to_port:
+                connection = getattr(ec2.Port, protocol)(from_port)
+            else:
+                connection = getattr(ec2.Port, protocol + '_range')(from_port, to_port)
+            security_groups[name].add_ingress_rule(
+                peer=ec2.Peer().ipv4(cidr_peers[peer]) if peer in cidr_peers else security_groups[peer],
+                connection=connection,
+                description=description
+            )
+    for name, (declared, compiled) in sorted(rule_counts(rules, compiled_rules).items()):
+        scope.node.add_info("{}: {} ingress rules ({} declared)".format(name, compiled, declared))
+
+    # VPC Endpoints
+    gateway_endpoints = list(settings['vpc_gateway_endpoints'])
+    if settings['binary_staging'] and 's3' not in gateway_endpoints:
+        # Staged binaries are fetched from S3 without the NAT gateways
+        gateway_endpoints.append('s3')
+    if settings['etcd_backup'] and 's3' not in gateway_endpoints:
+        # Snapshots go to S3 without the NAT gateways
+        gateway_endpoints.append('s3')
+    for service in gateway_endpoints:
+        vpc.add_gateway_endpoint(
+            service + '-gateway-endpoint',
+            service=ec2.GatewayVpcEndpointAwsService(service)
         )
-        # BASTION HOST
-        # AutoScalingGroup
-        bastion = autoscaling.AutoScalingGroup(
-            self,
-            "bastion",
-            vpc=vpc,
-            min_capacity=bastion_min_capacity,
-            max_capacity=bastion_max_capacity,
-            desired_capacity=bastion_desired_capacity,
-            instance_type=ec2.InstanceType(bastion_instance_type),
-            machine_image=ec2.AmazonLinuxImage(),
-            key_name=ssh_key_pair,
-            vpc_subnets=ec2.SubnetSelection(
+    for service in settings['vpc_interface_endpoints']:
+        endpoint = vpc.add_interface_endpoint(
+            service + '-interface-endpoint',
+            service=ec2.InterfaceVpcEndpointAwsService(service),
+            private_dns_enabled=True,
+            subnets=ec2.SubnetSelection(
                 subnet_name='Private'
-            ),
-            associate_public_ip_address=False
+            )
         )
-        bastion.add_to_role_policy(iampolicystatement)
-        bastion.add_to_role_policy(iampolicystatement_route53)
-
-        cfn_bastion = bastion.node.default_child
-        cfn_bastion.auto_scaling_group_name = "bastion"
-        cfn_bastion_lc = bastion.node.find_child('LaunchConfig')
-        cfn_bastion_lc.launch_configuration_name = "bastion"
-
-        # Classic LoadBalancer
-        bastion_lb = elb.LoadBalancer(
-            self,
-            "bastion-lb",
+        for role in node_roles:
+            endpoint.connections.allow_default_port_from(
+                security_groups[role],
+                "HTTPS: " + security_groups[role].node.id + " - " + service + " endpoint"
+            )
+
+    # Ubuntu AMI from dict mapping
+    ubuntu_ami = ec2.GenericLinuxImage(
+        ami_map={
+            settings['aws_region']: lookups.ubuntu_ami_id(settings['aws_region'])
+        }
+    )
+    # Machine image per node role
+    machine_images = {
+        'bastion': ec2.AmazonLinuxImage(generation=ec2.AmazonLinuxGeneration.AMAZON_LINUX_2),
+        'etcd': ubuntu_ami,
+        'master': ubuntu_ami,
+        'worker': ubuntu_ami,
+    }
+
+    # Golden AMIs: Image Builder bakes ubuntu_packages into one AMI per node role
+    if settings['golden_ami']:
+        golden_images = GoldenAmi(
+            scope,
+            'golden-ami',
             vpc=vpc,
-            internet_facing=True,
-            health_check=elb.HealthCheck(
-                port=22,
-                protocol=elb.LoadBalancingProtocol.TCP
+            parent_image=lookups.ubuntu_ami_id(settings['aws_region']),
+            roles=['etcd', 'master', 'worker'],
+            build_commands=ubuntu_packages,
+            role_commands=settings['golden_ami_role_commands'],
+            version=settings['golden_ami_version']
+        )
+        for role in ('etcd', 'master', 'worker'):
+            machine_images[role] = ec2.GenericLinuxImage(
+                ami_map={
+                    settings['aws_region']: golden_images.image_id(role)
+                }
             )
+
+    # Route53 records of the etcd, master and worker nodes
+    registration = None
+    if settings['node_registration']:
+        registration = NodeRegistration(
+            scope,
+            'node-registration',
+            zone=zoneid,
+            zone_name=settings['zone_fqdn'],
+            record_ttl=settings['node_record_ttl']
         )
 
-        cfn_bastion_lb = bastion_lb.node.default_child
-        cfn_bastion_lb.load_balancer_name = "bastion"
+    # Bucket of the etcd snapshots
+    etcd_backup_bucket = None
+    if settings['etcd_backup']:
+        etcd_backup_bucket = backup_bucket(
+            scope,
+            'etcd-backup-bucket',
+            bucket_name=settings['etcd_backup_bucket_name'],
+            retention_days=settings['etcd_backup_retention_days']
+        )
 
-        bastion_lb.add_listener(
-            external_port=22,
-            external_protocol=elb.LoadBalancingProtocol.TCP,
-            allow_connections_from=[ec2.Peer().ipv4(myipv4)]
+    # Bootstrap step events of the nodes
+    if bootstrap_log_group:
+        add_bootstrap_log_group(
+            scope,
+            log_group_name=bootstrap_log_group_name(settings),
+            roles=sorted({pool['role'] for pool in settings['node_pools']}),
+            namespace=settings['observability_namespace']
         )
-        bastion_lb.add_target(
-            target=bastion
+
+    # Add specific Tags to resources
+    for subnet in vpc.private_subnets:
+        core.Tag.add(
+            subnet,
+            key='Attribute',
+            value='private'
         )
-        # UserData
-        bastion.add_user_data(
-            "sudo yum update",
-            "sudo yum upgrade -y",
-            "sudo yum install jq tmux -y",
-            "wget https://gist.githubusercontent.com/dmytro/3984680/raw/1e25a9766b2f21d7a8e901492bbf9db672e0c871/ssh-multi.sh -O /home/ec2-user/tmux-multi.sh",
-            "chmod +x /home/ec2-user/tmux-multi.sh",
-            "wget https://pkg.cfssl.org/R1.2/cfssl_linux-amd64 && chmod +x cfssl_linux-amd64 && sudo mv cfssl_linux-amd64 /usr/local/bin/cfssl && sudo chown ec2-user:ec2-user /usr/local/bin/cfssl",
-            "wget https://pkg.cfssl.org/R1.2/cfssljson_linux-amd64 && chmod +x cfssljson_linux-amd64 && sudo mv cfssljson_linux-amd64 /usr/local/bin/cfssljson && sudo chown ec2-user:ec2-user /usr/local/bin/cfssljson",
-            "curl -LO https://storage.googleapis.com/kubernetes-release/release/$(curl -s https://storage.googleapis.com/kubernetes-release/release/stable.txt)/bin/linux/amd64/kubectl && chmod +x ./kubectl && sudo mv kubectl /usr/local/bin/kubectl && chown ec2-user:ec2-user /usr/local/bin/kubectl",
-            "sudo hostname " + "bastion" + "." + zone_fqdn,
-            "echo \"AWS_DEFAULT_REGION=$(curl -s http://169.254.169.254/latest/dynamic/instance-identity/document | grep region | awk -F\\\" '{print $4}')\" | sudo tee -a /etc/environment",
-            "echo \"HOSTEDZONE_NAME=" + zone_fqdn + "\" | sudo tee -a /etc/environment"
+    for subnet in vpc.public_subnets:
+        core.Tag.add(
+            subnet,
+            key='Attribute',
+            value='public'
         )
-        # Route53 Alias Target for LB
-        route53_target = route53_targets.ClassicLoadBalancerTarget(bastion_lb)
-        # Route53 Record for Bastion Host LB
-        route53_bastion = route53.ARecord(
-            self,
-            "bastion-lb-route53",
-            target=route53.RecordTarget.from_alias(route53_target),
-            zone=zoneid,
-            comment="Bastion Host LB",
-            record_name='bastion'
+
+    return ClusterNetwork(
+        vpc=vpc,
+        zone=zoneid,
+        workstation_cidr=myipv4,
+        security_groups=security_groups,
+        machine_images=machine_images,
+        registration=registration,
+        etcd_backup_bucket=etcd_backup_bucket
+    )
+
+
+def node_bootstrap(scope: core.Construct, settings: dict, network: ClusterNetwork, roles: list) -> dict:
+    """UserData inputs of the given node roles: role => environment, prepare_commands, steps, final_steps and assets.
+
+    The S3 assets the steps read (staged binaries, the node inventory tool,
+    the etcd snapshot tool) are created in scope, and only those of the given
+    roles.
+    """
+    ubuntu_bootstrap = [] if settings['golden_ami'] else [step('packages', *ubuntu_packages)]
+
+    # Environment per node role, written to /etc/environment
+    # (AWS_REGION and LOCAL_IPV4 come from the instance identity document)
+    node_environment = {
+        'AWS_DEFAULT_REGION': '$AWS_REGION',
+        'HOSTEDZONE_NAME': settings['zone_fqdn'],
+        'INTERNAL_IP': '$LOCAL_IPV4',
+    }
+    role_environment = {
+        'bastion': {
+            'AWS_DEFAULT_REGION': '$AWS_REGION',
+            'HOSTEDZONE_NAME': settings['zone_fqdn'],
+            # Scope of the k8s-inventory tool
+            'PROJECT_TAG': settings['tag_project'],
+            'VPC_ID': network.vpc.vpc_id,
+        },
+        'etcd': node_environment,
+        'master': node_environment,
+        'worker': dict(node_environment, POD_CIDR='$POD_CIDR'),
+    }
+
+    # Commands deriving node facts before the environment is written
+    role_prepare_commands = {}
+    if 'worker' in roles:
+        role_prepare_commands['worker'] = pod_cidr_fragment(
+            worker_subnet_cidrs(settings, network.vpc), settings['pod_cidr_block'], settings['pod_cidr_node_mask']
         )
 
-        # ETCD
-        # AutoScalingGroup
-        etcd = autoscaling.AutoScalingGroup(
-            self,
-            "etcd",
-            vpc=vpc,
-            min_capacity=etcd_min_capacity,
-            max_capacity=etcd_max_capacity,
-            desired_capacity=etcd_desired_capacity,
-            instance_type=ec2.InstanceType(etcd_instance_type),
-            machine_image=ubuntu_ami,
-            key_name=ssh_key_pair,
+    # Bootstrap steps per node role (run in parallel on boot)
+    role_steps = {
+        'bastion': [
+            step(
+                'packages',
+                "yum upgrade -y",
+                "yum install jq tmux python3 -y"
+            ),
+            step(
+                'tmux-multi',
+                "wget https://gist.githubusercontent.com/dmytro/3984680/raw/1e25a9766b2f21d7a8e901492bbf9db672e0c871/ssh-multi.sh -O /home/ec2-user/tmux-multi.sh",
+                "chmod +x /home/ec2-user/tmux-multi.sh"
+            ),
+            step(
+                'cfssl',
+                "wget https://pkg.cfssl.org/R1.2/cfssl_linux-amd64 -O /usr/local/bin/cfssl",
+                "chmod +x /usr/local/bin/cfssl",
+                "chown ec2-user:ec2-user /usr/local/bin/cfssl"
+            ),
+            step(
+                'cfssljson',
+                "wget https://pkg.cfssl.org/R1.2/cfssljson_linux-amd64 -O /usr/local/bin/cfssljson",
+                "chmod +x /usr/local/bin/cfssljson",
+                "chown ec2-user:ec2-user /usr/local/bin/cfssljson"
+            ),
+            step(
+                'kubectl',
+                "curl -Lo /usr/local/bin/kubectl https://storage.googleapis.com/kubernetes-release/release/$(curl -s https://storage.googleapis.com/kubernetes-release/release/stable.txt)/bin/linux/amd64/kubectl",
+                "chmod +x /usr/local/bin/kubectl",
+                "chown ec2-user:ec2-user /usr/local/bin/kubectl"
+            ),
+            step(
+                'hostname',
+                "hostname " + settings['resource_name_prefix'] + "bastion" + "." + settings['zone_fqdn']
+            ),
+        ],
+        'etcd': ubuntu_bootstrap,
+        'master': ubuntu_bootstrap,
+        'worker': ubuntu_bootstrap,
+    }
+    role_steps = {role: role_steps[role] for role in roles}
+
+    # Binaries staged as S3 assets, fetched in parallel through the VPC and checksum verified
+    role_binary_assets = {role: [] for role in roles}
+    staged_names = [
+        name for name, spec in settings['binary_manifest'].items() if set(spec['roles']) & set(roles)
+    ]
+    if settings['binary_staging'] and staged_names:
+        staged = stage_binaries(
+            settings['binary_manifest'], settings['binary_staging_dir'], settings['binary_lock_file']
+        )
+        role_binaries = {role: [] for role in roles}
+        for name in staged_names:
+            spec = settings['binary_manifest'][name]
+            asset = s3_assets.Asset(
+                scope,
+                'binary-' + name,
+                path=staged[name]['path']
+            )
+            for role in spec['roles']:
+                if role not in role_binaries:
+                    continue
+                role_binary_assets[role].append(asset)
+                role_binaries[role].append({
+                    'name': name,
+                    's3_uri': 's3://' + asset.s3_bucket_name + '/' + asset.s3_object_key,
+                    'sha256': staged[name]['sha256'],
+                    'archive': spec.get('archive', False),
+                })
+        for role, binaries in role_binaries.items():
+            if not binaries:
+                continue
+            commands = install_commands(binaries, owner='ec2-user:ec2-user' if role == 'bastion' else None)
+            # Staged binaries replace the steps downloading them from the internet
+            steps = [
+                bootstrap_step for bootstrap_step in role_steps[role]
+                if bootstrap_step['name'] not in settings['binary_manifest']
+            ]
+            if role != 'bastion' and not settings['golden_ami']:
+                # awscli is installed by the packages step first
+                steps = [step('packages', *(ubuntu_packages + commands))] + steps[1:]
+            else:
+                steps.append(step('binaries', *commands))
+            role_steps[role] = steps
+
+    # CloudWatch agent for the host metrics and bootstrap step events of every role
+    role_final_steps = {}
+    if settings['observability']:
+        for role, steps in role_steps.items():
+            commands = cloudwatch_agent_commands(
+                settings['observability_namespace'],
+                platform='amazon_linux' if role == 'bastion' else 'ubuntu',
+                architecture='amd64' if role == 'bastion' else settings['ubuntu_architecture'],
+                log_group_name=bootstrap_log_group_name(settings)
+            )
+            if steps and steps[0]['name'] == 'packages':
+                # apt and yum hold the package database lock, install the agent after the packages
+                role_steps[role] = [step('packages', *(steps[0]['commands'] + commands))] + steps[1:]
+            else:
+                role_steps[role] = steps + [step('cloudwatch-agent', *commands)]
+        if 'etcd' in role_steps:
+            # Disk IO metrics of the etcd data disk only, once the data volume step mounted /var/lib/etcd
+            role_final_steps['etcd'] = [step('etcd-disk-metrics', *etcd_disk_commands(
+                settings['observability_namespace'],
+                log_group_name=bootstrap_log_group_name(settings)
+            ))]
+
+    # Node inventory tool on the bastion (installed once python3 is)
+    if 'bastion' in roles:
+        inventory_asset = s3_assets.Asset(
+            scope,
+            'k8s-inventory',
+            path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'k8s_inventory.py')
+        )
+        role_binary_assets['bastion'].append(inventory_asset)
+        bastion_packages = role_steps['bastion'][0]
+        role_steps['bastion'][0] = step(
+            'packages',
+            *(bastion_packages['commands'] + [
+                "pip3 install boto3",
+                "aws s3 cp --quiet s3://" + inventory_asset.s3_bucket_name + "/" + inventory_asset.s3_object_key
+                + " /usr/local/bin/k8s-inventory",
+                "chmod 755 /usr/local/bin/k8s-inventory"
+            ])
+        )
+
+    # etcd snapshots to S3 (installed once pip3 and awscli are), restored before etcd is set up
+    if 'etcd' in roles and network.etcd_backup_bucket is not None:
+        backup_asset = s3_assets.Asset(
+            scope,
+            'etcd-backup',
+            path=BACKUP_SCRIPT
+        )
+        role_binary_assets['etcd'].append(backup_asset)
+        role_environment['etcd'] = dict(
+            role_environment['etcd'],
+            **backup_environment(
+                network.etcd_backup_bucket,
+                prefix=settings['resource_name_prefix'] + settings['tag_project'] + '/',
+                endpoint=settings['etcd_client_endpoint'],
+                tls=settings['etcd_client_tls'],
+                cluster_size=sum(
+                    pool['desired_capacity'] for pool in settings['node_pools'] if pool['role'] == 'etcd'
+                ),
+                project=settings['tag_project'],
+                vpc_id=network.vpc.vpc_id,
+                group_names=[
+                    settings['resource_name_prefix'] + pool['name']
+                    for pool in settings['node_pools'] if pool['role'] == 'etcd'
+                ]
+            )
+        )
+        commands = backup_install_commands(
+            's3://' + backup_asset.s3_bucket_name + '/' + backup_asset.s3_object_key,
+            settings['etcd_backup_schedule']
+        )
+        steps = role_steps['etcd']
+        if steps and steps[0]['name'] == 'packages':
+            role_steps['etcd'] = [step('packages', *(steps[0]['commands'] + commands))] + steps[1:]
+        else:
+            role_steps['etcd'] = steps + [step('etcd-backup', *commands)]
+        # Runs after the data volume step mounted /var/lib/etcd
+        role_final_steps.setdefault('etcd', []).append(step('etcd-restore', restore_command()))
+
+    return {
+        role: {
+            'environment': role_environment[role],
+            'prepare_commands': role_prepare_commands.get(role),
+            'steps': role_steps[role],
+            'final_steps': role_final_steps.get(role, []),
+            'assets': role_binary_assets[role],
+        }
+        for role in roles
+    }
+
+
+def role_policy_statements(zone: route53.IHostedZone) -> dict:
+    """IAM Policies per node role."""
+    # IAM Policy for Bastion Instance Profile
+    iampolicystatement = iam.PolicyStatement(
+        actions=[
+            "ec2:CreateRoute",
+            "ec2:CreateTags",
+            "ec2:DescribeAutoScalingGroups",
+            "autoscaling:DescribeAutoScalingInstances",
+            "ec2:DescribeRegions",
+            "ec2:DescribeRouteTables",
+            "ec2:DescribeInstances",
+            "ec2:DescribeTags",
+            "elasticloadbalancing:DescribeLoadBalancers",
+            "route53:ListHostedZonesByName"
+        ],
+        effect=iam.Effect.ALLOW,
+        resources=[
+            "*"
+        ]
+    )
+    iampolicystatement_route53 = iam.PolicyStatement(
+        actions=[
+            "route53:ChangeResourceRecordSets"
+        ],
+        effect=iam.Effect.ALLOW,
+        resources=[
+            "arn:aws:route53:::" + zone.hosted_zone_id[1:]
+        ]
+    )
+    return {
+        'bastion': [iampolicystatement, iampolicystatement_route53],
+        'etcd': [iampolicystatement],
+        'master': [iampolicystatement],
+        'worker': [iampolicystatement],
+    }
+
+
+def build_node_pools(scope: core.Construct, settings: dict, network: ClusterNetwork, node_pools: list,
+                     bootstrap: dict) -> dict:
+    """AutoScalingGroup per node pool (bootstrap from node_bootstrap() for their roles); return name => ASG."""
+    policy_statements = role_policy_statements(network.zone)
+    pools = {}
+    for pool in node_pools:
+        role_bootstrap = bootstrap[pool['role']]
+        storage = settings['etcd_storage_profiles'][pool.get('storage_profile', 'root')]
+        instance_type = pool_instance_types(pool, settings)[0]
+        placement = pool.get('placement', settings['placement_strategies'].get(pool['role']))
+        asg = autoscaling.AutoScalingGroup(
+            scope,
+            pool['name'],
+            vpc=network.vpc,
+            min_capacity=pool['min_capacity'],
+            max_capacity=pool['max_capacity'],
+            desired_capacity=pool['desired_capacity'],
+            instance_type=ec2.InstanceType(instance_type),
+            machine_image=network.machine_images[pool['role']],
+            key_name=settings['ssh_key_pair'],
             vpc_subnets=ec2.SubnetSelection(
-                subnet_name='Private'
+                subnet_name=pool.get('subnet_name', 'Private')
             ),
             associate_public_ip_address=False
         )
-        etcd.add_to_role_policy(iampolicystatement)
+        for statement in policy_statements[pool['role']]:
+            asg.add_to_role_policy(statement)
+        for asset in role_bootstrap['assets']:
+            asset.grant_read(asg.role)
+        if pool['role'] == 'etcd' and network.etcd_backup_bucket is not None:
+            network.etcd_backup_bucket.grant_read_write(asg.role)
+        asg.add_security_group(network.security_groups[pool.get('security_group', pool['role'])])
 
-        cfn_etcd = etcd.node.default_child
-        cfn_etcd.auto_scaling_group_name = "etcd"
-        cfn_etcd_lc = etcd.node.find_child('LaunchConfig')
-        cfn_etcd_lc.launch_configuration_name = "etcd"
+        cfn_asg = asg.node.default_child
+        cfn_asg.auto_scaling_group_name = settings['resource_name_prefix'] + pool['name']
+        if settings['observability']:
+            asg.role.add_managed_policy(
+                iam.ManagedPolicy.from_aws_managed_policy_name('CloudWatchAgentServerPolicy')
+            )
+            # Group metrics (desired, in service, pending, ...) for the dashboard
+            cfn_asg.metrics_collection = [
+                autoscaling.CfnAutoScalingGroup.MetricsCollectionProperty(granularity='1Minute')
+            ]
+        cfn_asg_lc = asg.node.find_child('LaunchConfig')
+        cfn_asg_lc.launch_configuration_name = settings['resource_name_prefix'] + pool['name']
+
+        # Placement group and Availability Zones
+        pool_subnets = network.vpc.select_subnets(subnet_name=pool.get('subnet_name', 'Private')).subnets
+        placement_subnets = pool_subnets
+        if pool['role'] in ('etcd', 'master') and settings['control_plane_azs']:
+            # Subnets are ordered by AZ, so etcd and masters share the same AZ set
+            placement_subnets = placement_subnets[:settings['control_plane_azs']]
+        if placement == 'cluster':
+            # Cluster placement groups live in a single AZ
+            placement_subnets = placement_subnets[:1]
+        if len(placement_subnets) < len(pool_subnets):
+            cfn_asg.vpc_zone_identifier = [subnet.subnet_id for subnet in placement_subnets]
+        if placement:
+            placement_group = ec2.CfnPlacementGroup(
+                scope,
+                pool['name'] + '-placement-group',
+                strategy=placement
+            )
+            if placement == 'partition':
+                placement_group.add_property_override('PartitionCount', settings['placement_partition_count'])
+            cfn_asg.placement_group = placement_group.ref
+
+        # Storage profile: dedicated data volume for /var/lib/etcd
+        pool_steps = list(role_bootstrap['steps'])
+        # Launch template settings a LaunchConfiguration does not support, one launch template per ASG
+        template_data = {}
+        if storage.get('volume_type'):
+            cfn_asg_lc.ebs_optimized = True
+            pool_steps.append(
+                data_volume_step('/var/lib/etcd', instance_store=storage['volume_type'] == 'instance-store')
+            )
+        if storage.get('volume_type') in ('gp3', 'io2'):
+            data_volume = {
+                'VolumeType': storage['volume_type'],
+                'VolumeSize': storage['volume_size'],
+                'DeleteOnTermination': True,
+                'Encrypted': True
+            }
+            if 'iops' in storage:
+                data_volume['Iops'] = storage['iops']
+            if 'throughput' in storage:
+                data_volume['Throughput'] = storage['throughput']
+            if storage['volume_type'] == 'io2':
+                template_data = {
+                    'ebs_optimized': True,
+                    'block_device_mappings': [
+                        ec2.CfnLaunchTemplate.BlockDeviceMappingProperty(
+                            device_name='/dev/sdf',
+                            ebs=ec2.CfnLaunchTemplate.EbsProperty(
+                                volume_type=data_volume['VolumeType'],
+                                volume_size=data_volume['VolumeSize'],
+                                iops=data_volume.get('Iops'),
+                                delete_on_termination=True,
+                                encrypted=True
+                            )
+                        )
+                    ]
+                }
+            else:
+                cfn_asg_lc.add_property_override(
+                    'BlockDeviceMappings',
+                    [{'DeviceName': '/dev/sdf', 'Ebs': data_volume}]
+                )
+
+        # Warm pool: nodes bootstrap on entry to it, only the pool's user_data runs on the way into service
+        warm_pool = pool.get('warm_pool', settings['warm_pools'].get(pool['role']))
+        lifecycle_hook = None
+        if warm_pool:
+            lifecycle_hook = add_warm_pool(asg, warm_pool)
+        if warm_pool and warm_pool.get('pool_state') == 'Hibernated':
+            use_hibernation(
+                asg,
+                network.machine_images[pool['role']],
+                instance_type,
+                settings['ssh_key_pair'],
+                root_volume_size=warm_pool.get('root_volume_size', 30),
+                **template_data
+            )
+        elif template_data:
+            use_launch_template(
+                asg,
+                network.machine_images[pool['role']],
+                instance_type,
+                settings['ssh_key_pair'],
+                **template_data
+            )
 
         # UserData
-        etcd.add_user_data(
-            "sudo apt-get update",
-            "sudo apt-get upgrade -y",
-            "sudo apt-get install python3-pip -y",
-            "sudo pip3 install awscli",
-            "echo \"AWS_DEFAULT_REGION=$(curl -s http://169.254.169.254/latest/dynamic/instance-identity/document | grep region | awk -F\\\" '{print $4}')\" | sudo tee -a /etc/environment",
-            "echo \"HOSTEDZONE_NAME=" + zone_fqdn + "\" | sudo tee -a /etc/environment",
-            "echo \"INTERNAL_IP=$(curl -s http://169.254.169.254/1.0/meta-data/local-ipv4)\" | sudo tee -a /etc/environment"
+        asg.add_user_data(
+            *compile_user_data(
+                environment=role_bootstrap['environment'],
+                steps=pool_steps,
+                final_steps=role_bootstrap['final_steps'],
+                lifecycle_hook=lifecycle_hook,
+                post_commands=pool.get('user_data', []),
+                prepare_commands=role_bootstrap['prepare_commands'],
+                labels={
+                    'cluster': settings['resource_name_prefix'] + settings['tag_project'],
+                    'role': pool['role'],
+                    'pool': pool['name'],
+                }
+            )
         )
+        # Autoscaling policies
+        if pool.get('scaling'):
+            add_scaling_policies(asg, pool['scaling'])
 
-        # KUBERNETES MASTER Load Balancer
+        # Launch Template with Spot and On-Demand capacity over several instance types
+        if pool.get('instance_types'):
+            use_mixed_instances(asg, pool, network.machine_images[pool['role']], settings['ssh_key_pair'])
+
+        # Route53 records of the etcd, master and worker nodes
+        if network.registration is not None and pool['role'] != 'bastion':
+            network.registration.register(asg, pool['role'])
+
+        # Add specific Tags to resources
+        name_suffix = node_roles[pool['role']]
+        if pool['name'] != pool['role']:
+            name_suffix += '-' + pool['name']
+        core.Tag.add(
+            asg,
+            apply_to_launched_instances=True,
+            key='Name',
+            value=settings['tag_project'] + name_suffix
+        )
+        pools[pool['name']] = asg
+    return pools
+
+
+def build_bastion_access(scope: core.Construct, settings: dict, network: ClusterNetwork, bastions: list) -> dict:
+    """Public Classic LoadBalancer and Route53 record of the bastion ASGs; return the LB for the dashboard."""
+    # Classic LoadBalancer
+    bastion_lb = elb.LoadBalancer(
+        scope,
+        "bastion-lb",
+        vpc=network.vpc,
+        internet_facing=True,
+        health_check=elb.HealthCheck(
+            port=22,
+            protocol=elb.LoadBalancingProtocol.TCP
+        )
+    )
+
+    cfn_bastion_lb = bastion_lb.node.default_child
+    cfn_bastion_lb.load_balancer_name = settings['resource_name_prefix'] + "bastion"
+
+    bastion_lb.add_listener(
+        external_port=22,
+        external_protocol=elb.LoadBalancingProtocol.TCP,
+        allow_connections_from=[ec2.Peer().ipv4(network.workstation_cidr)]
+    )
+    for bastion in bastions:
+        bastion_lb.add_target(
+            target=bastion
+        )
+    # Route53 Alias Target for LB
+    route53_target = route53_targets.ClassicLoadBalancerTarget(bastion_lb)
+    # Route53 Record for Bastion Host LB
+    route53.ARecord(
+        scope,
+        "bastion-lb-route53",
+        target=route53.RecordTarget.from_alias(route53_target),
+        zone=network.zone,
+        comment="Bastion Host LB",
+        record_name=settings['resource_name_prefix'] + 'bastion'
+    )
+
+    core.Tag.add(
+        bastion_lb,
+        apply_to_launched_instances=True,
+        key='Name',
+        value=settings['tag_project'] + '-bastion-lb'
+    )
+    return {
+        'title': 'bastion',
+        'type': 'classic',
+        'dimensions': {'LoadBalancerName': cfn_bastion_lb.load_balancer_name},
+    }
+
+
+def build_master_load_balancers(scope: core.Construct, settings: dict, network: ClusterNetwork,
+                                masters: list) -> list:
+    """Public and private kube-apiserver LoadBalancers of the master ASGs; return the LBs for the dashboard."""
+    load_balancers = []
+    if settings['master_lb_type'] == 'network':
+        # Public Load Balancer (for remote kubectl access)
+        master_public_lb = elbv2.NetworkLoadBalancer(
+            scope,
+            "k8s-real-hard-way-master-public-nlb",
+            vpc=network.vpc,
+            internet_facing=True,
+            cross_zone_enabled=True
+        )
+        cfn_master_public_lb = master_public_lb.node.default_child
+        cfn_master_public_lb.name = settings['resource_name_prefix'] + "master-public"
+
+        # Private Load Balancer (fronting kube-apiservers)
+        master_private_lb = elbv2.NetworkLoadBalancer(
+            scope,
+            "k8s-real-hard-way-master-private-nlb",
+            vpc=network.vpc,
+            internet_facing=False,
+            cross_zone_enabled=True
+        )
+        cfn_master_private_lb = master_private_lb.node.default_child
+        cfn_master_private_lb.name = settings['resource_name_prefix'] + "master-private"
+
+        # Add ASG as target for LBs
+        # (TCP passthrough, health checked on the kube-apiserver /healthz endpoint)
+        for title, master_lb in (('master-public', master_public_lb), ('master-private', master_private_lb)):
+            master_target_group = master_lb.add_listener(
+                "kube-apiserver",
+                port=6443
+            ).add_targets(
+                "masters",
+                port=6443,
+                targets=masters,
+                deregistration_delay=core.Duration.seconds(30),
+                health_check=elbv2.HealthCheck(
+                    protocol=elbv2.Protocol.HTTPS,
+                    path='/healthz',
+                    port='6443',
+                    interval=core.Duration.seconds(10),
+                    healthy_threshold_count=2,
+                    unhealthy_threshold_count=2
+                )
+            )
+            master_target_group.set_attribute('preserve_client_ip.enabled', 'true')
+            load_balancers.append({
+                'title': title,
+                'type': 'network',
+                'dimensions': {
+                    'LoadBalancer': master_lb.load_balancer_full_name,
+                    'TargetGroup': master_target_group.target_group_full_name,
+                },
+                'apiserver': True,
+            })
+    else:
         # Public Load Balancer (for remote kubectl access)
         master_public_lb = elb.LoadBalancer(
-            self,
+            scope,
             "k8s-real-hard-way-master-public-lb",
-            vpc=vpc,
+            vpc=network.vpc,
             internet_facing=True,
             health_check=elb.HealthCheck(
                 port=6443,
@@ -304,17 +1473,17 @@ class CdkPythonK8SRealWayAwsStack(core.Stack):
         master_public_lb.add_listener(
             external_port=6443,
             external_protocol=elb.LoadBalancingProtocol.TCP,
-            allow_connections_from=[ec2.Peer().ipv4(myipv4)]
+            allow_connections_from=[ec2.Peer().ipv4(network.workstation_cidr)]
         )
 
         cfn_master_public_lb = master_public_lb.node.default_child
-        cfn_master_public_lb.load_balancer_name = "master-public"
+        cfn_master_public_lb.load_balancer_name = settings['resource_name_prefix'] + "master-public"
 
         # Private Load Balancer (fronting kube-apiservers)
         master_private_lb = elb.LoadBalancer(
-            self,
+            scope,
             "k8s-real-hard-way-master-private-lb",
-            vpc=vpc,
+            vpc=network.vpc,
             internet_facing=False,
             health_check=elb.HealthCheck(
                 port=6443,
@@ -328,305 +1497,172 @@ class CdkPythonK8SRealWayAwsStack(core.Stack):
         )
 
         cfn_master_private_lb = master_private_lb.node.default_child
-        cfn_master_private_lb.load_balancer_name = "master-private"
+        cfn_master_private_lb.load_balancer_name = settings['resource_name_prefix'] + "master-private"
 
-        # AutoScalingGroup
-        master = autoscaling.AutoScalingGroup(
-            self,
-            "master",
-            vpc=vpc,
-            min_capacity=master_min_capacity,
-            max_capacity=master_max_capacity,
-            desired_capacity=master_desired_capacity,
-            instance_type=ec2.InstanceType(master_instance_type),
-            machine_image=ubuntu_ami,
-            key_name=ssh_key_pair,
-            vpc_subnets=ec2.SubnetSelection(
-                subnet_name='Private'
-            ),
-            associate_public_ip_address=False
-        )
-        master.add_to_role_policy(iampolicystatement)
+        # Add ASG as target for LBs
+        for master in masters:
+            master_public_lb.add_target(
+                target=master
+            )
+            master_private_lb.add_target(
+                target=master
+            )
 
-        cfn_master = master.node.default_child
-        cfn_master.auto_scaling_group_name = "master"
-        cfn_master_lc = master.node.find_child('LaunchConfig')
-        cfn_master_lc.launch_configuration_name = "master"
+        cfn_master_public_lb.security_groups = [
+            network.security_groups['master-public-lb'].security_group_id
+        ]
+        cfn_master_private_lb.security_groups = [
+            network.security_groups['master-private-lb'].security_group_id
+        ]
+        for title, cfn_master_lb in (('master-public', cfn_master_public_lb),
+                                     ('master-private', cfn_master_private_lb)):
+            load_balancers.append({
+                'title': title,
+                'type': 'classic',
+                'dimensions': {'LoadBalancerName': cfn_master_lb.load_balancer_name},
+                'apiserver': True,
+            })
 
-        # Add ASG as target for LBs
-        master_public_lb.add_target(
-            target=master
-        )
-        master_private_lb.add_target(
-            target=master
-        )
-        # UserData
-        master.add_user_data(
-            "sudo apt-get update",
-            "sudo apt-get upgrade -y",
-            "sudo apt-get install python3-pip -y",
-            "sudo pip3 install awscli",
-            "echo \"AWS_DEFAULT_REGION=$(curl -s http://169.254.169.254/latest/dynamic/instance-identity/document | grep region | awk -F\\\" '{print $4}')\" | sudo tee -a /etc/environment",
-            "echo \"HOSTEDZONE_NAME=" + zone_fqdn + "\" | sudo tee -a /etc/environment",
-            "echo \"INTERNAL_IP=$(curl -s http://169.254.169.254/1.0/meta-data/local-ipv4)\" | sudo tee -a /etc/environment"
-        )
+    core.Tag.add(
+        master_public_lb,
+        apply_to_launched_instances=True,
+        key='Name',
+        value=settings['tag_project'] + '-master-lb'
+    )
+    return load_balancers
 
-        # KUBERNETES WORKER
-        worker = autoscaling.AutoScalingGroup(
-            self,
-            "worker",
-            vpc=vpc,
-            min_capacity=worker_min_capacity,
-            max_capacity=worker_max_capacity,
-            desired_capacity=worker_desired_capacity,
-            instance_type=ec2.InstanceType(worker_instance_type),
-            machine_image=ubuntu_ami,
-            key_name=ssh_key_pair,
-            vpc_subnets=ec2.SubnetSelection(
-                subnet_name='Private'
-            ),
-            associate_public_ip_address=False
-        )
-        worker.add_to_role_policy(iampolicystatement)
 
-        cfn_worker = worker.node.default_child
-        cfn_worker.auto_scaling_group_name = "worker"
-        cfn_worker_lc = worker.node.find_child('LaunchConfig')
-        cfn_worker_lc.launch_configuration_name = "worker"
+def build_observability(scope: core.Construct, settings: dict, pools: dict, load_balancers: list,
+                        bootstrap_log_group: bool = True) -> ClusterObservability:
+    """CloudWatch dashboard and alarms of the node pools (name => ASG) and load balancers."""
+    return ClusterObservability(
+        scope,
+        'observability',
+        pools=[
+            {
+                'name': pool['name'],
+                'role': pool['role'],
+                'asg': pools[pool['name']],
+                'asg_name': settings['resource_name_prefix'] + pool['name'],
+            }
+            for pool in settings['node_pools']
+        ],
+        load_balancers=load_balancers,
+        namespace=settings['observability_namespace'],
+        name_prefix=settings['resource_name_prefix'] + settings['tag_project'] + '-',
+        etcd_disk_latency_threshold=settings['etcd_disk_latency_threshold'],
+        alarm_topic_arn=settings['alarm_topic_arn'] or None,
+        bootstrap_log_group_name=bootstrap_log_group_name(settings),
+        create_bootstrap_log_group=bootstrap_log_group
+    )
 
-        # UserData
-        worker.add_user_data(
-            "sudo apt-get update",
-            "sudo apt-get upgrade -y",
-            "sudo apt-get install python3-pip -y",
-            "sudo pip3 install awscli",
-            "RANDOM_NUMBER=$(shuf -i 10-250 -n 1)",
-            "echo \"POD_CIDR=" + pod_cidr + ".$RANDOM_NUMBER.0/24\" | sudo tee -a /etc/environment",
-            "echo \"AWS_DEFAULT_REGION=$(curl -s http://169.254.169.254/latest/dynamic/instance-identity/document | grep region | awk -F\\\" '{print $4}')\" | sudo tee -a /etc/environment",
-            "echo \"HOSTEDZONE_NAME=" + zone_fqdn + "\" | sudo tee -a /etc/environment",
-            "echo \"INTERNAL_IP=$(curl -s http://169.254.169.254/1.0/meta-data/local-ipv4)\" | sudo tee -a /etc/environment"
-        )
 
-        # SecurityGroups
-        # Bastion LB
-        bastion_lb_sg = ec2.SecurityGroup(
-            self,
-            "bastion-lb-sg",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="Bastion-LB",
-        )
-        # Kubernetes Master Public LB
-        master_public_lb_sg = ec2.SecurityGroup(
-            self,
-            "k8s-real-hard-way-master-public-lb-sg",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="K8s MasterPublicLB",
-        )
-        # Kubernetes Master Private LB
-        master_private_lb_sg = ec2.SecurityGroup(
-            self,
-            "k8s-real-hard-way-master-private-lb-sg",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="K8s MasterPrivateLB",
-        )
-        # Bastion
-        bastion_security_group = ec2.SecurityGroup(
-            self,
-            "bastion-security-group",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="Bastion"
-        )
-        # etcd
-        etcd_security_group = ec2.SecurityGroup(
-            self,
-            "etcd-security-group",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="etcd"
-        )
-        # Kubernetes Master
-        master_securiy_group = ec2.SecurityGroup(
-            self,
-            "master-security-group",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="K8s Master",
-        )
-        # Kubernetes Worker
-        worker_security_group = ec2.SecurityGroup(
-            self,
-            "worker-security-group",
-            vpc=vpc,
-            allow_all_outbound=True,
-            description="K8s Worker"
-        )
+def build_layer(scope: core.Construct, settings: dict, network: ClusterNetwork, node_pools: list):
+    """Node pools plus the LoadBalancers of their roles; return (name => ASG, LBs for the dashboard)."""
+    roles = sorted({pool['role'] for pool in node_pools})
+    bootstrap = node_bootstrap(scope, settings, network, roles)
+    pools = build_node_pools(scope, settings, network, node_pools, bootstrap)
 
-        # SecurityGroup Rules
-        # Bastion LB
-        bastion_lb_sg.add_ingress_rule(
-            peer=ec2.Peer().ipv4(myipv4),
-            connection=ec2.Port.tcp(22),
-            description="SSH: Workstation - MasterPublicLB"
-        )
-        # Master Public LB
-        master_public_lb_sg.add_ingress_rule(
-            peer=ec2.Peer().ipv4(myipv4),
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: Workstation - MasterPublicLB"
-        )
-        master_public_lb_sg.add_ingress_rule(
-            peer=master_securiy_group,
-            connection=ec2.Port.tcp(6443),
-            description="kubeapi: Workers - MasterPublicLB"
-        )
-        # Master Private LB
-        # master_private_lb_sg.add_ingress_rule(
-        #     peer=master_securiy_group,
-        #     connection=ec2.Port.tcp(6443),
-        #     description="kubectl: Masters - MasterPrivateLB"
-        # )
-        # master_private_lb_sg.add_ingress_rule(
-        #     peer=worker_security_group,
-        #     connection=ec2.Port.tcp(6443),
-        #     description="kubeapi: Workers - MasterPrivateLB"
-        # )
-        master_private_lb_sg.add_ingress_rule(
-            peer=ec2.Peer.any_ipv4(),
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: ALL - MasterPrivateLB"
-        )
-        # Bastion Host
-        bastion_security_group.add_ingress_rule(
-            peer=bastion_lb_sg,
-            connection=ec2.Port.tcp(22),
-            description="SSH: Bastion-LB - Bastio"
-        )
-        # etcd
-        etcd_security_group.add_ingress_rule(
-            peer=bastion_security_group,
-            connection=ec2.Port.tcp(22),
-            description="SSH: Bastion - Etcds"
-        )
-        etcd_security_group.add_ingress_rule(
-            peer=master_securiy_group,
-            connection=ec2.Port.tcp_range(start_port=2379, end_port=2380),
-            description="etcd: Masters - Etcds"
-        )
-        etcd_security_group.add_ingress_rule(
-            peer=etcd_security_group,
-            connection=ec2.Port.tcp_range(start_port=2379, end_port=2380),
-            description="etcd: Etcds - Etcds"
-        )
-        # K8s-Master
-        master_securiy_group.add_ingress_rule(
-            peer=worker_security_group,
-            connection=ec2.Port.all_traffic(),
-            description="ALL: Workers - Masters"
-        )
-        master_securiy_group.add_ingress_rule(
-            peer=bastion_security_group,
-            connection=ec2.Port.tcp(22),
-            description="SSH: Bastion - Masters"
-        )
-        master_securiy_group.add_ingress_rule(
-            peer=bastion_security_group,
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: Bastion - Masters"
-        )
-        master_securiy_group.add_ingress_rule(
-            peer=master_public_lb_sg,
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: MasterPublicLB - Masters"
-        )
-        master_securiy_group.add_ingress_rule(
-            peer=master_private_lb_sg,
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: MasterPrivateLB - Masters"
-        )
-        master_securiy_group.add_ingress_rule(
-            peer=worker_security_group,
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: Workers - Masters"
-        )
-        # K8s-Worker
-        worker_security_group.add_ingress_rule(
-            peer=master_securiy_group,
-            connection=ec2.Port.all_traffic(),
-            description="ALL: Master - Workers"
-        )
-        worker_security_group.add_ingress_rule(
-            peer=bastion_security_group,
-            connection=ec2.Port.tcp(22),
-            description="SSH: Bastion - Workers"
-        )
-        worker_security_group.add_ingress_rule(
-            peer=bastion_security_group,
-            connection=ec2.Port.tcp(6443),
-            description="kubectl: Bastion - Workers"
-        )
+    def pools_with_role(role):
+        return [pools[pool['name']] for pool in node_pools if pool['role'] == role]
 
-        # Add SecurityGroups to resources
-        bastion.add_security_group(bastion_security_group)
-        etcd.add_security_group(etcd_security_group)
-        master.add_security_group(master_securiy_group)
-        worker.add_security_group(worker_security_group)
-        cfn_master_public_lb.security_groups = [
-            master_public_lb_sg.security_group_id
-        ]
-        cfn_master_private_lb.security_groups = [
-            master_private_lb_sg.security_group_id
-        ]
+    load_balancers = []
+    if 'bastion' in roles:
+        load_balancers.append(build_bastion_access(scope, settings, network, pools_with_role('bastion')))
+    if 'master' in roles:
+        load_balancers += build_master_load_balancers(scope, settings, network, pools_with_role('master'))
+    return pools, load_balancers
 
-        # Add specific Tags to resources
-        core.Tag.add(
-            bastion,
-            apply_to_launched_instances=True,
-            key='Name',
-            value=tag_project + '-bastion'
-        )
-        core.Tag.add(
-            bastion_lb,
-            apply_to_launched_instances=True,
-            key='Name',
-            value=tag_project + '-bastion-lb'
-        )
-        core.Tag.add(
-            master_public_lb,
-            apply_to_launched_instances=True,
-            key='Name',
-            value=tag_project + '-master-lb'
-        )
-        core.Tag.add(
-            etcd,
-            apply_to_launched_instances=True,
-            key='Name',
-            value=tag_project + '-etcd'
-        )
-        core.Tag.add(
-            master,
-            apply_to_launched_instances=True,
-            key='Name',
-            value=tag_project + '-k8s-master'
-        )
-        core.Tag.add(
-            worker,
-            apply_to_launched_instances=True,
-            key='Name',
-            value=tag_project + '-k8s-worker'
-        )
-        for subnet in vpc.private_subnets:
-            core.Tag.add(
-                subnet,
-                key='Attribute',
-                value='private'
-            )
-        for subnet in vpc.public_subnets:
-            core.Tag.add(
-                subnet,
-                key='Attribute',
-                value='public'
-            )
+
+class CdkPythonK8SRealWayAwsStack(core.Stack):
+    """The whole cluster in one stack (the 'single' stack_layout)."""
+
+    def __init__(self, scope: core.Construct, id: str, lookups: Lookups = None, node_pools: list = None,
+                 cluster: dict = None, **kwargs) -> None:
+        # Configuration of this cluster (the variables above unless cluster overrides them)
+        settings = stack_settings(cluster, node_pools)
+        super().__init__(scope, id, tags=default_tags(settings), **kwargs)
+
+        # Network lookups are only resolved here, never at import time
+        if lookups is None:
+            lookups = default_lookups(settings)
+
+        network = build_network(self, settings, lookups)
+        pools, load_balancers = build_layer(self, settings, network, settings['node_pools'])
+        if settings['observability']:
+            build_observability(self, settings, pools, load_balancers)
+
+
+class NetworkStack(core.Stack):
+    """Network layer of a cluster: VPC, SecurityGroups, VPC endpoints, node images and node registration."""
+
+    def __init__(self, scope: core.Construct, id: str, settings: dict, lookups: Lookups, **kwargs) -> None:
+        super().__init__(scope, id, tags=default_tags(settings), **kwargs)
+
+        self.network = build_network(self, settings, lookups, bootstrap_log_group=settings['observability'])
+
+
+class NodePoolStack(core.Stack):
+    """Node layer of a cluster: the bastion, etcd or control plane pools (with their LBs), or one worker pool.
+
+    It only uses the ClusterNetwork of the network layer, so node layers
+    deploy independently of each other.
+    """
+
+    def __init__(self, scope: core.Construct, id: str, settings: dict, network: ClusterNetwork, node_pools: list,
+                 **kwargs) -> None:
+        super().__init__(scope, id, tags=default_tags(settings), **kwargs)
+
+        self.pools, self.load_balancers = build_layer(self, settings, network, node_pools)
+
+
+class ObservabilityStack(core.Stack):
+    """CloudWatch dashboard and alarms of a layered cluster (the bootstrap log group is in the network layer)."""
+
+    def __init__(self, scope: core.Construct, id: str, settings: dict, pools: dict, load_balancers: list,
+                 **kwargs) -> None:
+        super().__init__(scope, id, tags=default_tags(settings), **kwargs)
+
+        self.observability = build_observability(self, settings, pools, load_balancers, bootstrap_log_group=False)
+
+
+def cluster_stacks(scope: core.Construct, id: str, lookups: Lookups = None, node_pools: list = None,
+                   cluster: dict = None, **kwargs) -> dict:
+    """The stacks of one cluster in its stack_layout; return layer => stack.
+
+    'single': one stack called id. 'layered': <id>-network, then one stack
+    per layer of node pools, <id>-bastion, <id>-etcd, <id>-control-plane and
+    <id>-<pool name> per worker pool, all only depending on the network
+    stack, plus <id>-observability with observability.
+    """
+    settings = stack_settings(cluster, node_pools)
+    if settings['stack_layout'] == 'single':
+        return {'cluster': CdkPythonK8SRealWayAwsStack(
+            scope, id, lookups=lookups, node_pools=node_pools, cluster=cluster, **kwargs)}
+    if settings['stack_layout'] != 'layered':
+        raise ValueError("Unknown stack_layout '{}'".format(settings['stack_layout']))
+
+    layers = {}
+    for pool in settings['node_pools']:
+        layer = role_layers.get(pool['role'], pool['name'])
+        if pool['role'] not in role_layers and layer in ('network', 'observability', *role_layers.values()):
+            raise ValueError("Worker pool '{}' needs a name other than the '{}' layer".format(pool['name'], layer))
+        layers.setdefault(layer, []).append(pool)
+
+    # Network lookups are only resolved here, never at import time
+    if lookups is None:
+        lookups = default_lookups(settings)
+    network_stack = NetworkStack(scope, id + '-network', settings, lookups, **kwargs)
+    stacks = {'network': network_stack}
+    for layer, layer_pools in layers.items():
+        stacks[layer] = NodePoolStack(scope, id + '-' + layer, settings, network_stack.network, layer_pools, **kwargs)
+
+    if settings['observability']:
+        pools = {}
+        load_balancers = []
+        for layer in layers:
+            pools.update(stacks[layer].pools)
+            load_balancers += stacks[layer].load_balancers
+        stacks['observability'] = ObservabilityStack(
+            scope, id + '-observability', settings, pools, load_balancers, **kwargs)
+    return stacks
@@ -0,0 +1,163 @@
+"""Several clusters in one app, defined in clusters.json (next to cdk.json).
+
+clusters.json lists the clusters: a unique name plus the configuration
+variables of the stack module the cluster overrides, e.g.
+
+    [
+        {"name": "prod", "aws_region": "us-east-1", "zone_fqdn": "prod.example.com",
+         "vpc_cidr": "10.5.0.0/16"},
+        {"name": "dev", "aws_region": "eu-west-1", "zone_fqdn": "dev.example.com",
+         "vpc_cidr": "10.6.0.0/16", "worker_min_capacity": 1, "worker_desired_capacity": 1}
+    ]
+
+All clusters with the same Ubuntu release share one Lookups instance, so the
+workstation IP and the AMIs of all their regions are resolved in one pass.
+
+    python3 -m cdk_python_k8s_right_way_aws.clusters
+
+synthesizes every cluster in its own `cdk synth` process, in parallel, after
+resolving the shared lookups once in this process (the AMI IDs through the
+on-disk cache, the workstation IP through WORKSTATION_CIDR). Each process
+works on its own copy of cdk.context.json; the context values they looked up
+(e.g. hosted zones) are merged into cdk.context.json once all are done.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .cdk_python_k8s_right_way_aws_stack import cluster_settings, default_lookups, project_dir
+
+# Cluster definition file
+cluster_file = os.path.join(project_dir, 'clusters.json')
+
+# Context lookups cached by the CDK CLI
+context_file = os.path.join(project_dir, 'cdk.context.json')
+
+
+def check_vpc_cidrs(clusters):
+    """Fail if the vpc_cidr of two clusters overlap, they could never be peered."""
+    networks = sorted(
+        (ipaddress.ip_network(cluster_settings(cluster)['vpc_cidr']), cluster['name']) for cluster in clusters
+    )
+    # Sorted by first address, a network can only overlap the one reaching furthest before it
+    widest = None
+    for network, name in networks:
+        if widest is not None and network.network_address <= widest[0].broadcast_address:
+            raise ValueError("vpc_cidr {} of cluster '{}' overlaps vpc_cidr {} of cluster '{}'".format(
+                network, name, widest[0], widest[1]))
+        if widest is None or network.broadcast_address > widest[0].broadcast_address:
+            widest = (network, name)
+
+
+def load_clusters(path=cluster_file):
+    """Read and validate the cluster definitions of path."""
+    with open(path) as fp:
+        clusters = json.load(fp)
+    names = set()
+    for cluster in clusters:
+        if not cluster.get('name'):
+            raise ValueError("Cluster without name in " + path)
+        if cluster['name'] in names:
+            raise ValueError("Duplicate cluster name '{}' in {}".format(cluster['name'], path))
+        names.add(cluster['name'])
+    check_vpc_cidrs(clusters)
+    return clusters
+
+
+def shared_lookups(clusters):
+    """Return cluster name => Lookups, one instance per Ubuntu release covering the regions of its clusters."""
+    groups = {}
+    for cluster in clusters:
+        settings = cluster_settings(cluster)
+        key = (settings['ubuntu_codename'], settings['ubuntu_version'], settings['ubuntu_architecture'])
+        groups.setdefault(key, []).append((cluster['name'], settings))
+
+    lookups = {}
+    for members in groups.values():
+        settings = members[0][1]
+        if any(member['ami_lookup_regions'] is None for _, member in members):
+            regions = None
+        else:
+            regions = sorted({region for _, member in members for region in member['ami_lookup_regions']})
+        shared = default_lookups(dict(settings, ami_lookup_regions=regions))
+        for name, _ in members:
+            lookups[name] = shared
+    return lookups
+
+
+def read_context(path=context_file):
+    """The context values cached in path, {} if there is none."""
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def synth_clusters(clusters, output_dir, max_workers=4):
+    """Synthesize every cluster into output_dir/<name> in parallel; return name => cdk exit code."""
+    lookups = shared_lookups(clusters)
+    # Resolve everything the cluster stacks share once, before forking the synths
+    for shared in set(lookups.values()):
+        shared.ami_region_map()
+    env = dict(os.environ, WORKSTATION_CIDR=next(iter(lookups.values())).workstation_cidr())
+    context = read_context()
+    app = 'python3 ' + shlex.quote(os.path.join(project_dir, 'app.py'))
+
+    def synth(cluster, work_dir):
+        # The CDK CLI rewrites cdk.context.json of its working directory after
+        # context lookups, so concurrent synths each get their own copy
+        os.makedirs(work_dir)
+        if os.path.exists(os.path.join(project_dir, 'cdk.json')):
+            shutil.copy(os.path.join(project_dir, 'cdk.json'), work_dir)
+        with open(os.path.join(work_dir, 'cdk.context.json'), 'w') as fp:
+            json.dump(context, fp, indent=2)
+        result = subprocess.run(
+            ['cdk', 'synth', '--app', app, '-c', 'cluster=' + cluster['name'],
+             '-o', os.path.join(project_dir, output_dir, cluster['name'])],
+            cwd=work_dir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        return result, read_context(os.path.join(work_dir, 'cdk.context.json'))
+
+    results = {}
+    merged = dict(context)
+    with tempfile.TemporaryDirectory(prefix='cdk-synth-') as scratch, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        work_dirs = [os.path.join(scratch, cluster['name']) for cluster in clusters]
+        for cluster, (result, cluster_context) in zip(clusters, executor.map(synth, clusters, work_dirs)):
+            if result.returncode:
+                sys.stderr.write(result.stderr)
+            results[cluster['name']] = result.returncode
+            merged.update(cluster_context)
+    if merged != context:
+        with open(context_file, 'w') as fp:
+            json.dump(merged, fp, indent=2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--file', default=cluster_file, help="cluster definition file")
+    parser.add_argument('--output', default=os.path.join(project_dir, 'cdk.out'), help="output directory")
+    parser.add_argument('--max-workers', type=int, default=4, help="concurrent synths")
+    args = parser.parse_args(argv)
+
+    results = synth_clusters(load_clusters(args.file), args.output, args.max_workers)
+    for name, returncode in results.items():
+        print("{}: {}".format(name, 'ok' if returncode == 0 else 'failed ({})'.format(returncode)))
+    return 1 if any(results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
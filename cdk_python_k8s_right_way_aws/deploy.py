@@ -0,0 +1,129 @@
+"""Deploy the stacks of a synthesized app concurrently, each as soon as the stacks it depends on are deployed.
+
+`cdk deploy` deploys one stack after the other. In the layered stack_layout
+the bastion, etcd, control-plane and worker pool stacks only depend on the
+network stack, so once it is deployed they all deploy at the same time.
+
+    cdk synth
+    python3 -m cdk_python_k8s_right_way_aws.deploy --max-workers 8
+    python3 -m cdk_python_k8s_right_way_aws.deploy 'cdk-python-k8s-real-way-aws-worker*'
+
+Stacks are read from the cloud assembly (cdk.out/manifest.json). Given
+patterns, only the matching stacks are deployed, their dependencies are
+assumed to be deployed already. Stacks depending on a failed stack are
+skipped.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .cdk_python_k8s_right_way_aws_stack import project_dir
+
+STACK_ARTIFACT = 'aws:cloudformation:stack'
+
+
+def stack_dependencies(assembly_dir):
+    """Return stack name => names of the stacks it depends on, from the cloud assembly manifest."""
+    with open(os.path.join(assembly_dir, 'manifest.json')) as fp:
+        artifacts = json.load(fp).get('artifacts', {})
+    stacks = {name for name, artifact in artifacts.items() if artifact.get('type') == STACK_ARTIFACT}
+    return {
+        name: {dependency for dependency in artifacts[name].get('dependencies', []) if dependency in stacks}
+        for name in stacks
+    }
+
+
+def select_stacks(dependencies, patterns):
+    """Keep the stacks matching one of patterns, dropping dependencies on the others."""
+    if not patterns:
+        return dependencies
+    selected = {name for name in dependencies if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)}
+    return {name: dependencies[name] & selected for name in selected}
+
+
+def deploy_stacks(dependencies, deploy, max_workers=4):
+    """Call deploy(name) for every stack once all its dependencies succeeded, max_workers at a time.
+
+    deploy returns True on success. Returns name => 'deployed', 'failed' or
+    'skipped' (a dependency failed).
+    """
+    for name, depends_on in dependencies.items():
+        unknown = depends_on - set(dependencies)
+        if unknown:
+            raise ValueError("Stack '{}' depends on unknown stacks {}".format(name, ', '.join(sorted(unknown))))
+
+    results = {}
+    pending = dict(dependencies)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            # Skipping a stack can skip the stacks depending on it
+            changed = True
+            while changed:
+                changed = False
+                for name in sorted(pending):
+                    depends_on = pending[name]
+                    if any(results.get(dependency) in ('failed', 'skipped') for dependency in depends_on):
+                        results[name] = 'skipped'
+                    elif all(results.get(dependency) == 'deployed' for dependency in depends_on):
+                        running[executor.submit(deploy, name)] = name
+                    else:
+                        continue
+                    del pending[name]
+                    changed = True
+            if not pending and not running:
+                break
+            if not running:
+                # Left over stacks wait for each other
+                raise ValueError("Dependency cycle between stacks {}".format(', '.join(sorted(pending))))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = 'deployed' if future.result() else 'failed'
+    return results
+
+
+def cdk_deploy(assembly_dir, extra_args=()):
+    """Return a deploy(name) function running `cdk deploy --exclusively` against the synthesized assembly."""
+    def deploy(name):
+        start = time.time()
+        result = subprocess.run(
+            ['cdk', 'deploy', '--app', assembly_dir, '--exclusively', '--require-approval', 'never']
+            + list(extra_args) + [name],
+            cwd=project_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        if result.returncode:
+            sys.stderr.write(result.stderr)
+        print("{}: {} ({:.0f}s)".format(name, 'deployed' if result.returncode == 0 else 'failed', time.time() - start),
+              flush=True)
+        return result.returncode == 0
+    return deploy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('stacks', nargs='*', help="stack name patterns (default: all stacks)")
+    parser.add_argument('--app', default=os.path.join(project_dir, 'cdk.out'), help="synthesized cloud assembly")
+    parser.add_argument('--max-workers', type=int, default=4, help="concurrent deployments")
+    parser.add_argument('--profile', help="AWS profile passed to cdk deploy")
+    args = parser.parse_args(argv)
+
+    dependencies = select_stacks(stack_dependencies(args.app), args.stacks)
+    if not dependencies:
+        parser.error("no stacks to deploy in " + args.app)
+    extra_args = ['--profile', args.profile] if args.profile else []
+    results = deploy_stacks(dependencies, cdk_deploy(args.app, extra_args), args.max_workers)
+    for name in sorted(name for name, result in results.items() if result == 'skipped'):
+        print("{}: skipped".format(name))
+    return 1 if any(result != 'deployed' for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
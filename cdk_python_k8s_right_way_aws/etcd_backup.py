@@ -0,0 +1,74 @@
+import os
+
+from aws_cdk import (
+    aws_s3 as s3,
+    core,
+)
+
+# Snapshot tool installed on the etcd nodes (save, restore, list)
+BACKUP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'etcd_backup.py')
+
+BACKUP_TOOL = '/usr/local/bin/etcd-backup'
+
+# Seconds a booting etcd node waits for its peers before restoring, below the
+# 300 s heartbeat of the node registration lifecycle hooks
+RESTORE_WAIT = 240
+
+
+def backup_bucket(scope: core.Construct, id: str, bucket_name: str = None, retention_days: int = 7) -> s3.IBucket:
+    """Bucket of the etcd snapshots: the existing bucket_name, or a private bucket kept when the stack is deleted.
+
+    Snapshots expire after retention_days, parts of interrupted uploads after
+    one day.
+    """
+    if bucket_name:
+        return s3.Bucket.from_bucket_name(scope, id, bucket_name)
+    return s3.Bucket(
+        scope,
+        id,
+        encryption=s3.BucketEncryption.S3_MANAGED,
+        block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+        lifecycle_rules=[
+            s3.LifecycleRule(
+                expiration=core.Duration.days(retention_days),
+                abort_incomplete_multipart_upload_after=core.Duration.days(1)
+            )
+        ],
+        # The snapshots have to outlive the cluster
+        removal_policy=core.RemovalPolicy.RETAIN
+    )
+
+
+def backup_environment(bucket: s3.IBucket, prefix: str, endpoint: str, tls: dict, cluster_size: int,
+                       project: str, vpc_id: str, group_names: list) -> dict:
+    """Environment of the snapshot tool on the etcd nodes (group_names: the etcd ASGs of the cluster)."""
+    return {
+        'ETCD_BACKUP_BUCKET': bucket.bucket_name,
+        'ETCD_BACKUP_PREFIX': prefix,
+        'ETCD_ENDPOINT': endpoint,
+        'ETCD_CACERT': tls['cacert'],
+        'ETCD_CERT': tls['cert'],
+        'ETCD_KEY': tls['key'],
+        'ETCD_DATA_DIR': '/var/lib/etcd',
+        'ETCD_CLUSTER_SIZE': str(cluster_size),
+        'ETCD_GROUP_NAMES': ','.join(group_names),
+        'ETCD_RESTORE_WAIT': str(RESTORE_WAIT),
+        'PROJECT_TAG': project,
+        'VPC_ID': vpc_id,
+    }
+
+
+def backup_install_commands(script_uri: str, schedule: str) -> list:
+    """Install the snapshot tool from script_uri (needs pip3 and awscli) and run `save` on schedule (cron)."""
+    return [
+        "pip3 install boto3",
+        "aws s3 cp --quiet " + script_uri + " " + BACKUP_TOOL,
+        "chmod 755 " + BACKUP_TOOL,
+        "printf '%s\\n' '" + schedule + " root " + BACKUP_TOOL + " save >> /var/log/etcd-backup.log 2>&1'"
+        " > /etc/cron.d/etcd-backup",
+    ]
+
+
+def restore_command() -> str:
+    """Restore the latest snapshot on a node booting without etcd data, unless its cluster is alive."""
+    return BACKUP_TOOL + " restore >> /var/log/etcd-backup.log 2>&1"
@@ -0,0 +1,199 @@
+"""Lambda function keeping Route53 A records of the nodes in sync with their ASGs.
+
+The ASGs send their launching and terminating lifecycle hook notifications to
+an SQS queue, which invokes this function with batches of them. Every batch
+becomes one private IP lookup (describe_instances), as few Route53 ChangeBatch
+calls as possible (UPSERT for launched nodes, DELETE for terminated ones,
+<instance-id>.<zone> each) and then one CompleteLifecycleAction per hook.
+
+All AWS clients are passed in, so process_messages() runs unchanged against
+moto or botocore Stubbers.
+"""
+import json
+import logging
+import os
+import random
+import re
+import time
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+LAUNCHING = 'autoscaling:EC2_INSTANCE_LAUNCHING'
+TERMINATING = 'autoscaling:EC2_INSTANCE_TERMINATING'
+
+# Changes per ChangeBatch (Route53 allows 1000 records per request)
+MAX_BATCH_CHANGES = 500
+
+# Error codes retried with exponential backoff
+RETRYABLE_ERRORS = {'Throttling', 'ThrottlingException', 'PriorRequestNotComplete', 'RequestLimitExceeded'}
+
+
+def _error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def call_with_backoff(function, max_attempts=8, base_delay=0.2, max_delay=10, sleep=time.sleep, **kwargs):
+    """Call function(**kwargs), retrying throttled calls with full-jitter exponential backoff."""
+    for attempt in range(max_attempts):
+        try:
+            return function(**kwargs)
+        except Exception as error:
+            if _error_code(error) not in RETRYABLE_ERRORS or attempt == max_attempts - 1:
+                raise
+            sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def parse_hooks(bodies):
+    """Return the lifecycle hook notifications in the SQS message bodies (test notifications are skipped)."""
+    hooks = []
+    for body in bodies:
+        message = json.loads(body)
+        if message.get('LifecycleTransition') in (LAUNCHING, TERMINATING):
+            hooks.append(message)
+    return hooks
+
+
+def private_ips(ec2, instance_ids):
+    """instance ID => private IP of the instances that still exist, in one paginated call."""
+    ips = {}
+    if not instance_ids:
+        return ips
+    paginator = ec2.get_paginator('describe_instances')
+    # A filter instead of InstanceIds: instances that are already gone must not fail the whole lookup
+    for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': sorted(instance_ids)}]):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                if instance.get('PrivateIpAddress'):
+                    ips[instance['InstanceId']] = instance['PrivateIpAddress']
+    return ips
+
+
+def record_name(instance_id, zone_name):
+    return instance_id + '.' + zone_name.rstrip('.') + '.'
+
+
+def plan_changes(hooks, ips, zone_name, ttl):
+    """Coalesce hooks into one change per instance: DELETE if it is terminating at all, UPSERT otherwise.
+
+    Terminating instances without a known IP get a DELETE without records,
+    resolve_deletes() fills in the current ones.
+    """
+    actions = {}
+    for hook in hooks:
+        instance_id = hook['EC2InstanceId']
+        if hook['LifecycleTransition'] == TERMINATING or actions.get(instance_id) != 'DELETE':
+            actions[instance_id] = 'DELETE' if hook['LifecycleTransition'] == TERMINATING else 'UPSERT'
+
+    changes = []
+    for instance_id, action in sorted(actions.items()):
+        if action == 'UPSERT' and instance_id not in ips:
+            logger.warning("Launching instance %s has no private IP, skipping its record", instance_id)
+            continue
+        record_set = {'Name': record_name(instance_id, zone_name), 'Type': 'A', 'TTL': ttl}
+        if instance_id in ips:
+            record_set['ResourceRecords'] = [{'Value': ips[instance_id]}]
+        changes.append({'Action': action, 'ResourceRecordSet': record_set})
+    return changes
+
+
+def current_record(route53, zone_id, name):
+    """Return the A record set called name, or None."""
+    response = call_with_backoff(
+        route53.list_resource_record_sets,
+        HostedZoneId=zone_id, StartRecordName=name, StartRecordType='A', MaxItems='1'
+    )
+    for record_set in response['ResourceRecordSets']:
+        if record_set['Name'] == name and record_set['Type'] == 'A':
+            return record_set
+    return None
+
+
+def resolve_deletes(route53, zone_id, changes, names=None):
+    """Replace DELETEs (without records, or named in names) with the current record set; drop missing ones."""
+    resolved = []
+    for change in changes:
+        record_set = change['ResourceRecordSet']
+        if change['Action'] == 'DELETE' and ('ResourceRecords' not in record_set or record_set['Name'] in (names or ())):
+            current = current_record(route53, zone_id, record_set['Name'])
+            if current is None:
+                continue
+            change = {'Action': 'DELETE', 'ResourceRecordSet': current}
+        resolved.append(change)
+    return resolved
+
+
+def submit_changes(route53, zone_id, changes, sleep=time.sleep):
+    """Submit changes in as few ChangeBatch calls as possible, retrying throttled calls.
+
+    A DELETE of a record that is gone or has other values makes Route53 reject
+    the whole batch; those records are looked up and the batch is resubmitted.
+    """
+    changes = resolve_deletes(route53, zone_id, changes)
+    for start in range(0, len(changes), MAX_BATCH_CHANGES):
+        batch = changes[start:start + MAX_BATCH_CHANGES]
+        while batch:
+            try:
+                call_with_backoff(
+                    route53.change_resource_record_sets,
+                    sleep=sleep,
+                    HostedZoneId=zone_id,
+                    ChangeBatch={'Comment': 'node lifecycle hooks', 'Changes': batch}
+                )
+                logger.info("Submitted %d record changes", len(batch))
+                break
+            except Exception as error:
+                names = set(re.findall(r"name='([^']+)'", str(error)))
+                if _error_code(error) != 'InvalidChangeBatch' or not names:
+                    raise
+                logger.info("Resolving stale DELETEs of %s", ', '.join(sorted(names)))
+                resolved = resolve_deletes(route53, zone_id, batch, names)
+                if resolved == batch:
+                    raise
+                batch = resolved
+
+
+def complete_hooks(autoscaling, hooks, sleep=time.sleep):
+    """Let the ASGs continue the launches and terminations of hooks."""
+    for hook in hooks:
+        try:
+            call_with_backoff(
+                autoscaling.complete_lifecycle_action,
+                sleep=sleep,
+                LifecycleHookName=hook['LifecycleHookName'],
+                AutoScalingGroupName=hook['AutoScalingGroupName'],
+                LifecycleActionToken=hook['LifecycleActionToken'],
+                LifecycleActionResult='CONTINUE',
+                InstanceId=hook['EC2InstanceId']
+            )
+        except Exception as error:
+            # The action timed out (heartbeat) or was completed by a redelivered message
+            if _error_code(error) != 'ValidationError':
+                raise
+            logger.info("Lifecycle action of %s already completed: %s", hook['EC2InstanceId'], error)
+
+
+def process_messages(bodies, ec2, route53, autoscaling, zone_id, zone_name, ttl=60, sleep=time.sleep):
+    """Register and deregister the nodes of one batch of lifecycle hook messages."""
+    hooks = parse_hooks(bodies)
+    if not hooks:
+        return {'changes': 0, 'completed': 0}
+    ips = private_ips(ec2, {hook['EC2InstanceId'] for hook in hooks})
+    changes = plan_changes(hooks, ips, zone_name, ttl)
+    submit_changes(route53, zone_id.split('/')[-1], changes, sleep)
+    complete_hooks(autoscaling, hooks, sleep)
+    return {'changes': len(changes), 'completed': len(hooks)}
+
+
+def handler(event, context):
+    import boto3
+
+    return process_messages(
+        [record['body'] for record in event['Records']],
+        ec2=boto3.client('ec2'),
+        route53=boto3.client('route53'),
+        autoscaling=boto3.client('autoscaling'),
+        zone_id=os.environ['HOSTED_ZONE_ID'],
+        zone_name=os.environ['ZONE_NAME'],
+        ttl=int(os.environ.get('RECORD_TTL', '60'))
+    )
@@ -0,0 +1,128 @@
+import hashlib
+import json
+
+from aws_cdk import (
+    aws_ec2 as ec2,
+    aws_iam as iam,
+    core,
+)
+
+
+def _content_hash(*parts) -> str:
+    """Short hash of parts, for names of immutable resources."""
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()[:12]
+
+
+class GoldenAmi(core.Construct):
+    """EC2 Image Builder images with the node packages baked in, one per node role.
+
+    Each role gets its own recipe on top of parent_image, sharing a component
+    that runs build_commands plus the role's entry in role_commands. The
+    images are built while the stack deploys; image_id(role) returns the
+    resulting AMI ID as a token. Components and recipes are immutable, so
+    their names end in a hash of their contents (commands, parent_image and
+    version): a new parent AMI or changed commands create new ones and
+    trigger a new bake, bumping version forces one.
+    """
+
+    def __init__(self, scope: core.Construct, id: str, vpc: ec2.IVpc, parent_image: str, roles: list,
+                 build_commands: list, role_commands: dict = None, version: str = '1.0.0',
+                 instance_type: str = 't3a.small') -> None:
+        super().__init__(scope, id)
+
+        role_commands = role_commands or {}
+        name_prefix = core.Stack.of(self).stack_name
+
+        # Instance Profile for the build and test instances
+        role = iam.Role(
+            self,
+            'role',
+            assumed_by=iam.ServicePrincipal('ec2.amazonaws.com'),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('EC2InstanceProfileForImageBuilder'),
+                iam.ManagedPolicy.from_aws_managed_policy_name('AmazonSSMManagedInstanceCore')
+            ]
+        )
+        instance_profile = iam.CfnInstanceProfile(
+            self,
+            'instance-profile',
+            roles=[role.role_name]
+        )
+
+        security_group = ec2.SecurityGroup(
+            self,
+            'security-group',
+            vpc=vpc,
+            allow_all_outbound=True,
+            description="Golden AMI build"
+        )
+
+        infrastructure = core.CfnResource(
+            self,
+            'infrastructure',
+            type='AWS::ImageBuilder::InfrastructureConfiguration',
+            properties={
+                'Name': name_prefix + '-golden-ami',
+                'InstanceProfileName': instance_profile.ref,
+                'InstanceTypes': [instance_type],
+                'SubnetId': vpc.private_subnets[0].subnet_id,
+                'SecurityGroupIds': [security_group.security_group_id],
+                'TerminateInstanceOnFailure': True
+            }
+        )
+
+        self._image_ids = {}
+        for node_role in roles:
+            component_data = json.dumps({
+                'name': name_prefix + '-' + node_role,
+                'schemaVersion': 1.0,
+                'phases': [{
+                    'name': 'build',
+                    'steps': [{
+                        'name': 'InstallPackages',
+                        'action': 'ExecuteBash',
+                        'inputs': {
+                            'commands': build_commands + role_commands.get(node_role, [])
+                        }
+                    }]
+                }]
+            }, indent=2)
+            component_hash = _content_hash(component_data, version)
+            recipe_hash = _content_hash(component_hash, parent_image, version)
+            component = core.CfnResource(
+                self,
+                node_role + '-component',
+                type='AWS::ImageBuilder::Component',
+                properties={
+                    'Name': name_prefix + '-' + node_role + '-' + component_hash,
+                    'Platform': 'Linux',
+                    'Version': version,
+                    # JSON is valid YAML, which is what Image Builder expects here
+                    'Data': component_data
+                }
+            )
+            recipe = core.CfnResource(
+                self,
+                node_role + '-recipe',
+                type='AWS::ImageBuilder::ImageRecipe',
+                properties={
+                    'Name': name_prefix + '-' + node_role + '-' + recipe_hash,
+                    'Version': version,
+                    'ParentImage': parent_image,
+                    'Components': [{'ComponentArn': component.ref}]
+                }
+            )
+            image = core.CfnResource(
+                self,
+                node_role + '-image',
+                type='AWS::ImageBuilder::Image',
+                properties={
+                    'ImageRecipeArn': recipe.ref,
+                    'InfrastructureConfigurationArn': infrastructure.ref
+                }
+            )
+            self._image_ids[node_role] = core.Token.as_string(image.get_att('ImageId'))
+
+    def image_id(self, role: str) -> str:
+        """Return the baked AMI ID for role."""
+        return self._image_ids[role]
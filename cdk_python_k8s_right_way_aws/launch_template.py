@@ -0,0 +1,140 @@
+import jsii
+from aws_cdk import (
+    aws_autoscaling as autoscaling,
+    aws_ec2 as ec2,
+    core,
+)
+
+
+@jsii.implements(core.IStringProducer)
+class _UserDataProducer:
+    """Renders the ASG's UserData at synth time, including commands added later."""
+
+    def __init__(self, user_data: ec2.UserData) -> None:
+        self.user_data = user_data
+
+    def produce(self, context):
+        return core.Fn.base64(self.user_data.render())
+
+
+@jsii.implements(core.IListProducer)
+class _SecurityGroupsProducer:
+    """Lists the ASG's SecurityGroups at synth time, including groups added later."""
+
+    def __init__(self, connections: ec2.Connections) -> None:
+        self.connections = connections
+
+    def produce(self, context):
+        return [security_group.security_group_id for security_group in self.connections.security_groups]
+
+
+def _launch_template(asg: autoscaling.AutoScalingGroup, machine_image: ec2.IMachineImage, instance_type: str,
+                     key_name: str, **template_data) -> ec2.CfnLaunchTemplate:
+    """Launch template with the image, instance profile, SecurityGroups and UserData of asg."""
+    scope = core.Stack.of(asg)
+    instance_profile = asg.node.find_child('InstanceProfile')
+    return ec2.CfnLaunchTemplate(
+        asg,
+        'LaunchTemplate',
+        launch_template_name=asg.node.default_child.auto_scaling_group_name,
+        launch_template_data=ec2.CfnLaunchTemplate.LaunchTemplateDataProperty(
+            image_id=machine_image.get_image(scope).image_id,
+            instance_type=instance_type,
+            key_name=key_name or None,
+            iam_instance_profile=ec2.CfnLaunchTemplate.IamInstanceProfileProperty(
+                arn=instance_profile.attr_arn
+            ),
+            security_group_ids=core.Lazy.list_value(_SecurityGroupsProducer(asg.connections)),
+            user_data=core.Lazy.string_value(_UserDataProducer(asg.user_data)),
+            **template_data
+        )
+    )
+
+
+def _drop_launch_configuration(asg: autoscaling.AutoScalingGroup) -> None:
+    # The L2 AutoScalingGroup always creates a LaunchConfiguration; nothing
+    # references it anymore, so a never-true condition keeps it out of the stack.
+    asg.node.default_child.add_property_deletion_override('LaunchConfigurationName')
+    unused = core.CfnCondition(
+        asg,
+        'LaunchConfigUnused',
+        expression=core.Fn.condition_equals('launch-template', 'launch-configuration')
+    )
+    asg.node.find_child('LaunchConfig').cfn_options.condition = unused
+
+
+def use_launch_template(asg: autoscaling.AutoScalingGroup, machine_image: ec2.IMachineImage, instance_type: str,
+                        key_name: str, **template_data) -> ec2.CfnLaunchTemplate:
+    """Launch asg from a launch template instead of its LaunchConfiguration.
+
+    For settings a LaunchConfiguration does not support (e.g. io2 volumes,
+    hibernation), passed as template_data (LaunchTemplateDataProperty
+    arguments).
+    """
+    launch_template = _launch_template(asg, machine_image, instance_type, key_name, **template_data)
+    asg.node.default_child.add_property_override('LaunchTemplate', {
+        'LaunchTemplateId': launch_template.ref,
+        'Version': launch_template.attr_latest_version_number
+    })
+    _drop_launch_configuration(asg)
+    return launch_template
+
+
+def use_hibernation(asg: autoscaling.AutoScalingGroup, machine_image: ec2.IMachineImage, instance_type: str,
+                    key_name: str, root_volume_size: int, root_device_name: str = '/dev/sda1',
+                    block_device_mappings=(), **template_data) -> ec2.CfnLaunchTemplate:
+    """Launch asg from a launch template with hibernation enabled instead of its LaunchConfiguration.
+
+    Hibernation needs an encrypted root volume large enough for the RAM
+    (root_volume_size GiB), which replaces the AMI's root volume. An ASG has
+    a single launch template: further volumes (block_device_mappings) and
+    template_data go into the same one.
+    """
+    return use_launch_template(
+        asg,
+        machine_image,
+        instance_type,
+        key_name,
+        hibernation_options=ec2.CfnLaunchTemplate.HibernationOptionsProperty(configured=True),
+        block_device_mappings=[
+            ec2.CfnLaunchTemplate.BlockDeviceMappingProperty(
+                device_name=root_device_name,
+                ebs=ec2.CfnLaunchTemplate.EbsProperty(
+                    volume_type='gp2',
+                    volume_size=root_volume_size,
+                    encrypted=True,
+                    delete_on_termination=True
+                )
+            )
+        ] + list(block_device_mappings),
+        **template_data
+    )
+
+
+def use_mixed_instances(asg: autoscaling.AutoScalingGroup, pool: dict, machine_image: ec2.IMachineImage,
+                        key_name: str) -> ec2.CfnLaunchTemplate:
+    """Launch asg from a launch template with a MixedInstancesPolicy instead of its LaunchConfiguration.
+
+    The pool's instance_types become the policy's overrides; Spot capacity is
+    allocated with spot_allocation_strategy above an On-Demand base of
+    on_demand_base_capacity instances. The L2 AutoScalingGroup keeps working
+    as before (SecurityGroups, UserData, scaling policies, LB targets).
+    """
+    launch_template = _launch_template(asg, machine_image, pool['instance_types'][0], key_name)
+
+    asg.node.default_child.add_property_override('MixedInstancesPolicy', {
+        'LaunchTemplate': {
+            'LaunchTemplateSpecification': {
+                'LaunchTemplateId': launch_template.ref,
+                'Version': launch_template.attr_latest_version_number
+            },
+            'Overrides': [{'InstanceType': instance_type} for instance_type in pool['instance_types']]
+        },
+        'InstancesDistribution': {
+            'OnDemandBaseCapacity': pool.get('on_demand_base_capacity', 0),
+            'OnDemandPercentageAboveBaseCapacity': pool.get('on_demand_percentage_above_base_capacity', 0),
+            'SpotAllocationStrategy': pool.get('spot_allocation_strategy', 'capacity-optimized')
+        }
+    })
+    _drop_launch_configuration(asg)
+    return launch_template
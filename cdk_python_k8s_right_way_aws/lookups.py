@@ -0,0 +1,65 @@
+class Lookups:
+    """Resolves the values that need network access, only when first asked for.
+
+    The stack constructor takes an instance of this class, so importing the
+    stack module never talks to ipify or EC2. Results are memoized per instance,
+    so one instance can be shared between several stacks.
+    """
+
+    def __init__(self, aws_region, ami_lookup_regions=None, ami_lookup_max_workers=8,
+                 ami_lookup_timeout=10, ami_cache_file=None, ami_cache_ttl=0,
+                 ami_cache_refresh=False, ubuntu_codename='bionic', ubuntu_version='18.04',
+                 ubuntu_architecture='amd64', workstation_cidr=None):
+        self.aws_region = aws_region
+        self.ubuntu_codename = ubuntu_codename
+        self.ubuntu_version = ubuntu_version
+        self.ubuntu_architecture = ubuntu_architecture
+        self.ami_lookup_regions = ami_lookup_regions
+        self.ami_lookup_max_workers = ami_lookup_max_workers
+        self.ami_lookup_timeout = ami_lookup_timeout
+        self.ami_cache_file = ami_cache_file
+        self.ami_cache_ttl = ami_cache_ttl
+        self.ami_cache_refresh = ami_cache_refresh
+        # A workstation CIDR resolved beforehand (e.g. by a parent process) skips ipify
+        self._workstation_cidr = workstation_cidr
+        self._ami_region_map = None
+
+    def workstation_cidr(self):
+        """Return the public IPv4 address of this workstation as a /32 CIDR."""
+        if self._workstation_cidr is None:
+            from requests import get
+            self._workstation_cidr = get('https://api.ipify.org').text + "/32"
+        return self._workstation_cidr
+
+    def ami_region_map(self):
+        """Return the region <=> Ubuntu AMI mapping."""
+        if self._ami_region_map is None:
+            from .ami_lookup import EC2_ARCHITECTURES, get_ami_region_map, ubuntu_name_filter
+            self._ami_region_map = get_ami_region_map(
+                home_region=self.aws_region,
+                name_filter=ubuntu_name_filter(self.ubuntu_codename, self.ubuntu_version, self.ubuntu_architecture),
+                architecture=EC2_ARCHITECTURES[self.ubuntu_architecture],
+                regions=self.ami_lookup_regions,
+                max_workers=self.ami_lookup_max_workers,
+                timeout=self.ami_lookup_timeout,
+                cache_file=self.ami_cache_file,
+                cache_ttl=self.ami_cache_ttl,
+                refresh=self.ami_cache_refresh
+            )
+        return self._ami_region_map
+
+    def ubuntu_ami_id(self, region):
+        """Return the Ubuntu AMI ID for region, failing if it could not be resolved."""
+        ami_id = self.ami_region_map().get(region)
+        if ami_id is None:
+            raise RuntimeError("Could not find an Ubuntu AMI in region " + region)
+        return ami_id
+
+
+class StaticLookups(Lookups):
+    """Lookups with fixed values, for offline synths, tests and benchmarks."""
+
+    def __init__(self, workstation_cidr='203.0.113.10/32', ami_region_map=None):
+        super().__init__(aws_region=None)
+        self._workstation_cidr = workstation_cidr
+        self._ami_region_map = dict(ami_region_map or {})
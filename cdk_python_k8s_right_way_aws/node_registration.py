@@ -0,0 +1,107 @@
+import json
+import os
+
+import jsii
+from aws_cdk import (
+    aws_autoscaling as autoscaling,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_route53 as route53,
+    aws_sqs as sqs,
+    core,
+)
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'functions')
+
+
+@jsii.implements(autoscaling.ILifecycleHookTarget)
+class _QueueHookTarget:
+    """Sends the notifications of a lifecycle hook to an SQS queue."""
+
+    def __init__(self, queue: sqs.IQueue) -> None:
+        self.queue = queue
+
+    def bind(self, scope, lifecycle_hook):
+        self.queue.grant_send_messages(lifecycle_hook.role)
+        return autoscaling.LifecycleHookTargetConfig(notification_target_arn=self.queue.queue_arn)
+
+
+class NodeRegistration(core.Construct):
+    """Route53 A records <instance-id>.<zone> for the nodes of ASGs, driven by lifecycle hooks.
+
+    register(asg, role) adds launching and terminating lifecycle hooks that
+    notify one SQS queue. A single Lambda function (reserved concurrency 5)
+    drains the queue in batches, so a mass launch turns into a few batched
+    ChangeBatch calls instead of one Route53 request per node, and completes
+    the lifecycle actions afterwards. When registration fails the hooks time
+    out after heartbeat_timeout and the ASG continues anyway.
+    """
+
+    def __init__(self, scope: core.Construct, id: str, zone: route53.IHostedZone, zone_name: str,
+                 record_ttl: int = 60, heartbeat_timeout: int = 300, batch_size: int = 100,
+                 batching_window: int = 5) -> None:
+        super().__init__(scope, id)
+
+        function_timeout = core.Duration.seconds(60)
+        dead_letter_queue = sqs.Queue(
+            self,
+            'dead-letter-queue',
+            retention_period=core.Duration.days(14)
+        )
+        self.queue = sqs.Queue(
+            self,
+            'queue',
+            # Six times the function timeout, as recommended for Lambda event sources
+            visibility_timeout=core.Duration.seconds(6 * function_timeout.to_seconds()),
+            # Throttled deliveries count as receives too
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=20, queue=dead_letter_queue)
+        )
+
+        self.function = lambda_.Function(
+            self,
+            'function',
+            runtime=lambda_.Runtime.PYTHON_3_7,
+            code=lambda_.Code.from_asset(FUNCTIONS_DIR),
+            handler='route53_registration.handler',
+            timeout=function_timeout,
+            # Few batches at a time keep the Route53 request rate low; the SQS event source
+            # starts with five pollers, less concurrency gets their batches throttled
+            reserved_concurrent_executions=5,
+            environment={
+                'HOSTED_ZONE_ID': zone.hosted_zone_id,
+                'ZONE_NAME': zone_name,
+                'RECORD_TTL': str(record_ttl),
+            }
+        )
+        self.queue.grant_consume_messages(self.function)
+        self.function.add_event_source_mapping(
+            'queue',
+            event_source_arn=self.queue.queue_arn,
+            batch_size=batch_size,
+            max_batching_window=core.Duration.seconds(batching_window)
+        )
+        self.function.add_to_role_policy(iam.PolicyStatement(
+            actions=['route53:ChangeResourceRecordSets', 'route53:ListResourceRecordSets'],
+            effect=iam.Effect.ALLOW,
+            resources=['arn:aws:route53:::hostedzone/' + zone.hosted_zone_id.split('/')[-1]]
+        ))
+        self.function.add_to_role_policy(iam.PolicyStatement(
+            actions=['ec2:DescribeInstances', 'autoscaling:CompleteLifecycleAction'],
+            effect=iam.Effect.ALLOW,
+            resources=['*']
+        ))
+
+        self.heartbeat_timeout = core.Duration.seconds(heartbeat_timeout)
+
+    def register(self, asg: autoscaling.AutoScalingGroup, role: str) -> None:
+        """Maintain the records of the nodes of asg."""
+        for transition, name in ((autoscaling.LifecycleTransition.INSTANCE_LAUNCHING, 'launching'),
+                                 (autoscaling.LifecycleTransition.INSTANCE_TERMINATING, 'terminating')):
+            asg.add_lifecycle_hook(
+                'registration-' + name,
+                lifecycle_transition=transition,
+                notification_target=_QueueHookTarget(self.queue),
+                default_result=autoscaling.DefaultResult.CONTINUE,
+                heartbeat_timeout=self.heartbeat_timeout,
+                notification_metadata=json.dumps({'role': role})
+            )
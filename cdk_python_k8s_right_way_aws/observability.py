@@ -0,0 +1,389 @@
+import json
+
+from aws_cdk import (
+    aws_cloudwatch as cloudwatch,
+    aws_logs as logs,
+    core,
+)
+
+from .userdata import BOOTSTRAP_EVENTS_LOG
+
+CLOUDWATCH_AGENT_DIR = '/opt/aws/amazon-cloudwatch-agent'
+
+CLOUDWATCH_AGENT_CONFIG = CLOUDWATCH_AGENT_DIR + '/etc/amazon-cloudwatch-agent.json'
+
+# Extra dimension of the disk IO metrics of etcd nodes, which only cover the disk of /var/lib/etcd
+ETCD_DISK_DIMENSION = {'Disk': 'etcd-data'}
+
+# Replaced by the disk name at boot, see etcd_disk_commands()
+ETCD_DISK_PLACEHOLDER = '@ETCD_DISK@'
+
+
+def cloudwatch_agent_config(namespace, log_group_name=None, etcd_disk=None):
+    """CloudWatch agent configuration collecting CPU, memory, disk IO and network metrics.
+
+    With log_group_name the bootstrap step events are shipped to that log
+    group, one stream per instance. With etcd_disk (a disk name, e.g.
+    nvme1n1) the disk IO metrics only cover that disk and carry
+    ETCD_DISK_DIMENSION.
+
+    Every metric is also aggregated per AutoScalingGroupName, which is what the
+    dashboard and the alarms of ClusterObservability read. The agent cannot
+    time fsync calls; the write latency of a disk (diskio_write_time divided
+    by diskio_writes) is the closest proxy for etcd's WAL fsync latency.
+    """
+    config = {
+        'agent': {
+            'metrics_collection_interval': 60,
+        },
+        'metrics': {
+            'namespace': namespace,
+            'append_dimensions': {
+                'AutoScalingGroupName': '${aws:AutoScalingGroupName}',
+                'InstanceId': '${aws:InstanceId}',
+            },
+            'aggregation_dimensions': [['AutoScalingGroupName']],
+            'metrics_collected': {
+                'cpu': {
+                    'measurement': ['usage_active', 'usage_iowait'],
+                    'totalcpu': True,
+                },
+                'mem': {
+                    'measurement': ['used_percent'],
+                },
+                'disk': {
+                    'measurement': ['used_percent'],
+                    'resources': ['*'],
+                    'ignore_file_system_types': ['sysfs', 'devtmpfs', 'tmpfs', 'overlay', 'squashfs'],
+                },
+                'diskio': {
+                    'measurement': ['reads', 'writes', 'read_time', 'write_time', 'io_time', 'read_bytes',
+                                    'write_bytes'],
+                    'resources': [etcd_disk] if etcd_disk else ['*'],
+                },
+                'net': {
+                    'measurement': ['bytes_sent', 'bytes_recv', 'drop_in', 'drop_out'],
+                    'resources': ['eth*', 'ens*'],
+                },
+                'netstat': {
+                    'measurement': ['tcp_established', 'tcp_time_wait'],
+                },
+            },
+        },
+    }
+    if etcd_disk:
+        config['metrics']['metrics_collected']['diskio']['append_dimensions'] = dict(ETCD_DISK_DIMENSION)
+        config['metrics']['aggregation_dimensions'].append(['AutoScalingGroupName'] + list(ETCD_DISK_DIMENSION))
+    if log_group_name:
+        config['logs'] = {
+            'logs_collected': {
+                'files': {
+                    'collect_list': [{
+                        'file_path': BOOTSTRAP_EVENTS_LOG,
+                        'log_group_name': log_group_name,
+                        'log_stream_name': '{instance_id}',
+                    }],
+                },
+            },
+        }
+    return config
+
+
+def cloudwatch_agent_commands(namespace, platform='ubuntu', architecture='amd64', log_group_name=None):
+    """UserData commands installing the CloudWatch agent from the regional bucket and starting it.
+
+    platform is 'ubuntu' or 'amazon_linux'.
+    """
+    package = 'amazon-cloudwatch-agent.deb' if platform == 'ubuntu' else 'amazon-cloudwatch-agent.rpm'
+    install = "dpkg -i -E" if platform == 'ubuntu' else "rpm -U --replacepkgs"
+    config_file = CLOUDWATCH_AGENT_CONFIG
+    return [
+        "curl -sSfo /tmp/" + package + " https://amazoncloudwatch-agent-$AWS_REGION.s3.$AWS_REGION.amazonaws.com/"
+        + platform + "/" + architecture + "/latest/" + package,
+        install + " /tmp/" + package,
+        "printf '%s\\n' '" + json.dumps(cloudwatch_agent_config(namespace, log_group_name), sort_keys=True) + "' > " + config_file,
+        CLOUDWATCH_AGENT_DIR + "/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:" + config_file,
+    ]
+
+
+def etcd_disk_commands(namespace, data_dir='/var/lib/etcd', log_group_name=None):
+    """UserData commands restarting the CloudWatch agent with the disk IO metrics of the disk of data_dir only.
+
+    Runs once the data volume is mounted on data_dir and the agent is
+    installed (see cloudwatch_agent_commands()); without a dedicated data
+    volume that is the root disk.
+    """
+    config = cloudwatch_agent_config(namespace, log_group_name, etcd_disk=ETCD_DISK_PLACEHOLDER)
+    return [
+        "ETCD_DISK_SOURCE=$(findmnt -no SOURCE " + data_dir + " || findmnt -no SOURCE /)",
+        "ETCD_DISK=$(lsblk -no PKNAME \"$ETCD_DISK_SOURCE\" | head -1)",
+        "ETCD_DISK=${ETCD_DISK:-$(basename \"$ETCD_DISK_SOURCE\")}",
+        "printf '%s\\n' '" + json.dumps(config, sort_keys=True) + "' | sed \"s/" + ETCD_DISK_PLACEHOLDER
+        + "/$ETCD_DISK/\" > " + CLOUDWATCH_AGENT_CONFIG,
+        CLOUDWATCH_AGENT_DIR + "/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:"
+        + CLOUDWATCH_AGENT_CONFIG,
+    ]
+
+
+def add_bootstrap_log_group(scope: core.Construct, log_group_name: str, roles: list,
+                            namespace: str) -> logs.LogGroup:
+    """Log group of the bootstrap step events, with a <role>_time_to_ready metric per role.
+
+    The metric is the seconds from boot to the 'ready' event of successful
+    bootstraps.
+    """
+    log_group = logs.LogGroup(
+        scope,
+        'bootstrap-events',
+        log_group_name=log_group_name,
+        retention=logs.RetentionDays.ONE_MONTH,
+        removal_policy=core.RemovalPolicy.DESTROY
+    )
+    for role in roles:
+        logs.MetricFilter(
+            scope,
+            role + '-time-to-ready',
+            log_group=log_group,
+            metric_namespace=namespace,
+            metric_name=role + '_time_to_ready',
+            filter_pattern=logs.FilterPattern.literal(
+                '{ $.step = "ready" && $.role = "' + role + '" && $.exit_code = 0 }'),
+            metric_value='$.uptime_s'
+        )
+    return log_group
+
+
+class ClusterObservability(core.Construct):
+    """CloudWatch dashboard and alarms for the load balancers and node pools of a cluster.
+
+    pools is a list of dicts with name, role, asg (the AutoScalingGroup) and
+    asg_name (its physical name). load_balancers is a list of dicts with title, type ('classic' or
+    'network'), dimensions (the CloudWatch dimensions of the LB, for network
+    LBs including its TargetGroup) and apiserver (alarm on unhealthy hosts).
+
+    With bootstrap_log_group_name the log group of the bootstrap step events
+    is created before the node pools (see add_bootstrap_log_group()), unless
+    create_bootstrap_log_group is False because it exists elsewhere; the
+    dashboard shows its time-to-ready metrics either way.
+
+    The dashboard body is written as JSON, because the metric math for the
+    disk write latency is not available in the CloudWatch constructs of this
+    CDK version.
+    """
+
+    def __init__(self, scope: core.Construct, id: str, pools: list, load_balancers: list, namespace: str,
+                 name_prefix: str, etcd_disk_latency_threshold: float = 10, alarm_topic_arn: str = None,
+                 bootstrap_log_group_name: str = None, create_bootstrap_log_group: bool = True) -> None:
+        super().__init__(scope, id)
+
+        self.namespace = namespace
+        self.region = core.Stack.of(self).region
+        alarm_actions = [alarm_topic_arn] if alarm_topic_arn else None
+        self.alarms = []
+
+        # etcd disk write latency per etcd pool (ms per write operation on the etcd data disk)
+        for pool in pools:
+            if pool['role'] != 'etcd':
+                continue
+            alarm = cloudwatch.CfnAlarm(
+                self,
+                pool['name'] + '-disk-latency',
+                alarm_name=name_prefix + pool['name'] + '-disk-write-latency',
+                alarm_description="etcd disk write latency above " + str(etcd_disk_latency_threshold) + " ms",
+                comparison_operator='GreaterThanThreshold',
+                threshold=etcd_disk_latency_threshold,
+                evaluation_periods=5,
+                datapoints_to_alarm=3,
+                treat_missing_data='notBreaching',
+                alarm_actions=alarm_actions,
+                ok_actions=alarm_actions,
+                metrics=[
+                    cloudwatch.CfnAlarm.MetricDataQueryProperty(
+                        id='latency',
+                        expression='IF(writes > 0, write_time / writes, 0)',
+                        label='Disk write latency (ms)',
+                        return_data=True
+                    ),
+                    self._alarm_query('write_time', 'diskio_write_time', self._etcd_disk_dimensions(pool)),
+                    self._alarm_query('writes', 'diskio_writes', self._etcd_disk_dimensions(pool)),
+                ]
+            )
+            self.alarms.append(alarm)
+
+        # Unhealthy kube-apiservers behind their load balancers
+        for load_balancer in load_balancers:
+            if not load_balancer.get('apiserver'):
+                continue
+            alarm = cloudwatch.Alarm(
+                self,
+                load_balancer['title'] + '-unhealthy-hosts',
+                alarm_name=name_prefix + load_balancer['title'] + '-unhealthy-hosts',
+                alarm_description="Unhealthy kube-apiservers behind " + load_balancer['title'],
+                metric=self._load_balancer_metric(load_balancer, 'UnHealthyHostCount'),
+                statistic='Maximum',
+                period=core.Duration.minutes(1),
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                threshold=1,
+                evaluation_periods=3,
+                datapoints_to_alarm=2,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+            )
+            if alarm_topic_arn:
+                alarm.node.default_child.alarm_actions = alarm_actions
+                alarm.node.default_child.ok_actions = alarm_actions
+            self.alarms.append(alarm)
+
+        # Bootstrap step events, created before the agents on the nodes would create it
+        roles = sorted({pool['role'] for pool in pools})
+        if bootstrap_log_group_name and create_bootstrap_log_group:
+            log_group = add_bootstrap_log_group(self, bootstrap_log_group_name, roles, namespace)
+            for pool in pools:
+                pool['asg'].node.add_dependency(log_group)
+
+        widgets = self._load_balancer_widgets(load_balancers) + self._pool_widgets(pools)
+        if bootstrap_log_group_name:
+            widgets.append(self._widget('Time to ready (s since boot)', [
+                self._metric(namespace, role + '_time_to_ready', {}, label=role + ' ' + stat, stat=stat)
+                for role in roles for stat in ('p50', 'p95')
+            ], period=3600))
+        # Two widgets per row
+        for index, widget in enumerate(widgets):
+            widget.update({'x': (index % 2) * 12, 'y': (index // 2) * 6, 'width': 12, 'height': 6})
+
+        self.dashboard = cloudwatch.CfnDashboard(
+            self,
+            'dashboard',
+            dashboard_name=name_prefix + 'cluster',
+            dashboard_body=json.dumps({'widgets': widgets})
+        )
+
+    @staticmethod
+    def _etcd_disk_dimensions(pool):
+        return dict({'AutoScalingGroupName': pool['asg_name']}, **ETCD_DISK_DIMENSION)
+
+    def _alarm_query(self, id, metric_name, dimensions):
+        return cloudwatch.CfnAlarm.MetricDataQueryProperty(
+            id=id,
+            return_data=False,
+            metric_stat=cloudwatch.CfnAlarm.MetricStatProperty(
+                metric=cloudwatch.CfnAlarm.MetricProperty(
+                    namespace=self.namespace,
+                    metric_name=metric_name,
+                    dimensions=[
+                        cloudwatch.CfnAlarm.DimensionProperty(name=name, value=value)
+                        for name, value in dimensions.items()
+                    ]
+                ),
+                period=60,
+                stat='Sum'
+            )
+        )
+
+    @staticmethod
+    def _load_balancer_metric(load_balancer, metric_name):
+        return cloudwatch.Metric(
+            namespace='AWS/ELB' if load_balancer['type'] == 'classic' else 'AWS/NetworkELB',
+            metric_name=metric_name,
+            dimensions=load_balancer['dimensions']
+        )
+
+    def _widget(self, title, metrics, stat='Average', period=60):
+        return {
+            'type': 'metric',
+            'properties': {
+                'title': title,
+                'view': 'timeSeries',
+                'region': self.region,
+                'stat': stat,
+                'period': period,
+                'metrics': metrics,
+            },
+        }
+
+    @staticmethod
+    def _metric(namespace, metric_name, dimensions, **options):
+        line = [namespace, metric_name]
+        for name, value in dimensions.items():
+            line += [name, value]
+        return line + [options] if options else line
+
+    def _load_balancer_widgets(self, load_balancers):
+        widgets = []
+        classic = [lb for lb in load_balancers if lb['type'] == 'classic']
+        network = [lb for lb in load_balancers if lb['type'] == 'network']
+        if classic:
+            widgets.append(self._widget('Classic ELB latency (s)', [
+                self._metric('AWS/ELB', 'Latency', lb['dimensions'], label=lb['title'] + ' ' + stat, stat=stat)
+                for lb in classic for stat in ('Average', 'p99')
+            ]))
+            widgets.append(self._widget('Classic ELB surge queue and spillover', [
+                self._metric('AWS/ELB', metric_name, lb['dimensions'], label=lb['title'] + ' ' + metric_name,
+                             stat=stat)
+                for lb in classic for metric_name, stat in (('SurgeQueueLength', 'Maximum'), ('SpilloverCount', 'Sum'))
+            ]))
+        if network:
+            widgets.append(self._widget('NLB flows and target resets', [
+                self._metric('AWS/NetworkELB', metric_name, lb['dimensions'], label=lb['title'] + ' ' + metric_name,
+                             stat=stat)
+                for lb in network
+                for metric_name, stat in (('ActiveFlowCount', 'Average'), ('NewFlowCount', 'Sum'),
+                                          ('TCP_Target_Reset_Count', 'Sum'))
+            ]))
+        widgets.append(self._widget('Load balancer healthy / unhealthy hosts', [
+            self._metric('AWS/ELB' if lb['type'] == 'classic' else 'AWS/NetworkELB', metric_name, lb['dimensions'],
+                         label=lb['title'] + ' ' + metric_name)
+            for lb in load_balancers for metric_name in ('HealthyHostCount', 'UnHealthyHostCount')
+        ], stat='Maximum'))
+        return widgets
+
+    def _disk_write_latency(self, pools, etcd_disk=False):
+        """Metric math lines for the disk write latency (ms) of each pool: write_time / writes.
+
+        With etcd_disk, of the etcd data disk only.
+        """
+        lines = []
+        for index, pool in enumerate(pools):
+            if etcd_disk:
+                dimensions = self._etcd_disk_dimensions(pool)
+            else:
+                dimensions = {'AutoScalingGroupName': pool['asg_name']}
+            lines += [
+                [{'expression': 'IF(w{0} > 0, t{0} / w{0}, 0)'.format(index), 'label': pool['name'],
+                  'id': 'l{}'.format(index)}],
+                self._metric(self.namespace, 'diskio_write_time', dimensions, stat='Sum', visible=False,
+                             id='t{}'.format(index)),
+                self._metric(self.namespace, 'diskio_writes', dimensions, stat='Sum', visible=False,
+                             id='w{}'.format(index)),
+            ]
+        return lines
+
+    def _pool_widgets(self, pools):
+        def per_pool(metric_name, stat='Average', suffix=''):
+            return [
+                self._metric(self.namespace, metric_name, {'AutoScalingGroupName': pool['asg_name']},
+                             label=pool['name'] + suffix, stat=stat)
+                for pool in pools
+            ]
+
+        capacity = [
+            self._metric('AWS/AutoScaling', metric_name, {'AutoScalingGroupName': pool['asg_name']},
+                         label=pool['name'] + ' ' + metric_name)
+            for pool in pools
+            for metric_name in ('GroupDesiredCapacity', 'GroupInServiceInstances', 'GroupPendingInstances')
+        ]
+
+        return [
+            self._widget('Node pool capacity', capacity, stat='Maximum'),
+            self._widget('etcd disk write latency (ms)',
+                         self._disk_write_latency([pool for pool in pools if pool['role'] == 'etcd'],
+                                                  etcd_disk=True)),
+            self._widget('CPU active / iowait (%)',
+                         per_pool('cpu_usage_active', suffix=' active') + per_pool('cpu_usage_iowait', suffix=' iowait')),
+            self._widget('Memory used (%)', per_pool('mem_used_percent')),
+            self._widget('Disk write latency (ms)', self._disk_write_latency(pools)),
+            self._widget('Disk IO time (ms)', per_pool('diskio_io_time', stat='Sum')),
+            self._widget('Network bytes sent / received',
+                         per_pool('net_bytes_sent', stat='Sum', suffix=' sent')
+                         + per_pool('net_bytes_recv', stat='Sum', suffix=' received')),
+            self._widget('Disk used (%)', per_pool('disk_used_percent', stat='Maximum')),
+        ]
@@ -0,0 +1,66 @@
+"""Deterministic per-node POD_CIDR allocation.
+
+Every address of the subnets the worker nodes run in gets a fixed index
+(subnets in order, addresses in order within a subnet). A node's pod CIDR is
+the index-th block of size node_mask inside pod_cidr_block, so two nodes can
+only share a pod CIDR if they share a private IP. No lease table is needed and
+nothing has to be cleaned up when nodes go away.
+"""
+import ipaddress
+
+
+def _subnet_ranges(node_subnets):
+    """Yield (network, index offset) for each node subnet CIDR."""
+    offset = 0
+    for cidr in node_subnets:
+        network = ipaddress.ip_network(cidr)
+        yield network, offset
+        offset += network.num_addresses
+
+
+def validate_pod_cidr(node_subnets, pod_cidr_block, node_mask, vpc_cidr=None):
+    """Fail if pod_cidr_block cannot hold one node_mask block per node subnet address."""
+    pod_network = ipaddress.ip_network(pod_cidr_block)
+    if node_mask < pod_network.prefixlen:
+        raise ValueError("pod_cidr_node_mask /{} is larger than pod_cidr_block {}".format(node_mask, pod_cidr_block))
+    if vpc_cidr is not None and pod_network.overlaps(ipaddress.ip_network(vpc_cidr)):
+        raise ValueError("pod_cidr_block {} overlaps vpc_cidr {}".format(pod_cidr_block, vpc_cidr))
+    addresses = sum(ipaddress.ip_network(cidr).num_addresses for cidr in node_subnets)
+    blocks = 2 ** (node_mask - pod_network.prefixlen)
+    if addresses > blocks:
+        needed = node_mask - (addresses - 1).bit_length()
+        raise ValueError(
+            "pod_cidr_block {} has {} /{} blocks for {} node addresses, use a /{} or larger".format(
+                pod_cidr_block, blocks, node_mask, addresses, needed))
+
+
+def allocate_pod_cidr(node_ip, node_subnets, pod_cidr_block, node_mask):
+    """Return the pod CIDR of the node with private IP node_ip (mirrors the UserData fragment)."""
+    address = ipaddress.ip_address(node_ip)
+    pod_network = ipaddress.ip_network(pod_cidr_block)
+    for network, offset in _subnet_ranges(node_subnets):
+        if address in network:
+            index = offset + int(address) - int(network.network_address)
+            first = int(pod_network.network_address) + index * 2 ** (32 - node_mask)
+            return '{}/{}'.format(ipaddress.ip_address(first), node_mask)
+    raise ValueError("{} is not in any node subnet".format(node_ip))
+
+
+def pod_cidr_fragment(node_subnets, pod_cidr_block, node_mask):
+    """UserData lines exporting POD_CIDR for the node with private IP $LOCAL_IPV4."""
+    pod_network = ipaddress.ip_network(pod_cidr_block)
+    lines = [
+        "ip2int() { local IFS=.; set -- $1; echo $(( ($1 << 24) + ($2 << 16) + ($3 << 8) + $4 )); }",
+        "int2ip() { echo \"$(( ($1 >> 24) & 255 )).$(( ($1 >> 16) & 255 )).$(( ($1 >> 8) & 255 )).$(( $1 & 255 ))\"; }",
+        "NODE_IP=$(ip2int \"$LOCAL_IPV4\")",
+        "NODE_INDEX=",
+    ]
+    for network, offset in _subnet_ranges(node_subnets):
+        first = int(network.network_address)
+        lines.append(
+            "if [ $NODE_IP -ge {0} ] && [ $NODE_IP -lt {1} ]; then NODE_INDEX=$(( NODE_IP - {0} + {2} )); fi".format(
+                first, first + network.num_addresses, offset))
+    lines.append(
+        "[ -n \"$NODE_INDEX\" ] && export POD_CIDR=$(int2ip $(( {} + NODE_INDEX * {} )))/{}".format(
+            int(pod_network.network_address), 2 ** (32 - node_mask), node_mask))
+    return lines
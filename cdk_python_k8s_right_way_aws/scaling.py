@@ -0,0 +1,75 @@
+from aws_cdk import (
+    aws_autoscaling as autoscaling,
+    aws_cloudwatch as cloudwatch,
+    core,
+)
+
+
+def add_scaling_policies(asg: autoscaling.AutoScalingGroup, scaling: dict) -> None:
+    """Attach the target tracking and step scaling policies described by scaling to asg.
+
+    scaling keys (all optional):
+    cpu_target: average CPU utilization (%) to track
+    network_in_target / network_out_target: average bytes per second per instance to track
+    step_metric: step scaling on a custom CloudWatch metric, a dict of namespace,
+        metric_name, dimensions, statistic, period (seconds) and steps
+        ([{'lower': .., 'upper': .., 'change': ..}, ...], change in instances)
+    cooldown: seconds between scaling activities of the ASG
+    estimated_instance_warmup: seconds before a new instance counts towards the metrics
+    disable_scale_in: target tracking policies only scale out
+    scale_in_protection: protect new instances from scale-in
+    """
+    cfn_asg = asg.node.default_child
+    warmup = scaling.get('estimated_instance_warmup')
+    warmup = core.Duration.seconds(warmup) if warmup is not None else None
+    disable_scale_in = scaling.get('disable_scale_in', False)
+
+    if scaling.get('cooldown') is not None:
+        cfn_asg.cooldown = str(scaling['cooldown'])
+    if scaling.get('scale_in_protection'):
+        cfn_asg.new_instances_protected_from_scale_in = True
+
+    if scaling.get('cpu_target') is not None:
+        asg.scale_on_cpu_utilization(
+            'cpu-target-tracking',
+            target_utilization_percent=scaling['cpu_target'],
+            estimated_instance_warmup=warmup,
+            disable_scale_in=disable_scale_in
+        )
+    if scaling.get('network_in_target') is not None:
+        asg.scale_on_incoming_bytes(
+            'network-in-target-tracking',
+            target_bytes_per_second=scaling['network_in_target'],
+            estimated_instance_warmup=warmup,
+            disable_scale_in=disable_scale_in
+        )
+    if scaling.get('network_out_target') is not None:
+        asg.scale_on_outgoing_bytes(
+            'network-out-target-tracking',
+            target_bytes_per_second=scaling['network_out_target'],
+            estimated_instance_warmup=warmup,
+            disable_scale_in=disable_scale_in
+        )
+
+    step_metric = scaling.get('step_metric')
+    if step_metric:
+        asg.scale_on_metric(
+            'step-scaling',
+            metric=cloudwatch.Metric(
+                namespace=step_metric['namespace'],
+                metric_name=step_metric['metric_name'],
+                dimensions=step_metric.get('dimensions'),
+                statistic=step_metric.get('statistic', 'Maximum'),
+                period=core.Duration.seconds(step_metric.get('period', 60))
+            ),
+            scaling_steps=[
+                autoscaling.ScalingInterval(
+                    lower=interval.get('lower'),
+                    upper=interval.get('upper'),
+                    change=interval['change']
+                )
+                for interval in step_metric['steps']
+            ],
+            adjustment_type=autoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            estimated_instance_warmup=warmup
+        )
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""etcd snapshots streamed to S3, and their restore on replacement etcd nodes.
+
+save reads the snapshot stream of the local etcd member from the v3 gRPC
+gateway (the Maintenance/Snapshot call etcdctl uses), gzips it on the fly
+and uploads it as S3 multipart parts, several at a time, so the snapshot is
+never staged on disk. Only the current leader saves, so a cron entry on
+every etcd node produces one snapshot per run. latest.json points to the
+newest snapshot.
+
+restore runs on boot. If the data directory is empty and no other etcd
+member answers, it downloads the latest snapshot with parallel ranged GETs,
+decompresses the ranges in order while the next ones download, verifies the
+checksum and runs `etcdctl snapshot restore` for the members of the etcd
+ASGs.
+
+    etcd-backup save
+    etcd-backup restore
+    etcd-backup list
+
+Configured through the environment (or /etc/environment): ETCD_BACKUP_BUCKET,
+ETCD_BACKUP_PREFIX, ETCD_ENDPOINT, ETCD_CACERT, ETCD_CERT, ETCD_KEY,
+ETCD_DATA_DIR, ETCD_CLUSTER_SIZE, ETCD_GROUP_NAMES (etcd ASGs), ETCD_RESTORE_WAIT,
+PROJECT_TAG, VPC_ID and AWS_DEFAULT_REGION.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Gateway path prefixes of the etcd v3 API (etcd 3.4, 3.3)
+GATEWAY_PREFIXES = ('/v3', '/v3beta')
+
+# Smallest part S3 accepts for all but the last part of a multipart upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# gzip level of the snapshots (fast, snapshots compress well anyway)
+COMPRESSION_LEVEL = 3
+
+# Where restore writes the decompressed snapshot
+RESTORE_DIR = '/var/lib/etcd-restore'
+
+
+def load_environment(path='/etc/environment'):
+    """Add the variables of path that are not set yet (cron does not read /etc/environment everywhere)."""
+    try:
+        with open(path) as fp:
+            for line in fp:
+                name, _, value = line.strip().partition('=')
+                if name and not name.startswith('#') and name not in os.environ:
+                    os.environ[name] = value.strip('"')
+    except OSError:
+        pass
+
+
+def log(message, *args):
+    print(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()) + ' ' + message % args, flush=True)
+
+
+def tls_context(cacert=None, cert=None, key=None):
+    """SSL context for the etcd client endpoints; raises OSError (ssl.SSLError included) for missing or bad files."""
+    context = ssl.create_default_context(cafile=cacert)
+    # Members are addressed by IP, their certificates list the IPs
+    context.check_hostname = False
+    if cert:
+        context.load_cert_chain(cert, key)
+    return context
+
+
+class EtcdGateway:
+    """Client of the etcd v3 gRPC gateway of one member (context: a tls_context() to share between members)."""
+
+    def __init__(self, endpoint, cacert=None, cert=None, key=None, timeout=10, context=None):
+        self.endpoint = endpoint.rstrip('/')
+        self.timeout = timeout
+        self.context = context
+        if context is None and self.endpoint.startswith('https://'):
+            self.context = tls_context(cacert, cert, key)
+        self.prefix = None
+
+    def _open(self, path, body=b'{}'):
+        prefixes = [self.prefix] if self.prefix else GATEWAY_PREFIXES
+        for prefix in prefixes:
+            request = urllib.request.Request(self.endpoint + prefix + path, data=body, method='POST')
+            try:
+                response = urllib.request.urlopen(request, timeout=self.timeout, context=self.context)
+            except urllib.error.HTTPError as error:
+                if error.code == 404 and prefix != prefixes[-1]:
+                    continue
+                raise
+            self.prefix = prefix
+            return response
+
+    def status(self):
+        with self._open('/maintenance/status') as response:
+            return json.loads(response.read().decode())
+
+    def is_leader(self):
+        status = self.status()
+        return str(status['leader']) == str(status['header']['member_id'])
+
+    def snapshot(self):
+        """Yield the raw snapshot in chunks, as the member streams it."""
+        with self._open('/maintenance/snapshot') as response:
+            # The gateway streams one JSON message per line
+            for line in response:
+                if not line.strip():
+                    continue
+                message = json.loads(line.decode())
+                if 'error' in message:
+                    raise RuntimeError("etcd snapshot failed: {}".format(message['error']))
+                blob = message.get('result', {}).get('blob')
+                if blob:
+                    yield base64.b64decode(blob)
+
+    def healthy(self):
+        request = urllib.request.Request(self.endpoint + '/health')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout, context=self.context) as response:
+                return json.loads(response.read().decode()).get('health') in (True, 'true')
+        except (ssl.SSLError, OSError, ValueError):
+            return False
+
+
+def gateway_from_environment(endpoint=None, timeout=10):
+    return EtcdGateway(
+        endpoint or os.environ.get('ETCD_ENDPOINT', 'https://127.0.0.1:2379'),
+        cacert=os.environ.get('ETCD_CACERT'),
+        cert=os.environ.get('ETCD_CERT'),
+        key=os.environ.get('ETCD_KEY'),
+        timeout=timeout
+    )
+
+
+def compressed_parts(chunks, part_size, digest):
+    """gzip chunks on the fly, yielding parts of at least part_size bytes (the last one may be smaller).
+
+    digest is updated with the uncompressed data.
+    """
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    buffer = bytearray()
+    for chunk in chunks:
+        digest.update(chunk)
+        buffer += compressor.compress(chunk)
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    buffer += compressor.flush()
+    yield bytes(buffer)
+
+
+def upload_stream(s3, bucket, key, parts, max_workers=4):
+    """Upload parts as one multipart upload, max_workers parts at a time; return the uploaded size.
+
+    At most 2 * max_workers parts are held in memory. The upload is aborted on
+    any failure, so no incomplete parts are left behind.
+    """
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType='application/gzip')['UploadId']
+    size = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = deque()
+            completed = []
+            for number, body in enumerate(parts, 1):
+                size += len(body)
+                in_flight.append((number, executor.submit(
+                    s3.upload_part, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)))
+                if len(in_flight) >= 2 * max_workers:
+                    done_number, future = in_flight.popleft()
+                    completed.append({'PartNumber': done_number, 'ETag': future.result()['ETag']})
+            for done_number, future in in_flight:
+                completed.append({'PartNumber': done_number, 'ETag': future.result()['ETag']})
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': completed})
+    except BaseException:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return size
+
+
+def save(s3, gateway, bucket, prefix, part_size=16 * 1024 * 1024, max_workers=4, force=False):
+    """Stream one snapshot of the member behind gateway to S3; return its latest.json entry, or None if not leader."""
+    if not force and not gateway.is_leader():
+        log("not the etcd leader, skipping the snapshot")
+        return None
+    revision = gateway.status()['header'].get('revision', '0')
+    key = prefix + 'snapshots/' + time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()) + '-rev' + str(revision) + '.db.gz'
+    start = time.time()
+    digest = hashlib.sha256()
+    size = upload_stream(
+        s3, bucket, key, compressed_parts(gateway.snapshot(), max(part_size, MIN_PART_SIZE), digest), max_workers)
+    latest = {'key': key, 'size': size, 'sha256': digest.hexdigest(), 'revision': str(revision), 'time': time.time()}
+    s3.put_object(Bucket=bucket, Key=prefix + 'latest.json', Body=json.dumps(latest).encode(),
+                  ContentType='application/json')
+    log("saved s3://%s/%s (%d bytes compressed) in %.1fs", bucket, key, size, time.time() - start)
+    return latest
+
+
+def latest_snapshot(s3, bucket, prefix):
+    """The latest.json entry, or the newest snapshot object (without checksum) if there is none; None if no snapshot."""
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=prefix + 'latest.json')['Body'].read().decode())
+    except s3.exceptions.NoSuchKey:
+        pass
+    newest = None
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix + 'snapshots/'):
+        for item in page.get('Contents', []):
+            if newest is None or item['Key'] > newest['Key']:
+                newest = item
+    if newest is None:
+        return None
+    return {'key': newest['Key'], 'size': newest['Size'], 'sha256': None}
+
+
+def ranged_chunks(s3, bucket, key, size, part_size=8 * 1024 * 1024, max_workers=16):
+    """Yield the object in order, downloaded with up to max_workers ranged GETs in parallel.
+
+    Downloads run up to 2 * max_workers ranges ahead of the consumer.
+    """
+    def get(start, end):
+        return s3.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end))['Body'].read()
+
+    ranges = deque((start, min(start + part_size, size) - 1) for start in range(0, size, part_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < 2 * max_workers:
+                in_flight.append(executor.submit(get, *ranges.popleft()))
+            yield in_flight.popleft().result()
+
+
+def download_snapshot(s3, bucket, snapshot, path, part_size=8 * 1024 * 1024, max_workers=16):
+    """Download and decompress snapshot to path, verifying its checksum; return the elapsed seconds."""
+    start = time.time()
+    decompressor = zlib.decompressobj(31)
+    digest = hashlib.sha256()
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as fp:
+        for chunk in ranged_chunks(s3, bucket, snapshot['key'], snapshot['size'], part_size, max_workers):
+            data = decompressor.decompress(chunk)
+            digest.update(data)
+            fp.write(data)
+        data = decompressor.flush()
+        digest.update(data)
+        fp.write(data)
+    if snapshot.get('sha256') and digest.hexdigest() != snapshot['sha256']:
+        os.unlink(tmp_path)
+        raise ValueError("Checksum mismatch for {}: expected {}, got {}".format(
+            snapshot['key'], snapshot['sha256'], digest.hexdigest()))
+    os.replace(tmp_path, path)
+    return time.time() - start
+
+
+def etcd_members(ec2, project, cluster_size, vpc_id=None, group_names=None, timeout=240, sleep=time.sleep):
+    """Return [(name, private IP)] of the running etcd nodes of project, once cluster_size of them run.
+
+    Clusters of one app share the Project and Name tags, so the nodes are
+    also selected by vpc_id and the names of the etcd ASGs (group_names).
+    """
+    filters = [
+        {'Name': 'tag:Project', 'Values': [project]},
+        {'Name': 'instance-state-name', 'Values': ['pending', 'running']},
+    ]
+    if group_names:
+        filters.append({'Name': 'tag:aws:autoscaling:groupName', 'Values': list(group_names)})
+    else:
+        filters.append({'Name': 'tag:Name', 'Values': [project + '-etcd', project + '-etcd-*']})
+    if vpc_id:
+        filters.append({'Name': 'vpc-id', 'Values': [vpc_id]})
+    deadline = time.time() + timeout
+    while True:
+        members = []
+        for page in ec2.get_paginator('describe_instances').paginate(Filters=filters):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    if instance.get('PrivateIpAddress') and instance.get('PrivateDnsName'):
+                        # The short hostname, like `hostname -s` on the node
+                        members.append((instance['PrivateDnsName'].split('.')[0], instance['PrivateIpAddress']))
+        if len(members) >= cluster_size:
+            return sorted(members)
+        if time.time() > deadline:
+            raise RuntimeError("only {} of {} etcd nodes running after {}s".format(len(members), cluster_size, timeout))
+        sleep(10)
+
+
+def restore(s3, ec2, bucket, prefix, data_dir, project, cluster_size, local_ip, part_size, max_workers,
+            vpc_id=None, group_names=None, wait=240, cluster_token='etcd-cluster-0'):
+    """Restore the latest snapshot into an empty data_dir, unless another member of the cluster is healthy.
+
+    Waits at most wait seconds for the other etcd nodes, restore runs
+    during the node's boot. Without usable TLS files (ETCD_CACERT, ETCD_CERT,
+    ETCD_KEY) the other members cannot be asked, so nothing is restored: a
+    node replacing a member gets its certificates after boot.
+    """
+    if os.path.isdir(os.path.join(data_dir, 'member')):
+        log("%s holds etcd data, nothing to restore", data_dir)
+        return 0
+    snapshot = latest_snapshot(s3, bucket, prefix)
+    if snapshot is None:
+        log("no snapshot in s3://%s/%s, starting empty", bucket, prefix)
+        return 0
+    try:
+        context = tls_context(os.environ.get('ETCD_CACERT'), os.environ.get('ETCD_CERT'), os.environ.get('ETCD_KEY'))
+    except OSError as error:
+        log("etcd TLS files not usable (%s), peers unknown, not restoring", error)
+        return 0
+
+    members = etcd_members(ec2, project, cluster_size, vpc_id, group_names, timeout=wait)
+    peers = [ip for _, ip in members if ip != local_ip]
+    if any(EtcdGateway('https://' + ip + ':2379', timeout=2, context=context).healthy() for ip in peers):
+        # The cluster is alive: this node has to join it (etcdctl member add), not restore
+        log("etcd cluster is healthy, not restoring; add this node with etcdctl member add")
+        return 0
+
+    os.makedirs(RESTORE_DIR, exist_ok=True)
+    path = os.path.join(RESTORE_DIR, 'snapshot.db')
+    seconds = download_snapshot(s3, bucket, snapshot, path, part_size, max_workers)
+    log("downloaded s3://%s/%s (%d bytes compressed) in %.1fs", bucket, snapshot['key'], snapshot['size'], seconds)
+
+    etcdctl = shutil.which('etcdctl')
+    if etcdctl is None:
+        log("etcdctl not installed, restore %s manually", path)
+        return 0
+    names = {ip: name for name, ip in members}
+    if local_ip not in names:
+        raise RuntimeError("this node ({}) is not among the etcd nodes {}".format(local_ip, members))
+    if os.path.isdir(data_dir):
+        # etcdctl refuses existing data directories, data_dir may be a mount point
+        restore_dir = os.path.join(RESTORE_DIR, 'data')
+        shutil.rmtree(restore_dir, ignore_errors=True)
+    else:
+        restore_dir = data_dir
+    start = time.time()
+    subprocess.run([
+        etcdctl, 'snapshot', 'restore', path,
+        '--name', names[local_ip],
+        '--initial-cluster', ','.join('{}=https://{}:2380'.format(name, ip) for name, ip in members),
+        '--initial-cluster-token', cluster_token,
+        '--initial-advertise-peer-urls', 'https://{}:2380'.format(local_ip),
+        '--data-dir', restore_dir,
+    ], check=True, env=dict(os.environ, ETCDCTL_API='3'))
+    if restore_dir != data_dir:
+        # data_dir may be on another volume
+        shutil.move(os.path.join(restore_dir, 'member'), os.path.join(data_dir, 'member'))
+    os.unlink(path)
+    log("restored revision %s into %s in %.1fs", snapshot.get('revision', '?'), data_dir, time.time() - start)
+    return 0
+
+
+def main(argv=None):
+    load_environment()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['save', 'restore', 'list'])
+    parser.add_argument('--bucket', default=os.environ.get('ETCD_BACKUP_BUCKET'))
+    parser.add_argument('--prefix', default=os.environ.get('ETCD_BACKUP_PREFIX', ''))
+    parser.add_argument('--part-size-mb', type=int, default=None,
+                        help='multipart upload part size (save, default 16) or GET range size (restore, default 8)')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='concurrent part uploads (save, default 4) or ranged GETs (restore, default 16)')
+    parser.add_argument('--wait', type=int, default=int(os.environ.get('ETCD_RESTORE_WAIT', '240')),
+                        help='seconds restore waits for the other etcd nodes (default 240)')
+    parser.add_argument('--force', action='store_true', help='save even if this member is not the leader')
+    args = parser.parse_args(argv)
+    if not args.bucket:
+        parser.error('--bucket or ETCD_BACKUP_BUCKET is required')
+
+    import boto3
+
+    region = os.environ.get('AWS_DEFAULT_REGION')
+    s3 = boto3.client('s3', region_name=region)
+    if args.command == 'save':
+        save(s3, gateway_from_environment(), args.bucket, args.prefix, (args.part_size_mb or 16) * 1024 * 1024,
+             args.max_workers or 4, args.force)
+        return 0
+    if args.command == 'list':
+        print(json.dumps(latest_snapshot(s3, args.bucket, args.prefix), indent=2))
+        return 0
+    return restore(
+        s3,
+        boto3.client('ec2', region_name=region),
+        args.bucket,
+        args.prefix,
+        os.environ.get('ETCD_DATA_DIR', '/var/lib/etcd'),
+        os.environ['PROJECT_TAG'],
+        int(os.environ.get('ETCD_CLUSTER_SIZE', '3')),
+        os.environ.get('INTERNAL_IP'),
+        (args.part_size_mb or 8) * 1024 * 1024,
+        args.max_workers or 16,
+        vpc_id=os.environ.get('VPC_ID'),
+        group_names=[name for name in os.environ.get('ETCD_GROUP_NAMES', '').split(',') if name],
+        wait=args.wait
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
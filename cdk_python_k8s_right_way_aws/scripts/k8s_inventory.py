@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Node inventory of the cluster, from one paginated describe_instances sweep.
+
+All running instances of the VPC carrying the cluster's Project tag are read
+in a single paginated call and indexed by role and Availability Zone, using
+the Name tags the stack sets (<project>-etcd, <project>-k8s-master,
+<project>-k8s-worker[-<pool>], <project>-bastion). The index is cached on
+disk for --ttl seconds, so host lists for fan-out are printed without any
+API call.
+
+    k8s-inventory list
+    k8s-inventory ssh-config >> ~/.ssh/config
+    k8s-inventory tmux --role worker    # host list for ~/tmux-multi.sh
+    k8s-inventory ansible > hosts.ini
+
+Installed on the bastion, where VPC_ID, PROJECT_TAG and AWS_DEFAULT_REGION
+come from /etc/environment.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Node roles and the suffix of their Name tag (as set by the stack)
+NAME_SUFFIXES = {
+    'bastion': '-bastion',
+    'etcd': '-etcd',
+    'master': '-k8s-master',
+    'worker': '-k8s-worker',
+}
+
+# SSH user per role (Ubuntu nodes, Amazon Linux bastion)
+SSH_USERS = {
+    'bastion': 'ec2-user',
+    'etcd': 'ubuntu',
+    'master': 'ubuntu',
+    'worker': 'ubuntu',
+}
+
+CACHE_FILE = os.path.expanduser('~/.cache/k8s-inventory.json')
+
+
+def parse_name(name, project):
+    """Return (role, pool) of a node Name tag, or None if it is not a node of project."""
+    if not name or not name.startswith(project):
+        return None
+    rest = name[len(project):]
+    # Longest suffix first, '-k8s-worker-<pool>' must not match a shorter role suffix
+    for role, suffix in sorted(NAME_SUFFIXES.items(), key=lambda item: -len(item[1])):
+        if rest == suffix:
+            return role, role
+        if rest.startswith(suffix + '-'):
+            return role, rest[len(suffix) + 1:]
+    return None
+
+
+def sweep(ec2, project, vpc_id=None):
+    """Return the index role => AZ => [node], from one paginated describe_instances call."""
+    filters = [
+        {'Name': 'tag:Project', 'Values': [project]},
+        {'Name': 'instance-state-name', 'Values': ['running']},
+    ]
+    if vpc_id:
+        filters.append({'Name': 'vpc-id', 'Values': [vpc_id]})
+    index = {}
+    for page in ec2.get_paginator('describe_instances').paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                parsed = parse_name(tags.get('Name'), project)
+                if parsed is None:
+                    continue
+                role, pool = parsed
+                zone = instance['Placement']['AvailabilityZone']
+                index.setdefault(role, {}).setdefault(zone, []).append({
+                    'instance_id': instance['InstanceId'],
+                    'pool': pool,
+                    'private_ip': instance.get('PrivateIpAddress'),
+                    'hostname': instance.get('PrivateDnsName'),
+                    'launch_time': str(instance.get('LaunchTime')),
+                })
+    for zones in index.values():
+        for nodes in zones.values():
+            nodes.sort(key=lambda node: (node['pool'], node['launch_time'], node['instance_id']))
+    return index
+
+
+def load_index(project, vpc_id, region, ttl, refresh=False, cache_file=CACHE_FILE):
+    """Return the cached index if it is younger than ttl seconds, else sweep and cache it."""
+    key = '{}|{}|{}'.format(project, vpc_id or '', region or '')
+    try:
+        with open(cache_file) as fp:
+            cached = json.load(fp)
+        if not refresh and cached.get('key') == key and time.time() - cached['time'] < ttl:
+            return cached['index']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import boto3
+
+    index = sweep(boto3.client('ec2', region_name=region), project, vpc_id)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump({'key': key, 'time': time.time(), 'index': index}, fp)
+    os.replace(tmp_path, cache_file)
+    return index
+
+
+def select(index, roles=None, zones=None):
+    """Yield (role, zone, node) in role, zone and pool order, optionally filtered."""
+    for role in sorted(index):
+        if roles and role not in roles:
+            continue
+        for zone in sorted(index[role]):
+            if zones and zone not in zones:
+                continue
+            for node in index[role][zone]:
+                yield role, zone, node
+
+
+def host_alias(zone, node, number):
+    """Stable SSH alias, e.g. worker-a-1 or worker-spot-b-2."""
+    return '{}-{}-{}'.format(node['pool'], zone[-1], number)
+
+
+def numbered(nodes):
+    """Number the nodes per pool and AZ, starting at 1."""
+    counters = {}
+    for role, zone, node in nodes:
+        key = (node['pool'], zone)
+        counters[key] = counters.get(key, 0) + 1
+        yield role, zone, node, counters[key]
+
+
+def ssh_config(nodes, bastion_host=None):
+    lines = []
+    for role, zone, node, number in numbered(nodes):
+        lines += [
+            'Host ' + host_alias(zone, node, number),
+            '    HostName ' + node['private_ip'],
+            '    User ' + SSH_USERS[role],
+        ]
+        if bastion_host and role != 'bastion':
+            lines.append('    ProxyJump ' + bastion_host)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def tmux_hosts(nodes):
+    """Space separated user@ip list, the host list tmux-multi.sh takes."""
+    return ' '.join(SSH_USERS[role] + '@' + node['private_ip'] for role, zone, node in nodes)
+
+
+def ansible_inventory(nodes):
+    """INI inventory with one group per role, per pool and per role and AZ."""
+    groups = {}
+    for role, zone, node, number in numbered(nodes):
+        host = '{} ansible_host={} ansible_user={} instance_id={}'.format(
+            host_alias(zone, node, number), node['private_ip'], SSH_USERS[role], node['instance_id'])
+        for group in (role, role + '_' + zone.replace('-', '_'), 'pool_' + node['pool'].replace('-', '_')):
+            groups.setdefault(group, []).append(host)
+    lines = []
+    for group in sorted(groups):
+        lines.append('[' + group + ']')
+        lines += groups[group]
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output', choices=['list', 'ssh-config', 'tmux', 'ansible'])
+    parser.add_argument('--role', action='append', choices=sorted(NAME_SUFFIXES), help='only nodes of this role')
+    parser.add_argument('--az', action='append', help='only nodes in this Availability Zone')
+    parser.add_argument('--project', default=os.environ.get('PROJECT_TAG'), help='Project tag of the cluster')
+    parser.add_argument('--vpc-id', default=os.environ.get('VPC_ID'))
+    parser.add_argument('--region', default=os.environ.get('AWS_DEFAULT_REGION'))
+    parser.add_argument('--ttl', type=int, default=300, help='seconds the cached index is used')
+    parser.add_argument('--refresh', action='store_true', help='ignore the cache')
+    parser.add_argument('--bastion-host', help='ProxyJump host for ssh-config (when used off the bastion)')
+    args = parser.parse_args(argv)
+    if not args.project:
+        parser.error('--project or PROJECT_TAG is required')
+
+    index = load_index(args.project, args.vpc_id, args.region, args.ttl, args.refresh)
+    nodes = list(select(index, args.role, args.az))
+    if args.output == 'list':
+        print(json.dumps(
+            {role: {zone: index[role][zone] for zone in index[role] if not args.az or zone in args.az}
+             for role in index if not args.role or role in args.role},
+            indent=2, sort_keys=True))
+    elif args.output == 'ssh-config':
+        print(ssh_config(nodes, args.bastion_host))
+    elif args.output == 'tmux':
+        print(tmux_hosts(nodes))
+    else:
+        print(ansible_inventory(nodes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Declarative security group rules, compiled into as few ingress rules as possible.
+
+A rule opens ports of one security group (to) for a peer (from), both given
+by name: security groups are resolved by the stack, CIDR peers through the
+cidrs mapping (e.g. workstation, vpc, any). ports is 'all', '<protocol>:<port>'
+or '<protocol>:<from>-<to>'. A rule with when (setting => value) only
+applies if all those settings match.
+
+Per security group and peer, compile_rules() keeps a single 'all' rule if
+there is one (with the description of the 'all' rules only), otherwise
+merges overlapping and adjacent port ranges of each protocol. Rules of a CIDR peer that a wider CIDR peer of the same security
+group already covers are dropped.
+"""
+import ipaddress
+
+# Longest description EC2 accepts for a rule
+MAX_DESCRIPTION = 255
+
+
+def parse_ports(ports):
+    """Return (protocol, from_port, to_port) of a ports spec."""
+    if ports == 'all':
+        return 'all', 0, 65535
+    protocol, _, port_range = ports.partition(':')
+    from_port, _, to_port = port_range.partition('-')
+    return protocol, int(from_port), int(to_port or from_port)
+
+
+def validate_rules(rules, security_groups, cidrs):
+    """Raise ValueError for rules naming an unknown security group, peer or ports spec."""
+    for rule in rules:
+        if rule['to'] not in security_groups:
+            raise ValueError("security group rule {}: unknown security group '{}'".format(rule, rule['to']))
+        if rule['from'] not in security_groups and rule['from'] not in cidrs:
+            raise ValueError("security group rule {}: unknown peer '{}'".format(rule, rule['from']))
+        try:
+            protocol, from_port, to_port = parse_ports(rule['ports'])
+        except ValueError:
+            raise ValueError("security group rule {}: invalid ports '{}'".format(rule, rule['ports']))
+        if protocol not in ('all', 'tcp', 'udp') or not 0 <= from_port <= to_port <= 65535:
+            raise ValueError("security group rule {}: invalid ports '{}'".format(rule, rule['ports']))
+
+
+def applicable_rules(rules, settings):
+    """The rules whose when conditions match settings."""
+    return [
+        rule for rule in rules
+        if all(settings.get(name) == value for name, value in rule.get('when', {}).items())
+    ]
+
+
+def _description(descriptions):
+    unique = []
+    for description in descriptions:
+        if description not in unique:
+            unique.append(description)
+    return ', '.join(unique)[:MAX_DESCRIPTION]
+
+
+def _merge_ranges(ranges):
+    """Merge overlapping and adjacent (from_port, to_port, descriptions) ranges."""
+    merged = []
+    for from_port, to_port, descriptions in sorted(ranges):
+        if merged and from_port <= merged[-1][1] + 1:
+            last_from, last_to, last_descriptions = merged[-1]
+            merged[-1] = (last_from, max(last_to, to_port), last_descriptions + descriptions)
+        else:
+            merged.append((from_port, to_port, list(descriptions)))
+    return merged
+
+
+def _covers(wider, narrower):
+    return wider[1] == 'all' or (
+        wider[1] == narrower[1] and wider[2] <= narrower[2] and narrower[3] <= wider[3])
+
+
+def compile_rules(rules, cidrs):
+    """Return security group => [(peer, protocol, from_port, to_port, description)], sorted by peer and port."""
+    grouped = {}
+    for rule in rules:
+        protocol, from_port, to_port = parse_ports(rule['ports'])
+        ranges = grouped.setdefault(rule['to'], {}).setdefault(rule['from'], {})
+        ranges.setdefault(protocol, []).append((from_port, to_port, [rule.get('description', '')]))
+
+    compiled = {}
+    for security_group, peers in grouped.items():
+        entries = []
+        for peer, protocols in peers.items():
+            if 'all' in protocols:
+                # The port rules it absorbs are dropped, descriptions included
+                descriptions = [description for _, _, descs in protocols['all'] for description in descs]
+                entries.append((peer, 'all', 0, 65535, _description(descriptions)))
+                continue
+            for protocol, ranges in protocols.items():
+                for from_port, to_port, descriptions in _merge_ranges(ranges):
+                    entries.append((peer, protocol, from_port, to_port, _description(descriptions)))
+
+        def network(peer):
+            return ipaddress.ip_network(cidrs[peer]) if peer in cidrs else None
+
+        def subnet_of(narrower, wider):
+            return (narrower.version == wider.version and wider.network_address <= narrower.network_address
+                    and narrower.broadcast_address <= wider.broadcast_address)
+
+        # CIDR peers inside a wider CIDR peer with the same or more ports add nothing
+        kept = []
+        for entry in entries:
+            entry_network = network(entry[0])
+            redundant = entry_network is not None and any(
+                other[0] != entry[0] and network(other[0]) is not None
+                and subnet_of(entry_network, network(other[0])) and _covers(other, entry)
+                and (network(other[0]) != entry_network or other[0] < entry[0])
+                for other in entries
+            )
+            if not redundant:
+                kept.append(entry)
+        compiled[security_group] = sorted(kept)
+    return compiled
+
+
+def rule_counts(rules, compiled):
+    """Return security group => (declared rules, compiled rules)."""
+    declared = {}
+    for rule in rules:
+        declared[rule['to']] = declared.get(rule['to'], 0) + 1
+    return {security_group: (declared[security_group], len(entries)) for security_group, entries in compiled.items()}
@@ -0,0 +1,265 @@
+"""Composable UserData fragments, compiled into one bootstrap script per node.
+
+A node's UserData is built from three parts:
+
+* a single IMDSv2 pass that fetches one session token and the instance
+  identity document, exporting AWS_REGION, AVAILABILITY_ZONE, INSTANCE_ID and
+  LOCAL_IPV4 for everything that follows,
+* optional prepare commands deriving more facts from those (e.g. POD_CIDR),
+* one atomic rewrite of /etc/environment with all variables of the node,
+* steps (named lists of commands) which are independent of each other and run
+  in parallel; the commands inside a step run in order,
+* final steps depending on all of them, run one after the other.
+
+Nodes of a warm pool run all of that once, on entry to the pool, and leave
+the node-specific part (the pool's own commands) to node-in-service, which
+waits until the instance heads into service; both complete the node's
+launching lifecycle action (see compile_user_data's lifecycle_hook).
+
+Every step is timed: step_event writes one JSON event per step (start, end,
+exit code, seconds since boot) to BOOTSTRAP_EVENTS_LOG and, prefixed with
+BOOTSTRAP_EVENT, to the cloud-init output. The final 'ready' event marks the
+end of the bootstrap. benchmarks/boot_times.py turns them into per-role,
+per-step percentiles.
+
+UserData runs as root, so the fragments do not use sudo.
+"""
+
+IMDS_URL = 'http://169.254.169.254/latest'
+
+# Seconds the IMDSv2 session token stays valid
+IMDS_TOKEN_TTL = 300
+
+# Bootstrap step events, one JSON object per line
+BOOTSTRAP_EVENTS_LOG = '/var/log/bootstrap-events.log'
+
+# Node-specific bootstrap of warm pool nodes, run when they move into service
+IN_SERVICE_SCRIPT = '/usr/local/sbin/node-in-service'
+IN_SERVICE_UNIT = '/etc/systemd/system/node-in-service.service'
+
+
+def step(name, *commands):
+    """Return a named bootstrap step running commands in order."""
+    return {'name': name, 'commands': list(commands)}
+
+
+def data_volume_step(mount_point, instance_store=False):
+    """Step formatting the node's data disk and mounting it on mount_point.
+
+    The disk is the first one that is not the root disk; with instance_store
+    only NVMe instance storage qualifies. An existing filesystem (e.g. after a
+    reboot) is kept.
+    """
+    model_filter = " | grep 'Instance Storage'" if instance_store else ""
+    return step(
+        'data-volume',
+        "ROOT_DISK=/dev/$(lsblk -no PKNAME \"$(findmnt -no SOURCE /)\")",
+        "DATA_DISK=$(lsblk -dpno NAME,TYPE,MODEL | awk '$2 == \"disk\"'" + model_filter
+        + " | awk '{print $1}' | grep -vx \"$ROOT_DISK\" | head -1)",
+        "test -n \"$DATA_DISK\"",
+        "{ blkid \"$DATA_DISK\" || mkfs.ext4 -q -m 0 \"$DATA_DISK\"; }",
+        "mkdir -p " + mount_point,
+        "echo \"UUID=$(blkid -s UUID -o value \"$DATA_DISK\") " + mount_point
+        + " ext4 defaults,noatime,nofail 0 2\" >> /etc/fstab",
+        "mount " + mount_point,
+        "chmod 700 " + mount_point
+    )
+
+
+def _identity_field(field):
+    """Shell expression extracting field from the identity document in $IDENTITY."""
+    return "$(printf '%s' \"$IDENTITY\" | sed -n 's/.*\"" + field + "\" *: *\"\\([^\"]*\\)\".*/\\1/p')"
+
+
+def imds_fragment():
+    """Fetch one IMDSv2 token and the identity document, exporting the instance facts."""
+    return [
+        "IMDS_TOKEN=$(curl -s -X PUT " + IMDS_URL + "/api/token -H 'X-aws-ec2-metadata-token-ttl-seconds: "
+        + str(IMDS_TOKEN_TTL) + "')",
+        "imds() { curl -s -H \"X-aws-ec2-metadata-token: $IMDS_TOKEN\" " + IMDS_URL + "/$1; }",
+        "IDENTITY=$(imds dynamic/instance-identity/document)",
+        "export AWS_REGION=" + _identity_field('region'),
+        "export AVAILABILITY_ZONE=" + _identity_field('availabilityZone'),
+        "export INSTANCE_ID=" + _identity_field('instanceId'),
+        "export LOCAL_IPV4=" + _identity_field('privateIp'),
+    ]
+
+
+def instrumentation_fragment(labels=None):
+    """Start the bootstrap clock and define step_event NAME START_MS EXIT_CODE.
+
+    step_event logs the event of one step, labelled with labels (constant
+    strings, e.g. role and pool), and returns EXIT_CODE.
+    """
+    fields = ''.join(',"{}":"{}"'.format(name, value) for name, value in sorted((labels or {}).items()))
+    return [
+        "BOOTSTRAP_START=$(date +%s%3N)",
+        "step_event() {",
+        "  local EVENT",
+        "  EVENT=$(printf '{\"instance_id\":\"%s\"" + fields + ",\"step\":\"%s\",\"start_ms\":%s,"
+        "\"end_ms\":%s,\"exit_code\":%s,\"uptime_s\":%s}' \"$INSTANCE_ID\" \"$1\" \"$2\" \"$(date +%s%3N)\" \"$3\" "
+        "\"$(cut -d' ' -f1 /proc/uptime)\")",
+        "  echo \"$EVENT\" >> " + BOOTSTRAP_EVENTS_LOG,
+        "  echo \"BOOTSTRAP_EVENT $EVENT\"",
+        "  return $3",
+        "}",
+    ]
+
+
+def environment_fragment(environment):
+    """Append environment (name => shell value) to /etc/environment in one atomic replace."""
+    # Evaluate every value exactly once, so later steps see what was written
+    lines = ["export " + name + "=\"" + value + "\"" for name, value in environment.items()]
+    lines += ["ENV_FILE=$(mktemp /etc/environment.XXXXXX)", "{", "  cat /etc/environment"]
+    for name in environment:
+        lines.append("  echo \"" + name + "=$" + name + "\"")
+    lines += [
+        "} > \"$ENV_FILE\"",
+        "chmod 644 \"$ENV_FILE\" && mv \"$ENV_FILE\" /etc/environment",
+    ]
+    return lines
+
+
+def steps_fragment(steps):
+    """Run steps in parallel, each timed in its own subshell, and fail if any of them failed."""
+    lines = ["BOOTSTRAP_FAILED=0"]
+    for index, bootstrap_step in enumerate(steps):
+        lines.append(
+            "( STEP_START=$(date +%s%3N); ( " + " && ".join(bootstrap_step['commands'])
+            + " ); step_event " + bootstrap_step['name'] + " \"$STEP_START\" $? ) &")
+        lines.append("STEP_PID_{}=$!".format(index))
+    for index, bootstrap_step in enumerate(steps):
+        lines.append(
+            "wait $STEP_PID_{0} || {{ echo \"bootstrap step {1} failed\" >&2; BOOTSTRAP_FAILED=1; }}".format(
+                index, bootstrap_step['name']))
+    return lines
+
+
+def final_steps_fragment(steps):
+    """Run steps one after the other, each timed, recording failures like steps_fragment()."""
+    lines = []
+    for bootstrap_step in steps:
+        lines.append(
+            "STEP_START=$(date +%s%3N); ( " + " && ".join(bootstrap_step['commands'])
+            + " ); step_event " + bootstrap_step['name'] + " \"$STEP_START\" $? || { echo \"bootstrap step "
+            + bootstrap_step['name'] + " failed\" >&2; BOOTSTRAP_FAILED=1; }")
+    return lines
+
+
+def lifecycle_fragment(lifecycle_hook):
+    """Define target_state (the instance's target lifecycle state) and complete_lifecycle RESULT.
+
+    lifecycle_hook is a dict of the auto_scaling_group_name and
+    lifecycle_hook_name of the node's launching lifecycle hook.
+    """
+    return [
+        # Own token per call, the one of imds_fragment() expires during long steps
+        "target_state() {",
+        "  curl -s -H \"X-aws-ec2-metadata-token: $(curl -s -X PUT " + IMDS_URL + "/api/token "
+        "-H 'X-aws-ec2-metadata-token-ttl-seconds: 60')\" " + IMDS_URL + "/meta-data/autoscaling/target-lifecycle-state",
+        "}",
+        "complete_lifecycle() {",
+        "  aws autoscaling complete-lifecycle-action --region \"$AWS_REGION\" --auto-scaling-group-name "
+        + lifecycle_hook['auto_scaling_group_name'] + " --lifecycle-hook-name " + lifecycle_hook['lifecycle_hook_name']
+        + " --instance-id \"$INSTANCE_ID\" --lifecycle-action-result \"$1\"",
+        "}",
+    ]
+
+
+def post_commands_fragment(post_commands):
+    """Run the node's own commands in order after the bootstrap steps, timed as one user-data step.
+
+    Like a step they run in a subshell and stop at the first failure, which
+    fails the bootstrap.
+    """
+    if not post_commands:
+        return []
+    return [
+        "USER_DATA_START=$(date +%s%3N)",
+        "( " + " && ".join(post_commands) + " )",
+        "step_event user-data \"$USER_DATA_START\" $? || { echo \"user-data failed\" >&2; BOOTSTRAP_FAILED=1; }",
+    ]
+
+
+def completion_fragment():
+    """Complete the lifecycle action: CONTINUE, or ABANDON (the ASG replaces the node) if a step failed."""
+    return ["complete_lifecycle \"$(test \"$BOOTSTRAP_FAILED\" = 0 && echo CONTINUE || echo ABANDON)\""]
+
+
+def in_service_fragment(post_commands, labels, lifecycle_hook):
+    """Install node-in-service, running post_commands once the warm pool node heads into service.
+
+    It polls the target lifecycle state, so it picks up both a stopped node
+    booting again and a hibernated one resuming, then disables itself.
+    """
+    script = ["#!/bin/bash"] + lifecycle_fragment(lifecycle_hook) + [
+        "until [ \"$(target_state)\" = InService ]; do sleep 1; done",
+    ]
+    script += instrumentation_fragment(labels)
+    script += imds_fragment()
+    script += [
+        "set -a; . /etc/environment; set +a",
+        "BOOTSTRAP_FAILED=0",
+    ]
+    script += post_commands_fragment(post_commands)
+    script.append("step_event ready \"$BOOTSTRAP_START\" \"$BOOTSTRAP_FAILED\"")
+    script += completion_fragment()
+    script.append("systemctl disable node-in-service.service")
+    unit = [
+        "[Unit]",
+        "Description=Node-specific bootstrap of a warm pool node moving into service",
+        "Wants=network-online.target",
+        "After=network-online.target",
+        "[Service]",
+        "Type=simple",
+        "ExecStart=" + IN_SERVICE_SCRIPT,
+        "[Install]",
+        "WantedBy=multi-user.target",
+    ]
+    return [
+        "cat > " + IN_SERVICE_SCRIPT + " <<'IN_SERVICE'",
+    ] + script + [
+        "IN_SERVICE",
+        "chmod 755 " + IN_SERVICE_SCRIPT,
+        "cat > " + IN_SERVICE_UNIT + " <<'IN_SERVICE_UNIT'",
+    ] + unit + [
+        "IN_SERVICE_UNIT",
+        "systemctl daemon-reload",
+        "systemctl enable node-in-service.service",
+        # Not waiting for it, it runs until the node is stopped or hibernated
+        "systemctl start --no-block node-in-service.service",
+    ]
+
+
+def compile_user_data(environment, steps, post_commands=None, prepare_commands=None, labels=None, final_steps=None,
+                      lifecycle_hook=None):
+    """Compile the bootstrap of one node into a list of UserData lines.
+
+    final_steps run one after the other once all steps are done (e.g. when
+    they need the packages and the mounted data volume).
+    labels are added to every step event (e.g. {'role': 'etcd', 'pool': 'etcd'}).
+    With lifecycle_hook (see lifecycle_fragment()) the node completes its
+    launching lifecycle action; when it launches into a warm pool,
+    post_commands are left to node-in-service (see in_service_fragment()).
+    """
+    lines = instrumentation_fragment(labels)
+    lines += imds_fragment()
+    lines += prepare_commands or []
+    lines += environment_fragment(environment)
+    lines.append("step_event prepare \"$BOOTSTRAP_START\" 0")
+    lines += steps_fragment(steps)
+    lines += final_steps_fragment(final_steps or [])
+    if lifecycle_hook:
+        lines += lifecycle_fragment(lifecycle_hook)
+        lines += ["case \"$(target_state)\" in", "Warmed:*)"]
+        lines += in_service_fragment(post_commands, labels, lifecycle_hook)
+        lines += ["step_event warmed \"$BOOTSTRAP_START\" \"$BOOTSTRAP_FAILED\"", ";;", "*)"]
+        lines += post_commands_fragment(post_commands)
+        lines += ["step_event ready \"$BOOTSTRAP_START\" \"$BOOTSTRAP_FAILED\"", ";;", "esac"]
+        lines += completion_fragment()
+    else:
+        lines += post_commands_fragment(post_commands)
+        lines.append("step_event ready \"$BOOTSTRAP_START\" \"$BOOTSTRAP_FAILED\"")
+    # Exit status of the script for cloud-init
+    lines.append("test \"$BOOTSTRAP_FAILED\" = 0")
+    return lines
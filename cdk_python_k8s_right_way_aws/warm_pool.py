@@ -0,0 +1,81 @@
+from aws_cdk import (
+    aws_autoscaling as autoscaling,
+    aws_iam as iam,
+    core,
+)
+
+# Launching lifecycle hook the nodes of a warm pool ASG complete themselves
+LIFECYCLE_HOOK_NAME = 'bootstrap'
+
+POOL_STATES = ('Stopped', 'Hibernated')
+
+
+def validate_warm_pool(pool: dict, warm_pool: dict) -> None:
+    """Raise ValueError for a warm pool the node pool cannot have."""
+    if pool['role'] not in ('master', 'worker'):
+        raise ValueError("Node pool '{}': warm pools are supported for master and worker pools only".format(
+            pool['name']))
+    if pool.get('instance_types'):
+        raise ValueError("Node pool '{}': warm pools do not support mixed instances pools".format(pool['name']))
+    if warm_pool.get('pool_state', 'Stopped') not in POOL_STATES:
+        raise ValueError("Node pool '{}': unknown warm pool pool_state '{}'".format(
+            pool['name'], warm_pool['pool_state']))
+    if not 0 <= warm_pool.get('min_size', 0) <= pool['max_capacity']:
+        raise ValueError("Node pool '{}' needs 0 <= warm pool min_size <= max_capacity".format(pool['name']))
+
+
+def add_warm_pool(asg: autoscaling.AutoScalingGroup, warm_pool: dict) -> dict:
+    """Keep pre-initialized instances of asg stopped or hibernated in a warm pool; return the lifecycle hook.
+
+    warm_pool keys (all optional):
+    min_size: instances kept in the warm pool (default: 0)
+    max_prepared_capacity: warm plus in-service instances (default: the ASG's max_capacity)
+    pool_state: 'Stopped' or 'Hibernated' (default: 'Stopped')
+    heartbeat_timeout: seconds a node has for its bootstrap before it is abandoned (default: 900)
+
+    The launching lifecycle hook is part of the ASG, so it also holds the
+    instances of the first launch until they completed their bootstrap (see
+    compile_user_data()). The returned dict is the lifecycle_hook argument
+    of compile_user_data().
+    """
+    cfn_asg = asg.node.default_child
+    cfn_asg.lifecycle_hook_specification_list = [
+        autoscaling.CfnAutoScalingGroup.LifecycleHookSpecificationProperty(
+            lifecycle_hook_name=LIFECYCLE_HOOK_NAME,
+            lifecycle_transition='autoscaling:EC2_INSTANCE_LAUNCHING',
+            # A node failing its bootstrap is replaced
+            default_result='ABANDON',
+            heartbeat_timeout=warm_pool.get('heartbeat_timeout', 900)
+        )
+    ]
+    asg.add_to_role_policy(iam.PolicyStatement(
+        actions=['autoscaling:CompleteLifecycleAction'],
+        effect=iam.Effect.ALLOW,
+        resources=[
+            core.Stack.of(asg).format_arn(
+                service='autoscaling',
+                resource='autoScalingGroup',
+                sep=':',
+                resource_name='*:autoScalingGroupName/' + cfn_asg.auto_scaling_group_name
+            )
+        ]
+    ))
+
+    properties = {
+        'AutoScalingGroupName': asg.auto_scaling_group_name,
+        'MinSize': warm_pool.get('min_size', 0),
+        'PoolState': warm_pool.get('pool_state', 'Stopped'),
+    }
+    if warm_pool.get('max_prepared_capacity') is not None:
+        properties['MaxGroupPreparedCapacity'] = warm_pool['max_prepared_capacity']
+    core.CfnResource(
+        asg,
+        'WarmPool',
+        type='AWS::AutoScaling::WarmPool',
+        properties=properties
+    )
+
+    return {
+        'auto_scaling_group_name': cfn_asg.auto_scaling_group_name,
+        'lifecycle_hook_name': LIFECYCLE_HOOK_NAME,
+    }
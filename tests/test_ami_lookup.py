@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+try:
+    from cdk_python_k8s_right_way_aws import ami_lookup
+except ImportError:  # needs boto3
+    ami_lookup = None
+
+NAME_FILTER = 'ubuntu/images/hvm-ssd/ubuntu-bionic-18.04-amd64-server-*'
+OWNER = '099720109477'
+
+
+class FakeEc2:
+    def __init__(self, region, images):
+        self.region = region
+        self.images = images
+
+    def can_paginate(self, name):
+        return False
+
+    def describe_images(self, Filters, Owners):
+        if self.images is None:
+            raise RuntimeError('UnauthorizedOperation')
+        return {'Images': self.images}
+
+    def describe_regions(self):
+        return {'Regions': [{'RegionName': 'us-east-1'}, {'RegionName': 'eu-west-1'}]}
+
+
+class FakeSession:
+    """boto3 Session stand-in whose EC2 clients answer from images (region => Images, None to fail)."""
+
+    def __init__(self, images):
+        self.images = images
+        self.regions = []
+
+    def __call__(self):
+        return self
+
+    def client(self, service, region_name, config):
+        self.regions.append(region_name)
+        return FakeEc2(region_name, self.images.get(region_name, []))
+
+
+def image(image_id, created):
+    return {'ImageId': image_id, 'CreationDate': created}
+
+
+@unittest.skipIf(ami_lookup is None, "needs boto3")
+class AmiCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, '.ami-cache.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_cache(self, entries):
+        with open(self.cache_file, 'w') as fp:
+            json.dump(entries, fp)
+
+    def read_cache(self):
+        with open(self.cache_file) as fp:
+            return json.load(fp)
+
+    def entry(self, value, age):
+        return {'value': value, 'resolved_at': time.time() - age}
+
+    def lookup(self, session, **kwargs):
+        kwargs.setdefault('regions', ['us-east-1', 'eu-west-1'])
+        with mock.patch.object(ami_lookup.boto3.session, 'Session', session):
+            return ami_lookup.get_ami_region_map('us-east-1', name_filter=NAME_FILTER, owner=OWNER,
+                                                 cache_file=self.cache_file, cache_ttl=3600, **kwargs)
+
+    def test_missing_or_broken_cache_is_empty(self):
+        self.assertEqual(ami_lookup.load_ami_cache(self.cache_file), {})
+        with open(self.cache_file, 'w') as fp:
+            fp.write('{"truncated": ')
+        self.assertEqual(ami_lookup.load_ami_cache(self.cache_file), {})
+
+    def test_save_merges_into_the_cache(self):
+        self.write_cache({'a': 1})
+        ami_lookup.save_ami_cache(self.cache_file, {'b': 2})
+        self.assertEqual(self.read_cache(), {'a': 1, 'b': 2})
+        self.assertEqual(os.listdir(self.directory.name), ['.ami-cache.json'])
+
+    def test_fresh_entries_need_no_aws_call(self):
+        self.write_cache({
+            'us-east-1|' + NAME_FILTER + '|' + OWNER: self.entry('ami-1', 60),
+            'eu-west-1|' + NAME_FILTER + '|' + OWNER: self.entry('ami-2', 60),
+        })
+        session = mock.Mock(side_effect=AssertionError('no AWS call expected'))
+        self.assertEqual(self.lookup(session), {'us-east-1': 'ami-1', 'eu-west-1': 'ami-2'})
+
+    def test_expired_entries_are_looked_up_again(self):
+        self.write_cache({
+            'us-east-1|' + NAME_FILTER + '|' + OWNER: self.entry('ami-1', 60),
+            'eu-west-1|' + NAME_FILTER + '|' + OWNER: self.entry('ami-old', 7200),
+        })
+        session = FakeSession({'eu-west-1': [image('ami-2', '2019-01-01'), image('ami-3', '2019-02-01')]})
+
+        self.assertEqual(self.lookup(session), {'us-east-1': 'ami-1', 'eu-west-1': 'ami-3'})
+        self.assertEqual(session.regions, ['eu-west-1'])
+        self.assertEqual(self.read_cache()['eu-west-1|' + NAME_FILTER + '|' + OWNER]['value'], 'ami-3')
+
+    def test_refresh_ignores_fresh_entries(self):
+        self.write_cache({'us-east-1|' + NAME_FILTER + '|' + OWNER: self.entry('ami-1', 60)})
+        session = FakeSession({'us-east-1': [image('ami-4', '2019-03-01')]})
+
+        self.assertEqual(self.lookup(session, regions=['us-east-1'], refresh=True), {'us-east-1': 'ami-4'})
+        self.assertEqual(self.read_cache()['us-east-1|' + NAME_FILTER + '|' + OWNER]['value'], 'ami-4')
+
+    def test_region_list_is_cached(self):
+        session = FakeSession({
+            'us-east-1': [image('ami-1', '2019-01-01')],
+            'eu-west-1': [image('ami-2', '2019-01-01')],
+        })
+        self.assertEqual(self.lookup(session, regions=None), {'us-east-1': 'ami-1', 'eu-west-1': 'ami-2'})
+
+        session = mock.Mock(side_effect=AssertionError('no AWS call expected'))
+        self.assertEqual(self.lookup(session, regions=None), {'us-east-1': 'ami-1', 'eu-west-1': 'ami-2'})
+
+    def test_failed_regions_are_left_out_and_not_cached(self):
+        session = FakeSession({'us-east-1': [image('ami-1', '2019-01-01')], 'eu-west-1': None})
+        with self.assertLogs(ami_lookup.logger, 'WARNING'):
+            self.assertEqual(self.lookup(session), {'us-east-1': 'ami-1'})
+        self.assertNotIn('eu-west-1|' + NAME_FILTER + '|' + OWNER, self.read_cache())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+
+try:
+    from cdk_python_k8s_right_way_aws import clusters
+except ImportError:  # the cluster settings come from the stack module, which needs aws-cdk
+    clusters = None
+
+
+@unittest.skipIf(clusters is None, "needs aws-cdk")
+class CheckVpcCidrsTest(unittest.TestCase):
+    def test_disjoint_cidrs_pass(self):
+        clusters.check_vpc_cidrs([
+            {'name': 'prod', 'vpc_cidr': '10.5.0.0/16'},
+            {'name': 'dev', 'vpc_cidr': '10.6.0.0/16'},
+            {'name': 'test', 'vpc_cidr': '10.4.0.0/16'},
+        ])
+
+    def test_adjacent_cidrs_pass(self):
+        clusters.check_vpc_cidrs([
+            {'name': 'prod', 'vpc_cidr': '10.5.0.0/17'},
+            {'name': 'dev', 'vpc_cidr': '10.5.128.0/17'},
+        ])
+
+    def test_overlapping_cidrs_fail(self):
+        with self.assertRaisesRegex(ValueError, "vpc_cidr 10.5.128.0/20 of cluster 'dev' overlaps vpc_cidr "
+                                                "10.5.0.0/16 of cluster 'prod'"):
+            clusters.check_vpc_cidrs([
+                {'name': 'prod', 'vpc_cidr': '10.5.0.0/16'},
+                {'name': 'dev', 'vpc_cidr': '10.5.128.0/20'},
+            ])
+
+    def test_cidr_inside_another_fails(self):
+        with self.assertRaisesRegex(ValueError, "cluster 'dev' overlaps .* cluster 'prod'"):
+            clusters.check_vpc_cidrs([
+                {'name': 'test', 'vpc_cidr': '10.6.0.0/16'},
+                {'name': 'prod', 'vpc_cidr': '10.5.0.0/16'},
+                {'name': 'dev', 'vpc_cidr': '10.5.255.0/24'},
+            ])
+
+    def test_clusters_without_vpc_cidr_use_the_default(self):
+        with self.assertRaisesRegex(ValueError, 'overlaps'):
+            clusters.check_vpc_cidrs([{'name': 'prod'}, {'name': 'dev'}])
+
+
+@unittest.skipIf(clusters is None, "needs aws-cdk")
+class LoadClustersTest(unittest.TestCase):
+    def load(self, definitions):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'clusters.json')
+            with open(path, 'w') as fp:
+                json.dump(definitions, fp)
+            return clusters.load_clusters(path)
+
+    def test_valid_definitions(self):
+        definitions = [{'name': 'prod', 'vpc_cidr': '10.5.0.0/16'}, {'name': 'dev', 'vpc_cidr': '10.6.0.0/16'}]
+        self.assertEqual(self.load(definitions), definitions)
+
+    def test_cluster_without_name_fails(self):
+        with self.assertRaisesRegex(ValueError, 'Cluster without name'):
+            self.load([{'vpc_cidr': '10.5.0.0/16'}])
+
+    def test_duplicate_name_fails(self):
+        with self.assertRaisesRegex(ValueError, "Duplicate cluster name 'prod'"):
+            self.load([{'name': 'prod', 'vpc_cidr': '10.5.0.0/16'}, {'name': 'prod', 'vpc_cidr': '10.6.0.0/16'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+try:
+    from cdk_python_k8s_right_way_aws import deploy
+except ImportError:  # project_dir comes from the stack module, which needs aws-cdk
+    deploy = None
+
+LAYERED = {
+    'k8s-network': set(),
+    'k8s-bastion': {'k8s-network'},
+    'k8s-etcd': {'k8s-network'},
+    'k8s-control-plane': {'k8s-network'},
+    'k8s-worker': {'k8s-network'},
+    'k8s-observability': {'k8s-etcd', 'k8s-control-plane', 'k8s-worker'},
+}
+
+
+class Recorder:
+    """deploy(name) stand-in recording the stacks already deployed when each one starts."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+        self.deployed = set()
+        self.started = {}
+
+    def __call__(self, name):
+        with self.lock:
+            self.started[name] = set(self.deployed)
+        if name in self.failing:
+            return False
+        with self.lock:
+            self.deployed.add(name)
+        return True
+
+
+@unittest.skipIf(deploy is None, "needs aws-cdk")
+class DeployStacksTest(unittest.TestCase):
+    def test_stacks_deploy_after_their_dependencies(self):
+        recorder = Recorder()
+        results = deploy.deploy_stacks(LAYERED, recorder, max_workers=4)
+
+        self.assertEqual(results, {name: 'deployed' for name in LAYERED})
+        for name, depends_on in LAYERED.items():
+            self.assertLessEqual(depends_on, recorder.started[name], name)
+
+    def test_independent_stacks_deploy_concurrently(self):
+        layers = ['k8s-bastion', 'k8s-etcd', 'k8s-control-plane', 'k8s-worker']
+        # Only passes if all four layers are in flight at the same time
+        barrier = threading.Barrier(len(layers), timeout=10)
+
+        def deploy_stack(name):
+            if name in layers:
+                barrier.wait()
+            return True
+
+        results = deploy.deploy_stacks(LAYERED, deploy_stack, max_workers=len(layers))
+        self.assertEqual(set(results.values()), {'deployed'})
+
+    def test_failed_stack_skips_its_dependents(self):
+        results = deploy.deploy_stacks(LAYERED, Recorder(failing={'k8s-etcd'}), max_workers=2)
+
+        self.assertEqual(results['k8s-etcd'], 'failed')
+        self.assertEqual(results['k8s-observability'], 'skipped')
+        for name in ('k8s-network', 'k8s-bastion', 'k8s-control-plane', 'k8s-worker'):
+            self.assertEqual(results[name], 'deployed')
+
+    def test_skipping_is_transitive(self):
+        recorder = Recorder(failing={'k8s-network'})
+        results = deploy.deploy_stacks(LAYERED, recorder)
+
+        self.assertEqual(results['k8s-network'], 'failed')
+        self.assertEqual({results[name] for name in LAYERED if name != 'k8s-network'}, {'skipped'})
+        self.assertEqual(list(recorder.started), ['k8s-network'])
+
+    def test_unknown_dependency_fails(self):
+        with self.assertRaisesRegex(ValueError, 'unknown stacks k8s-vpc'):
+            deploy.deploy_stacks({'k8s-network': {'k8s-vpc'}}, Recorder())
+
+    def test_dependency_cycle_fails(self):
+        with self.assertRaisesRegex(ValueError, 'Dependency cycle between stacks k8s-etcd, k8s-worker'):
+            deploy.deploy_stacks(
+                {'k8s-network': set(), 'k8s-etcd': {'k8s-worker'}, 'k8s-worker': {'k8s-etcd', 'k8s-network'}},
+                Recorder())
+
+
+@unittest.skipIf(deploy is None, "needs aws-cdk")
+class StackDependenciesTest(unittest.TestCase):
+    def test_dependencies_from_manifest(self):
+        manifest = {'artifacts': {
+            'Tree': {'type': 'cdk:tree'},
+            'k8s-network': {'type': 'aws:cloudformation:stack'},
+            'k8s-worker': {'type': 'aws:cloudformation:stack', 'dependencies': ['k8s-network', 'k8s-network.assets']},
+            'k8s-network.assets': {'type': 'cdk:asset-manifest'},
+        }}
+        with tempfile.TemporaryDirectory() as assembly_dir:
+            with open(os.path.join(assembly_dir, 'manifest.json'), 'w') as fp:
+                json.dump(manifest, fp)
+            dependencies = deploy.stack_dependencies(assembly_dir)
+
+        self.assertEqual(dependencies, {'k8s-network': set(), 'k8s-worker': {'k8s-network'}})
+
+    def test_select_stacks_drops_dependencies_on_unselected_stacks(self):
+        self.assertEqual(deploy.select_stacks(LAYERED, ['k8s-worker', 'k8s-obs*']), {
+            'k8s-worker': set(),
+            'k8s-observability': {'k8s-worker'},
+        })
+        self.assertIs(deploy.select_stacks(LAYERED, []), LAYERED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import io
+import json
+import os
+import ssl
+import tempfile
+import unittest
+from unittest import mock
+
+from cdk_python_k8s_right_way_aws.scripts import etcd_backup
+
+PROJECT = 'k8s-the-real-hard-way-aws'
+
+
+class FakeS3:
+    """S3 client stand-in holding a latest.json entry and recording the keys read."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, latest):
+        self.latest = latest
+        self.keys = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.keys.append(Key)
+        if Key.endswith('latest.json'):
+            return {'Body': io.BytesIO(json.dumps(self.latest).encode())}
+        raise AssertionError('snapshot download: ' + Key)
+
+
+class FakeEc2:
+    def __init__(self, ips):
+        self.ips = ips
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Filters):
+        return [{'Reservations': [{'Instances': [
+            {'PrivateIpAddress': ip, 'PrivateDnsName': 'ip-' + ip.replace('.', '-') + '.ec2.internal'}
+            for ip in self.ips]}]}]
+
+
+class RestoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.data_dir = os.path.join(self.directory.name, 'etcd')
+        self.s3 = FakeS3({'key': 'etcd/snapshots/1.db.gz', 'size': 1024, 'sha256': None})
+
+    def restore(self):
+        return etcd_backup.restore(self.s3, FakeEc2(['10.5.0.1', '10.5.0.2', '10.5.0.3']), 'bucket', 'etcd/',
+                                   self.data_dir, PROJECT, 3, '10.5.0.1', part_size=512, max_workers=2, wait=0)
+
+    def test_missing_tls_files_skip_the_restore(self):
+        missing = os.path.join(self.directory.name, 'missing')
+        environment = {
+            'ETCD_CACERT': os.path.join(missing, 'ca.pem'),
+            'ETCD_CERT': os.path.join(missing, 'kubernetes.pem'),
+            'ETCD_KEY': os.path.join(missing, 'kubernetes-key.pem'),
+        }
+        with mock.patch.dict(os.environ, environment), mock.patch.object(etcd_backup, 'log'):
+            self.assertEqual(self.restore(), 0)
+        self.assertEqual(self.s3.keys, ['etcd/latest.json'])
+        self.assertFalse(os.path.exists(self.data_dir))
+
+    def test_existing_data_is_kept(self):
+        os.makedirs(os.path.join(self.data_dir, 'member'))
+        with mock.patch.object(etcd_backup, 'log'):
+            self.assertEqual(self.restore(), 0)
+        self.assertEqual(self.s3.keys, [])
+
+
+class HealthyTest(unittest.TestCase):
+    def test_tls_errors_mean_unhealthy(self):
+        gateway = etcd_backup.EtcdGateway('https://10.5.0.2:2379', timeout=2, context=ssl.create_default_context())
+        for error in (ssl.SSLError('handshake failed'), ConnectionRefusedError()):
+            with self.subTest(error=error), mock.patch('urllib.request.urlopen', side_effect=error):
+                self.assertFalse(gateway.healthy())
+
+
+if __name__ == '__main__':
+    unittest.main()
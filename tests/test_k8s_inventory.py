@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from cdk_python_k8s_right_way_aws.scripts import k8s_inventory
+
+PROJECT = 'k8s-the-real-hard-way-aws'
+
+
+class FakeEc2:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Filters):
+        self.calls.append(Filters)
+        return self.pages
+
+
+def instance(instance_id, name, zone='us-east-1a', launch_time='2019-01-01'):
+    return {
+        'InstanceId': instance_id,
+        'Tags': [{'Key': 'Name', 'Value': name}, {'Key': 'Project', 'Value': PROJECT}],
+        'Placement': {'AvailabilityZone': zone},
+        'PrivateIpAddress': '10.5.0.' + instance_id[-1],
+        'PrivateDnsName': 'ip-10-5-0-{}.ec2.internal'.format(instance_id[-1]),
+        'LaunchTime': launch_time,
+    }
+
+
+class ParseNameTest(unittest.TestCase):
+    def test_role_names(self):
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-bastion', PROJECT), ('bastion', 'bastion'))
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-etcd', PROJECT), ('etcd', 'etcd'))
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-k8s-master', PROJECT), ('master', 'master'))
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-k8s-worker', PROJECT), ('worker', 'worker'))
+
+    def test_pool_suffix(self):
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-k8s-worker-spot', PROJECT), ('worker', 'spot'))
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-k8s-worker-gpu-large', PROJECT), ('worker', 'gpu-large'))
+        self.assertEqual(k8s_inventory.parse_name(PROJECT + '-etcd-io2', PROJECT), ('etcd', 'io2'))
+
+    def test_other_names(self):
+        for name in (None, '', 'other-project-k8s-worker', PROJECT, PROJECT + '-k8s-workers', PROJECT + '-master-lb'):
+            with self.subTest(name=name):
+                self.assertIsNone(k8s_inventory.parse_name(name, PROJECT))
+
+
+class SweepTest(unittest.TestCase):
+    def test_index_by_role_and_zone(self):
+        ec2 = FakeEc2([
+            {'Reservations': [{'Instances': [
+                instance('i-1', PROJECT + '-k8s-worker', launch_time='2019-01-02'),
+                instance('i-2', PROJECT + '-k8s-worker', launch_time='2019-01-01'),
+            ]}]},
+            {'Reservations': [{'Instances': [
+                instance('i-3', PROJECT + '-k8s-worker-spot', zone='us-east-1b'),
+                instance('i-4', PROJECT + '-k8s-master'),
+                instance('i-5', 'unrelated'),
+            ]}]},
+        ])
+        index = k8s_inventory.sweep(ec2, PROJECT, vpc_id='vpc-1')
+
+        self.assertEqual(sorted(index), ['master', 'worker'])
+        self.assertEqual([node['instance_id'] for node in index['worker']['us-east-1a']], ['i-2', 'i-1'])
+        self.assertEqual(index['worker']['us-east-1b'][0]['pool'], 'spot')
+        self.assertEqual(index['master']['us-east-1a'][0]['private_ip'], '10.5.0.4')
+        self.assertIn({'Name': 'vpc-id', 'Values': ['vpc-1']}, ec2.calls[0])
+
+
+class LoadIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.cache_dir.name, 'k8s-inventory.json')
+        self.index = {'worker': {'us-east-1a': []}}
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def write_cache(self, key, age):
+        with open(self.cache_file, 'w') as fp:
+            json.dump({'key': key, 'time': time.time() - age, 'index': self.index}, fp)
+
+    def test_fresh_cache_is_served_without_api_call(self):
+        self.write_cache(PROJECT + '|vpc-1|us-east-1', age=10)
+        self.assertEqual(
+            k8s_inventory.load_index(PROJECT, 'vpc-1', 'us-east-1', ttl=60, cache_file=self.cache_file), self.index)
+
+
+if __name__ == '__main__':
+    unittest.main()
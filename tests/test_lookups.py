@@ -0,0 +1,109 @@
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import types
+import unittest
+from unittest import mock
+
+from cdk_python_k8s_right_way_aws.lookups import Lookups, StaticLookups
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STACK_MODULE = 'cdk_python_k8s_right_way_aws.cdk_python_k8s_right_way_aws_stack'
+
+
+def no_network(*args, **kwargs):
+    raise AssertionError('network access')
+
+
+def fake_ami_lookup(ami_region_map):
+    """Module standing in for ami_lookup, recording the get_ami_region_map calls."""
+    module = types.ModuleType('ami_lookup')
+    module.EC2_ARCHITECTURES = {'amd64': 'x86_64', 'arm64': 'arm64'}
+    module.ubuntu_name_filter = lambda codename, version, architecture: '-'.join((codename, version, architecture))
+    module.get_ami_region_map = mock.Mock(return_value=ami_region_map)
+    return module
+
+
+class StaticLookupsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(socket.socket, 'connect', no_network)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fixture_values(self):
+        lookups = StaticLookups('198.51.100.7/32', {'us-east-1': 'ami-1', 'eu-west-1': 'ami-2'})
+        self.assertEqual(lookups.workstation_cidr(), '198.51.100.7/32')
+        self.assertEqual(lookups.ami_region_map(), {'us-east-1': 'ami-1', 'eu-west-1': 'ami-2'})
+        self.assertEqual(lookups.ubuntu_ami_id('eu-west-1'), 'ami-2')
+
+    def test_defaults(self):
+        lookups = StaticLookups()
+        self.assertEqual(lookups.workstation_cidr(), '203.0.113.10/32')
+        self.assertEqual(lookups.ami_region_map(), {})
+
+    def test_region_without_ami_fails(self):
+        with self.assertRaisesRegex(RuntimeError, 'Could not find an Ubuntu AMI in region ap-south-1'):
+            StaticLookups(ami_region_map={'us-east-1': 'ami-1'}).ubuntu_ami_id('ap-south-1')
+
+    def test_fixture_map_is_copied(self):
+        ami_region_map = {'us-east-1': 'ami-1'}
+        lookups = StaticLookups(ami_region_map=ami_region_map)
+        ami_region_map['us-east-1'] = 'ami-2'
+        self.assertEqual(lookups.ubuntu_ami_id('us-east-1'), 'ami-1')
+
+
+class LookupsTest(unittest.TestCase):
+    def test_given_workstation_cidr_skips_ipify(self):
+        with mock.patch.object(socket.socket, 'connect', no_network):
+            self.assertEqual(Lookups('us-east-1', workstation_cidr='192.0.2.1/32').workstation_cidr(), '192.0.2.1/32')
+
+    def test_amis_are_resolved_on_first_use_only(self):
+        ami_lookup = fake_ami_lookup({'eu-central-1': 'ami-1'})
+        with mock.patch.dict(sys.modules, {'cdk_python_k8s_right_way_aws.ami_lookup': ami_lookup}):
+            lookups = Lookups('eu-central-1', ami_lookup_regions=['eu-central-1'], ami_cache_file='/tmp/cache.json',
+                              ami_cache_ttl=60, ubuntu_codename='focal', ubuntu_version='20.04',
+                              ubuntu_architecture='arm64')
+            ami_lookup.get_ami_region_map.assert_not_called()
+
+            self.assertEqual(lookups.ubuntu_ami_id('eu-central-1'), 'ami-1')
+            self.assertEqual(lookups.ami_region_map(), {'eu-central-1': 'ami-1'})
+
+        ami_lookup.get_ami_region_map.assert_called_once_with(
+            home_region='eu-central-1',
+            name_filter='focal-20.04-arm64',
+            architecture='arm64',
+            regions=['eu-central-1'],
+            max_workers=8,
+            timeout=10,
+            cache_file='/tmp/cache.json',
+            cache_ttl=60,
+            refresh=False
+        )
+
+
+@unittest.skipUnless(importlib.util.find_spec('aws_cdk'), "needs aws-cdk")
+class StackModuleImportTest(unittest.TestCase):
+    def test_import_makes_no_network_call(self):
+        snippet = "\n".join([
+            "import socket",
+            "def no_network(*args, **kwargs):",
+            "    raise RuntimeError('network access during import')",
+            "socket.socket.connect = no_network",
+            "socket.create_connection = no_network",
+            "import " + STACK_MODULE,
+        ])
+        subprocess.run([sys.executable, '-c', snippet], cwd=PROJECT_DIR, check=True)
+
+    def test_default_lookups_take_the_workstation_cidr_from_the_environment(self):
+        stack_module = importlib.import_module(STACK_MODULE)
+        with mock.patch.dict(os.environ, {'WORKSTATION_CIDR': '192.0.2.1/32'}):
+            lookups = stack_module.default_lookups()
+        self.assertEqual(lookups.workstation_cidr(), '192.0.2.1/32')
+        self.assertEqual(lookups.aws_region, stack_module.aws_region)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+try:
+    from cdk_python_k8s_right_way_aws import cdk_python_k8s_right_way_aws_stack as stack_module
+except ImportError:  # needs aws-cdk
+    stack_module = None
+
+
+def worker_pool(**spec):
+    pool = {'name': 'worker', 'role': 'worker', 'instance_type': 'm5.large',
+            'min_capacity': 1, 'max_capacity': 1, 'desired_capacity': 1}
+    pool.update(spec)
+    return pool
+
+
+@unittest.skipIf(stack_module is None, "needs aws-cdk")
+class ValidateNodePoolsTest(unittest.TestCase):
+    def validate(self, cluster=None, node_pools=None):
+        settings = stack_module.cluster_settings(cluster)
+        stack_module.validate_node_pools(settings['node_pools'] if node_pools is None else node_pools, settings)
+
+    def test_default_pools_pass(self):
+        self.validate()
+
+    def test_unknown_default_placement_is_named(self):
+        with self.assertRaisesRegex(ValueError, "Unknown placement 'rack' in node pool 'etcd'"):
+            self.validate({'placement_strategies': {'etcd': 'rack', 'master': None}})
+
+    def test_unknown_default_storage_profile_is_named(self):
+        with self.assertRaisesRegex(ValueError, "Unknown storage_profile 'fast' in node pool 'etcd'"):
+            self.validate({'etcd_storage_profile': 'fast'})
+
+    def test_unknown_security_group_is_named(self):
+        with self.assertRaisesRegex(ValueError, "Unknown security_group 'db' in node pool 'worker'"):
+            self.validate(node_pools=[worker_pool(security_group='db')])
+
+    def test_default_cluster_placement_checks_the_instance_type(self):
+        with self.assertRaisesRegex(ValueError, "does not support burstable t3.small"):
+            self.validate({'placement_strategies': {'etcd': None, 'master': 'cluster'}},
+                          node_pools=[worker_pool(name='master', role='master', instance_type='t3.small')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import ipaddress
+import shutil
+import subprocess
+import unittest
+
+from cdk_python_k8s_right_way_aws.pod_cidr import allocate_pod_cidr, pod_cidr_fragment, validate_pod_cidr
+
+NODE_SUBNETS = ['10.5.128.0/20', '10.5.144.0/20', '10.5.160.0/20']
+POD_CIDR_BLOCK = '100.64.0.0/10'
+NODE_MASK = 24
+
+
+class AllocatePodCidrTest(unittest.TestCase):
+    def test_first_address_of_first_subnet_gets_first_block(self):
+        self.assertEqual(allocate_pod_cidr('10.5.128.0', NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK), '100.64.0.0/24')
+
+    def test_subnets_continue_the_index_of_the_previous_ones(self):
+        # 4096 addresses per /20, so the second subnet starts at block 4096
+        self.assertEqual(allocate_pod_cidr('10.5.144.0', NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK), '100.80.0.0/24')
+        self.assertEqual(allocate_pod_cidr('10.5.160.7', NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK), '100.96.7.0/24')
+
+    def test_every_node_address_gets_its_own_block(self):
+        pod_cidrs = set()
+        for cidr in NODE_SUBNETS:
+            for address in ipaddress.ip_network(cidr):
+                pod_cidrs.add(allocate_pod_cidr(str(address), NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK))
+        self.assertEqual(len(pod_cidrs), 3 * 4096)
+        pod_network = ipaddress.ip_network(POD_CIDR_BLOCK)
+        self.assertTrue(all(ipaddress.ip_network(cidr).subnet_of(pod_network) for cidr in pod_cidrs))
+
+    def test_node_mask_sets_the_block_size(self):
+        self.assertEqual(allocate_pod_cidr('10.5.128.3', NODE_SUBNETS, POD_CIDR_BLOCK, 26), '100.64.0.192/26')
+
+    def test_address_outside_the_node_subnets_fails(self):
+        with self.assertRaises(ValueError):
+            allocate_pod_cidr('10.5.0.10', NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK)
+
+
+class ValidatePodCidrTest(unittest.TestCase):
+    def test_large_enough_block_passes(self):
+        validate_pod_cidr(NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK, vpc_cidr='10.5.0.0/16')
+
+    def test_too_small_block_fails(self):
+        with self.assertRaisesRegex(ValueError, 'use a /10 or larger'):
+            validate_pod_cidr(NODE_SUBNETS, '100.64.0.0/16', NODE_MASK)
+
+    def test_node_mask_wider_than_block_fails(self):
+        with self.assertRaises(ValueError):
+            validate_pod_cidr(NODE_SUBNETS, POD_CIDR_BLOCK, 8)
+
+    def test_block_overlapping_the_vpc_fails(self):
+        with self.assertRaisesRegex(ValueError, 'overlaps vpc_cidr'):
+            validate_pod_cidr(NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK, vpc_cidr='100.64.0.0/16')
+
+
+@unittest.skipUnless(shutil.which('bash'), "needs bash")
+class PodCidrFragmentTest(unittest.TestCase):
+    def pod_cidr(self, node_ip, node_subnets=NODE_SUBNETS, pod_cidr_block=POD_CIDR_BLOCK, node_mask=NODE_MASK):
+        script = "\n".join(
+            ["LOCAL_IPV4=" + node_ip] + pod_cidr_fragment(node_subnets, pod_cidr_block, node_mask)
+            + ["echo \"$POD_CIDR\""])
+        return subprocess.run(['bash', '-c', script], check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.strip()
+
+    def test_fragment_matches_allocate_pod_cidr(self):
+        for node_ip in ('10.5.128.0', '10.5.128.1', '10.5.143.255', '10.5.144.0', '10.5.170.42', '10.5.175.255'):
+            self.assertEqual(self.pod_cidr(node_ip),
+                             allocate_pod_cidr(node_ip, NODE_SUBNETS, POD_CIDR_BLOCK, NODE_MASK))
+
+    def test_fragment_with_small_node_mask(self):
+        self.assertEqual(self.pod_cidr('10.5.128.3', node_mask=26),
+                         '100.64.0.192/26')
+
+    def test_fragment_leaves_pod_cidr_unset_outside_the_node_subnets(self):
+        self.assertEqual(self.pod_cidr('10.5.0.10'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import json
+import unittest
+
+from cdk_python_k8s_right_way_aws.functions import route53_registration as registration
+
+ZONE_NAME = 'k8s.example.com'
+
+
+class ClientError(Exception):
+    """Stand-in for botocore's ClientError."""
+
+    def __init__(self, code, message=''):
+        super().__init__(message)
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class FakeEc2:
+    def __init__(self, ips):
+        self.ips = ips
+        self.calls = []
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Filters):
+        self.calls.append(Filters)
+        instance_ids = Filters[0]['Values']
+        return [{'Reservations': [{'Instances': [
+            {'InstanceId': instance_id, 'PrivateIpAddress': self.ips[instance_id]}
+            for instance_id in instance_ids if instance_id in self.ips
+        ]}]}]
+
+
+class FakeRoute53:
+    def __init__(self, records=None, failures=()):
+        # name => record set
+        self.records = dict(records or {})
+        self.failures = list(failures)
+        self.batches = []
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        if self.failures:
+            raise self.failures.pop(0)
+        for change in ChangeBatch['Changes']:
+            record_set = change['ResourceRecordSet']
+            if change['Action'] == 'DELETE':
+                if self.records.get(record_set['Name']) != record_set:
+                    raise ClientError(
+                        'InvalidChangeBatch',
+                        "Tried to delete resource record set [name='{}', type='A'] but it was not found".format(
+                            record_set['Name']))
+        self.batches.append(ChangeBatch['Changes'])
+        for change in ChangeBatch['Changes']:
+            record_set = change['ResourceRecordSet']
+            if change['Action'] == 'DELETE':
+                del self.records[record_set['Name']]
+            else:
+                self.records[record_set['Name']] = record_set
+
+    def list_resource_record_sets(self, HostedZoneId, StartRecordName, StartRecordType, MaxItems):
+        names = sorted(name for name in self.records if name >= StartRecordName)
+        return {'ResourceRecordSets': [self.records[name] for name in names[:int(MaxItems)]]}
+
+
+class FakeAutoScaling:
+    def __init__(self, completed=()):
+        self.completed = list(completed)
+        self.calls = []
+
+    def complete_lifecycle_action(self, **kwargs):
+        if kwargs['InstanceId'] in self.completed:
+            raise ClientError('ValidationError', 'No active Lifecycle Action found')
+        self.calls.append(kwargs)
+
+
+def hook(instance_id, transition=registration.LAUNCHING):
+    return json.dumps({
+        'LifecycleTransition': transition,
+        'EC2InstanceId': instance_id,
+        'LifecycleHookName': 'registration-launching',
+        'AutoScalingGroupName': 'worker',
+        'LifecycleActionToken': 'token-' + instance_id,
+    })
+
+
+def record(instance_id, ip):
+    return {
+        'Name': registration.record_name(instance_id, ZONE_NAME),
+        'Type': 'A',
+        'TTL': 60,
+        'ResourceRecords': [{'Value': ip}],
+    }
+
+
+def process(bodies, ec2, route53, autoscaling):
+    return registration.process_messages(
+        bodies, ec2, route53, autoscaling, '/hostedzone/Z123', ZONE_NAME, sleep=lambda seconds: None)
+
+
+class ProcessMessagesTest(unittest.TestCase):
+
+    def test_mass_launch_is_one_lookup_and_one_change_batch(self):
+        ips = {'i-{}'.format(number): '10.5.1.{}'.format(number) for number in range(50)}
+        ec2, route53, autoscaling = FakeEc2(ips), FakeRoute53(), FakeAutoScaling()
+
+        result = process([hook(instance_id) for instance_id in ips], ec2, route53, autoscaling)
+
+        self.assertEqual(result, {'changes': 50, 'completed': 50})
+        self.assertEqual(len(ec2.calls), 1)
+        self.assertEqual(len(route53.batches), 1)
+        self.assertEqual(route53.records[registration.record_name('i-7', ZONE_NAME)], record('i-7', '10.5.1.7'))
+        self.assertEqual(len(autoscaling.calls), 50)
+        self.assertEqual(autoscaling.calls[0]['LifecycleActionResult'], 'CONTINUE')
+
+    def test_terminating_wins_over_launching(self):
+        ec2 = FakeEc2({'i-1': '10.5.1.1'})
+        route53 = FakeRoute53({record('i-1', '10.5.1.1')['Name']: record('i-1', '10.5.1.1')})
+
+        process([hook('i-1'), hook('i-1', registration.TERMINATING)], ec2, route53, FakeAutoScaling())
+
+        self.assertEqual(route53.batches, [[{'Action': 'DELETE', 'ResourceRecordSet': record('i-1', '10.5.1.1')}]])
+        self.assertEqual(route53.records, {})
+
+    def test_delete_of_a_gone_instance_uses_the_current_record(self):
+        route53 = FakeRoute53({record('i-2', '10.5.1.9')['Name']: record('i-2', '10.5.1.9')})
+
+        process([hook('i-2', registration.TERMINATING)], FakeEc2({}), route53, FakeAutoScaling())
+
+        self.assertEqual(route53.records, {})
+
+    def test_delete_of_a_missing_record_is_dropped(self):
+        route53 = FakeRoute53()
+
+        result = process([hook('i-3', registration.TERMINATING)], FakeEc2({}), route53, FakeAutoScaling())
+
+        self.assertEqual(result, {'changes': 1, 'completed': 1})
+        self.assertEqual(route53.batches, [])
+
+    def test_stale_delete_is_resolved_and_resubmitted(self):
+        # Known IP, but the record points elsewhere: Route53 rejects the batch
+        ec2 = FakeEc2({'i-4': '10.5.1.4', 'i-5': '10.5.1.5'})
+        route53 = FakeRoute53({record('i-4', '10.5.1.44')['Name']: record('i-4', '10.5.1.44')})
+
+        process([hook('i-4', registration.TERMINATING), hook('i-5')], ec2, route53, FakeAutoScaling())
+
+        self.assertEqual(list(route53.records), [record('i-5', '10.5.1.5')['Name']])
+
+    def test_throttled_change_batch_is_retried(self):
+        route53 = FakeRoute53(failures=[ClientError('Throttling'), ClientError('PriorRequestNotComplete')])
+
+        process([hook('i-6')], FakeEc2({'i-6': '10.5.1.6'}), route53, FakeAutoScaling())
+
+        self.assertEqual(len(route53.batches), 1)
+
+    def test_other_errors_are_raised(self):
+        route53 = FakeRoute53(failures=[ClientError('AccessDenied')])
+
+        with self.assertRaises(ClientError):
+            process([hook('i-7')], FakeEc2({'i-7': '10.5.1.7'}), route53, FakeAutoScaling())
+
+    def test_already_completed_lifecycle_actions_are_ignored(self):
+        autoscaling = FakeAutoScaling(completed=['i-8'])
+
+        result = process([hook('i-8'), hook('i-9')], FakeEc2({'i-8': '10.5.1.8', 'i-9': '10.5.1.9'}),
+                         FakeRoute53(), autoscaling)
+
+        self.assertEqual(result['completed'], 2)
+        self.assertEqual([call['InstanceId'] for call in autoscaling.calls], ['i-9'])
+
+    def test_test_notifications_are_skipped(self):
+        ec2 = FakeEc2({})
+
+        result = process([json.dumps({'Event': 'autoscaling:TEST_NOTIFICATION'})], ec2, FakeRoute53(),
+                         FakeAutoScaling())
+
+        self.assertEqual(result, {'changes': 0, 'completed': 0})
+        self.assertEqual(ec2.calls, [])
+
+    def test_launching_instance_without_ip_gets_no_record(self):
+        route53 = FakeRoute53()
+
+        result = process([hook('i-10')], FakeEc2({}), route53, FakeAutoScaling())
+
+        self.assertEqual(result['changes'], 0)
+        self.assertEqual(route53.batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""process_messages() against moto's EC2 and Route53, skipped if moto is not installed."""
+import contextlib
+import unittest
+
+import pytest
+
+try:
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+except pytest.skip.Exception as skipped:
+    # Also a skip for python -m unittest
+    raise unittest.SkipTest(str(skipped))
+
+from cdk_python_k8s_right_way_aws.functions import route53_registration as registration
+
+from .test_route53_registration import ZONE_NAME, FakeAutoScaling, hook
+
+REGION = 'us-east-1'
+
+
+def mock_aws():
+    if hasattr(moto, 'mock_aws'):
+        return moto.mock_aws()
+    stack = contextlib.ExitStack()
+    for mock in (moto.mock_ec2, moto.mock_route53):
+        stack.enter_context(mock())
+    return stack
+
+
+class MotoProcessMessagesTest(unittest.TestCase):
+    def setUp(self):
+        aws = mock_aws()
+        aws.__enter__()
+        self.addCleanup(aws.__exit__, None, None, None)
+        self.ec2 = boto3.client('ec2', region_name=REGION)
+        self.route53 = boto3.client('route53', region_name=REGION)
+        self.zone_id = self.route53.create_hosted_zone(Name=ZONE_NAME, CallerReference='nodes')['HostedZone']['Id']
+        image_id = self.ec2.describe_images(Owners=['amazon'])['Images'][0]['ImageId']
+        instances = self.ec2.run_instances(ImageId=image_id, InstanceType='t3.small', MinCount=3, MaxCount=3)
+        self.ips = {instance['InstanceId']: instance['PrivateIpAddress'] for instance in instances['Instances']}
+
+    def process(self, bodies):
+        # moto's Auto Scaling knows no lifecycle actions of these instances
+        return registration.process_messages(bodies, self.ec2, self.route53, FakeAutoScaling(), self.zone_id,
+                                             ZONE_NAME, sleep=lambda seconds: None)
+
+    def a_records(self):
+        record_sets = self.route53.list_resource_record_sets(HostedZoneId=self.zone_id)['ResourceRecordSets']
+        return {record_set['Name']: record_set['ResourceRecords'][0]['Value']
+                for record_set in record_sets if record_set['Type'] == 'A'}
+
+    def test_launch_and_terminate(self):
+        result = self.process([hook(instance_id) for instance_id in self.ips])
+
+        self.assertEqual(result, {'changes': 3, 'completed': 3})
+        self.assertEqual(self.a_records(), {
+            registration.record_name(instance_id, ZONE_NAME): ip for instance_id, ip in self.ips.items()})
+
+        gone, *remaining = sorted(self.ips)
+        self.ec2.terminate_instances(InstanceIds=[gone])
+        self.process([hook(gone, registration.TERMINATING), hook('i-00000000', registration.TERMINATING)])
+
+        self.assertEqual(sorted(self.a_records()), [registration.record_name(instance_id, ZONE_NAME)
+                                                    for instance_id in remaining])
+
+
+if __name__ == '__main__':
+    unittest.main()
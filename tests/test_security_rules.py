@@ -0,0 +1,129 @@
+import unittest
+
+from cdk_python_k8s_right_way_aws.security_rules import (
+    applicable_rules,
+    compile_rules,
+    parse_ports,
+    rule_counts,
+    validate_rules,
+)
+
+SECURITY_GROUPS = {'bastion': None, 'etcd': None, 'master': None, 'worker': None}
+CIDRS = {'workstation': '203.0.113.10/32', 'vpc': '10.5.0.0/16', 'any': '0.0.0.0/0'}
+
+
+def rule(to, peer, ports, description='', **options):
+    return dict({'to': to, 'from': peer, 'ports': ports, 'description': description}, **options)
+
+
+class ParsePortsTest(unittest.TestCase):
+    def test_port_specs(self):
+        self.assertEqual(parse_ports('all'), ('all', 0, 65535))
+        self.assertEqual(parse_ports('tcp:22'), ('tcp', 22, 22))
+        self.assertEqual(parse_ports('udp:2379-2380'), ('udp', 2379, 2380))
+
+
+class ValidateRulesTest(unittest.TestCase):
+    def test_valid_rules_pass(self):
+        validate_rules([
+            rule('master', 'worker', 'all'),
+            rule('etcd', 'master', 'tcp:2379-2380'),
+            rule('master', 'vpc', 'udp:53'),
+        ], SECURITY_GROUPS, CIDRS)
+
+    def test_unknown_security_group_fails(self):
+        with self.assertRaisesRegex(ValueError, "unknown security group 'lb'"):
+            validate_rules([rule('lb', 'worker', 'tcp:80')], SECURITY_GROUPS, CIDRS)
+
+    def test_unknown_peer_fails(self):
+        with self.assertRaisesRegex(ValueError, "unknown peer 'office'"):
+            validate_rules([rule('master', 'office', 'tcp:22')], SECURITY_GROUPS, CIDRS)
+
+    def test_invalid_ports_fail(self):
+        for ports in ('tcp', 'tcp:ssh', 'icmp:8', 'tcp:2380-2379', 'tcp:70000', ''):
+            with self.subTest(ports=ports), self.assertRaisesRegex(ValueError, 'invalid ports'):
+                validate_rules([rule('master', 'worker', ports)], SECURITY_GROUPS, CIDRS)
+
+
+class ApplicableRulesTest(unittest.TestCase):
+    def test_when_conditions_select_rules(self):
+        rules = [
+            rule('master', 'bastion', 'tcp:22'),
+            rule('master', 'workstation', 'tcp:6443', when={'master_lb_type': 'network'}),
+            rule('master', 'vpc', 'tcp:6443', when={'master_lb_type': 'network', 'observability': True}),
+        ]
+        self.assertEqual(applicable_rules(rules, {'master_lb_type': 'classic'}), rules[:1])
+        self.assertEqual(applicable_rules(rules, {'master_lb_type': 'network', 'observability': False}), rules[:2])
+
+
+class CompileRulesTest(unittest.TestCase):
+    def test_all_rule_absorbs_port_rules_of_the_same_peer(self):
+        compiled = compile_rules([
+            rule('master', 'worker', 'all', "ALL: Workers - Masters"),
+            rule('master', 'worker', 'tcp:6443', "kubectl: Workers - Masters"),
+            rule('master', 'bastion', 'tcp:6443', "kubectl: Bastion - Masters"),
+        ], CIDRS)
+        self.assertEqual(compiled['master'], [
+            ('bastion', 'tcp', 6443, 6443, "kubectl: Bastion - Masters"),
+            ('worker', 'all', 0, 65535, "ALL: Workers - Masters"),
+        ])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        compiled = compile_rules([
+            rule('etcd', 'master', 'tcp:2379', "client"),
+            rule('etcd', 'master', 'tcp:2380', "peer"),
+            rule('etcd', 'master', 'tcp:2379-2381', "client"),
+            rule('etcd', 'master', 'tcp:22', "ssh"),
+            rule('etcd', 'master', 'udp:2379', "udp"),
+        ], CIDRS)
+        self.assertEqual(compiled['etcd'], [
+            ('master', 'tcp', 22, 22, "ssh"),
+            ('master', 'tcp', 2379, 2381, "client, peer"),
+            ('master', 'udp', 2379, 2379, "udp"),
+        ])
+
+    def test_cidr_peer_inside_a_wider_cidr_peer_is_dropped(self):
+        compiled = compile_rules([
+            rule('master', 'workstation', 'tcp:6443', "kubectl: Workstation - Masters"),
+            rule('master', 'any', 'tcp:6443', "kubectl: ALL - Masters"),
+            rule('master', 'vpc', 'tcp:22', "SSH: VPC - Masters"),
+        ], CIDRS)
+        self.assertEqual(compiled['master'], [
+            ('any', 'tcp', 6443, 6443, "kubectl: ALL - Masters"),
+            ('vpc', 'tcp', 22, 22, "SSH: VPC - Masters"),
+        ])
+
+    def test_narrower_port_range_of_a_wider_cidr_peer_keeps_the_rule(self):
+        compiled = compile_rules([
+            rule('master', 'vpc', 'tcp:6443-6444'),
+            rule('master', 'any', 'tcp:6443'),
+        ], CIDRS)
+        self.assertEqual([entry[0] for entry in compiled['master']], ['any', 'vpc'])
+
+    def test_security_group_peers_are_never_dropped_for_cidr_peers(self):
+        compiled = compile_rules([
+            rule('master', 'any', 'all'),
+            rule('master', 'worker', 'tcp:6443'),
+        ], CIDRS)
+        self.assertEqual([entry[0] for entry in compiled['master']], ['any', 'worker'])
+
+    def test_long_descriptions_are_truncated(self):
+        descriptions = ['a' * 100, 'b' * 100, 'c' * 100]
+        compiled = compile_rules([
+            rule('master', 'worker', 'tcp:{}'.format(port), description)
+            for port, description in enumerate(descriptions, 1)
+        ], CIDRS)
+        # Merged into one range, the joined descriptions are cut at the EC2 limit
+        self.assertEqual(compiled['master'], [('worker', 'tcp', 1, 3, ', '.join(descriptions)[:255])])
+
+    def test_rule_counts(self):
+        rules = [
+            rule('master', 'worker', 'all'),
+            rule('master', 'worker', 'tcp:6443'),
+            rule('worker', 'master', 'all'),
+        ]
+        self.assertEqual(rule_counts(rules, compile_rules(rules, CIDRS)), {'master': (2, 1), 'worker': (1, 1)})
+
+
+if __name__ == '__main__':
+    unittest.main()